@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Load generator of the rainbow server: simulates clients which send a frame, wait for its action, and send the next
+frame at a fixed rate, then reports the action round trip latency and the CPU usage of the server process.
+Run from Modules/server/rainbow: python load_generator.py --clients 32 --server-pid <pid of main.py>
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+from manage.connection import ACTION_STRUCT, FRAME_HEADER_STRUCT, IMAGE_HEIGHT, IMAGE_WIDTH, LENGTH_STRUCT, \
+    MAGIC_NUMBER
+
+
+class Client(threading.Thread):
+    def __init__(self, index, address, fps, duration, episode_len, timeout):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.__index = index
+        self.__address = address
+        self.__interval = 1. / fps
+        self.__duration = duration
+        self.__episode_len = episode_len
+        self.__timeout = timeout
+
+        self.latencies = []
+        self.timeout_count = 0
+        self.error = None
+
+    def run(self):
+        try:
+            client_socket = socket.create_connection(self.__address)
+            client_socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            client_socket.settimeout(self.__timeout)
+            self._run(client_socket)
+            client_socket.close()
+        except OSError as err:
+            self.error = err
+
+    def _run(self, client_socket):
+        random_state = np.random.RandomState(self.__index)
+        images = random_state.randint(0, 256, (8, IMAGE_WIDTH, IMAGE_HEIGHT)).astype(np.uint8)
+        data_length = FRAME_HEADER_STRUCT.size + images[0].nbytes
+
+        frame_index = 0
+        end_time = time.time() + self.__duration
+        while time.time() < end_time:
+            terminal = 1 if frame_index % self.__episode_len == self.__episode_len - 1 else 0
+            data = LENGTH_STRUCT.pack(data_length) + \
+                FRAME_HEADER_STRUCT.pack(MAGIC_NUMBER, random_state.uniform(-1, 1), terminal, frame_index) + \
+                images[frame_index % len(images)].tobytes()
+
+            send_time = time.time()
+            client_socket.sendall(data)
+            if self._recv_action(client_socket, frame_index):
+                self.latencies.append(time.time() - send_time)
+            else:
+                self.timeout_count += 1
+
+            frame_index += 1
+            sleep_time = send_time + self.__interval - time.time()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+
+    @staticmethod
+    def _recv_action(client_socket, frame_index):
+        # the action of an older frame may arrive after a timeout, skip it
+        while True:
+            try:
+                data = client_socket.recv(ACTION_STRUCT.size, socket.MSG_WAITALL)
+            except socket.timeout:
+                return False
+
+            if len(data) != ACTION_STRUCT.size:
+                raise ConnectionError('server closed the connection')
+
+            magic_number, _, action_frame_index = ACTION_STRUCT.unpack(data)
+            if magic_number != MAGIC_NUMBER:
+                raise ConnectionError('magic number error')
+            if action_frame_index == frame_index:
+                return True
+
+
+def get_cpu_time(pid):
+    """
+    user and system CPU seconds of a process, read from /proc
+    """
+    with open('/proc/{}/stat'.format(pid)) as stat_file:
+        fields = stat_file.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rainbow server load generator')
+    parser.add_argument('--ip', type=str, default='127.0.0.1', help='server ip')
+    parser.add_argument('--port', type=int, default=8888, help='server port')
+    parser.add_argument('--clients', type=int, default=32, help='number of simulated clients')
+    parser.add_argument('--fps', type=float, default=20, help='frames sent per second by each client')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of the load')
+    parser.add_argument('--episode-len', type=int, default=500, help='frames of an episode')
+    parser.add_argument('--timeout', type=float, default=1., help='seconds a client waits for an action')
+    parser.add_argument('--server-pid', type=int, default=None, help='pid of the server, to measure its CPU usage')
+    args = parser.parse_args()
+
+    clients = [Client(index, (args.ip, args.port), args.fps, args.duration, args.episode_len, args.timeout)
+               for index in range(args.clients)]
+
+    start_cpu = get_cpu_time(args.server_pid) if args.server_pid else None
+    start_time = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    cost_time = time.time() - start_time
+
+    latencies = np.array([latency for client in clients for latency in client.latencies]) * 1000
+    timeout_count = sum(client.timeout_count for client in clients)
+    errors = [client.error for client in clients if client.error is not None]
+
+    print('{} clients, {:.0f} fps each, {:.1f} s'.format(args.clients, args.fps, cost_time))
+    print('actions: {} ({:.0f}/s), timeouts: {}, client errors: {}'.format(
+        len(latencies), len(latencies) / cost_time, timeout_count, len(errors)))
+    if len(latencies) > 0:
+        print('round trip latency avg: {:.2f} ms, p50: {:.2f} ms, p99: {:.2f} ms, max: {:.2f} ms'.format(
+            latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 99), latencies.max()))
+    if start_cpu is not None:
+        server_cpu = get_cpu_time(args.server_pid) - start_cpu
+        print('server CPU: {:.2f} s, {:.1f}% of one core'.format(server_cpu, 100 * server_cpu / cost_time))
+
+
+if __name__ == '__main__':
+    main()
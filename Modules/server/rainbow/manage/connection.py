@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import struct
+
+import numpy as np
+
+from log.log import LOG
+
+MAGIC_NUMBER = 967345
+IMAGE_WIDTH = 84
+IMAGE_HEIGHT = 84
+
+# 帧: 4字节数据长度, 数据前16个字节是魔数、补偿信息、是否终止、帧序号，后面是帧数据
+LENGTH_STRUCT = struct.Struct('i')
+FRAME_HEADER_STRUCT = struct.Struct('ifii')
+FRAME_DATA_LENGTH = FRAME_HEADER_STRUCT.size + IMAGE_WIDTH * IMAGE_HEIGHT
+# 操作: 魔数、操作序号、帧序号
+ACTION_STRUCT = struct.Struct('iii')
+
+RECV_SIZE = 65536
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Connection(object):
+    """
+    non-blocking client connection, buffers the partial frames received and the actions not sent yet
+    """
+
+    def __init__(self, client_socket):
+        self.socket = client_socket
+        self.fd = client_socket.fileno()
+        self.worker_index = -1
+        # epoll is armed with EPOLLOUT only when the write buffer is not empty
+        self.want_write = False
+
+        self.__read_buffer = bytearray()
+        self.__write_buffer = bytearray()
+
+    def read_frames(self):
+        """
+        read until the socket would block (edge-triggered), returns the complete frames and whether the peer closed
+        """
+        closed = False
+        while True:
+            try:
+                data = self.socket.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionError as err:
+                LOG.warning('receive data from fd {} failed, err: {}'.format(self.fd, err))
+                closed = True
+                break
+
+            if not data:
+                closed = True
+                break
+            self.__read_buffer += data
+
+        return self._parse_frames(), closed
+
+    def write_action(self, action_index, frame_index):
+        self.__write_buffer += ACTION_STRUCT.pack(MAGIC_NUMBER, action_index, frame_index)
+
+    def flush(self):
+        """
+        send the buffered actions until the socket would block, returns True if the write buffer is empty
+        """
+        while self.__write_buffer:
+            try:
+                sent = self.socket.send(self.__write_buffer)
+            except (BlockingIOError, InterruptedError):
+                return False
+            del self.__write_buffer[:sent]
+        return True
+
+    def _parse_frames(self):
+        frames = []
+        buffer = self.__read_buffer
+        offset = 0
+        while len(buffer) - offset >= LENGTH_STRUCT.size:
+            data_length = LENGTH_STRUCT.unpack_from(buffer, offset)[0]
+            if data_length != FRAME_DATA_LENGTH:
+                raise ProtocolError('invalid data length {}'.format(data_length))
+
+            data_offset = offset + LENGTH_STRUCT.size
+            if len(buffer) - data_offset < data_length:
+                break
+
+            magic_number, reward, terminal, frame_index = FRAME_HEADER_STRUCT.unpack_from(buffer, data_offset)
+            if magic_number != MAGIC_NUMBER:
+                raise ProtocolError('magic number error')
+
+            image = np.frombuffer(buffer, np.uint8, IMAGE_WIDTH * IMAGE_HEIGHT,
+                                  data_offset + FRAME_HEADER_STRUCT.size).reshape((IMAGE_WIDTH, IMAGE_HEIGHT)).copy()
+            frames.append((image, reward, bool(terminal == 1), frame_index))
+            offset = data_offset + data_length
+
+        if offset > 0:
+            del buffer[:offset]
+        return frames
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import queue
+import threading
+import time
+
+import torch
+
+from log.log import LOG
+
+LOG_FREQUENCY = 1000
+WAIT_REQUEST_TIMEOUT = 0.1
+
+
+class InferenceRequest(object):
+    def __init__(self, state):
+        self.state = state
+        self.action_index = None
+        # the exception of the batch inference, raised in the worker thread
+        self.error = None
+        self.submit_time = time.time()
+        self.done = threading.Event()
+
+
+class InferenceBatcher(threading.Thread):
+    """
+    inference batcher, collects the states of all workers within a small time window,
+    predicts their actions with one batched forward pass and scatters the actions back,
+    the weights of the agent are replaced by the ones published to weight queue between batches
+    """
+
+    def __init__(self, agent, max_batch_size, max_wait_ms, weight_queue=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.__agent = agent
+        self.__max_batch_size = max(1, max_batch_size)
+        self.__max_wait = max(0., max_wait_ms / 1000.)
+        self.__request_queue = queue.Queue()
+        self.__weight_queue = weight_queue
+        self.__exited = False
+        self.__weight_version = 0
+
+        self.__batch_count = 0
+        self.__request_count = 0
+        self.__queue_time = 0.
+        self.__max_queue_time = 0.
+        self.__inference_time = 0.
+
+    def act(self, state):
+        """
+        predict the action of a state, called by worker threads, blocks until the batch of the state is predicted
+        """
+        request = InferenceRequest(state)
+        self.__request_queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.action_index
+
+    def stop(self):
+        self.__exited = True
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        LOG.info('inference batcher is running, max batch size: {}, max wait: {} ms'.format(
+            self.__max_batch_size, self.__max_wait * 1000))
+        while not self.__exited:
+            self._sync_weights()
+            batch = self._collect_batch()
+            if batch:
+                self._predict(batch)
+
+    def _sync_weights(self):
+        if self.__weight_queue is None:
+            return
+
+        try:
+            state_dict = self.__weight_queue.get_nowait()
+        except queue.Empty:
+            return
+
+        try:
+            self.__agent.online_net.load_state_dict(state_dict)
+        except Exception as err:
+            LOG.error('load the weights published by the learner failed, err: {}'.format(err))
+            return
+
+        self.__weight_version += 1
+        LOG.debug('inference agent loads weights version {}'.format(self.__weight_version))
+
+    def _collect_batch(self):
+        try:
+            batch = [self.__request_queue.get(timeout=WAIT_REQUEST_TIMEOUT)]
+        except queue.Empty:
+            return None
+
+        # wait the other workers until the batch is full or the first request waits max wait time
+        deadline = batch[0].submit_time + self.__max_wait
+        while len(batch) < self.__max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    batch.append(self.__request_queue.get(timeout=timeout))
+                else:
+                    batch.append(self.__request_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _predict(self, batch):
+        start_time = time.time()
+        try:
+            action_indexes = self.__agent.act_batch(torch.stack([request.state for request in batch], 0))
+        except Exception as err:
+            LOG.error('inference batch of {} states failed, err: {}'.format(len(batch), err))
+            for request in batch:
+                request.error = err
+                request.done.set()
+            return
+        end_time = time.time()
+
+        for request, action_index in zip(batch, action_indexes):
+            request.action_index = action_index
+            request.done.set()
+
+        self._update_metrics(batch, start_time, end_time)
+
+    def _update_metrics(self, batch, start_time, end_time):
+        for request in batch:
+            queue_time = start_time - request.submit_time
+            self.__queue_time += queue_time
+            self.__max_queue_time = max(self.__max_queue_time, queue_time)
+        self.__inference_time += end_time - start_time
+        self.__request_count += len(batch)
+        self.__batch_count += 1
+
+        if self.__batch_count % LOG_FREQUENCY == 0:
+            LOG.info('inference batch fill: {:.2f}/{}, queue time avg: {:.2f} ms, max: {:.2f} ms, '
+                     'inference time avg: {:.2f} ms per batch'.format(
+                         self.__request_count / self.__batch_count, self.__max_batch_size,
+                         1000 * self.__queue_time / self.__request_count, 1000 * self.__max_queue_time,
+                         1000 * self.__inference_time / self.__batch_count))
+            self.__batch_count = 0
+            self.__request_count = 0
+            self.__queue_time = 0.
+            self.__max_queue_time = 0.
+            self.__inference_time = 0.
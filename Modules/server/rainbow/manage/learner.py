@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import queue
+import threading
+import time
+
+import torch.multiprocessing as mp
+
+from log.log import LOG
+
+WAIT_TRANSITION_TIMEOUT = 0.1
+TERMINAL_TRANSITION_TIMEOUT = 1.
+STAT_INTERVAL = 10
+DROP_LOG_FREQUENCY = 100
+# train() takes one transition of each worker a loop, the learner stops taking messages once a worker has this
+# many transitions waiting in the master, so the backlog stays in the bounded transition queue
+MAX_PENDING_TRANSITIONS = 2
+
+# 训练进程的消息类型
+MSG_TRANSITION = 0
+MSG_RELEASE_WORKER = 1
+MSG_EPISODE_BREAK = 2
+
+
+def _publish_weights(master, weight_queue):
+    # only the newest weights are kept in the queue, the tensors are moved to shared memory by the queue.
+    # cpu() returns the live parameter on a CPU device, clone it so the optimizer never updates the published copy
+    state_dict = {key: value.detach().cpu().clone() for key, value in master.rainbow.online_net.state_dict().items()}
+    try:
+        weight_queue.get_nowait()
+    except queue.Empty:
+        pass
+
+    try:
+        weight_queue.put_nowait(state_dict)
+    except queue.Full:
+        LOG.warning('publish weights failed, weight queue full')
+
+
+def _receive_transitions(master, transition_queue, block):
+    # block for the first message if the master has nothing to train, then take the pending ones as fast as
+    # train() consumes them
+    try:
+        message = transition_queue.get(timeout=WAIT_TRANSITION_TIMEOUT) if block else transition_queue.get_nowait()
+    except queue.Empty:
+        return 0
+
+    count = 0
+    while True:
+        msg_type, data = message
+        if msg_type == MSG_TRANSITION:
+            count += 1
+            if master.send_transition(*data) >= MAX_PENDING_TRANSITIONS:
+                return count
+        elif msg_type == MSG_RELEASE_WORKER:
+            master.release_worker(data)
+        elif msg_type == MSG_EPISODE_BREAK:
+            master.end_episode(data)
+
+        try:
+            message = transition_queue.get_nowait()
+        except queue.Empty:
+            return count
+
+
+def _learner_main(transition_queue, weight_queue, exit_event, weight_sync_step, shared_memory):
+    # import in the learner process, so the model and the memories are only created here
+    from manage.master import Master
+
+    master = Master(shared_memory)
+    _publish_weights(master, weight_queue)
+    LOG.info('learner process is running, weight sync step: {}'.format(weight_sync_step))
+
+    trained = False
+    sync_step = 0
+    stat_step = 0
+    stat_time = time.time()
+    try:
+        while not exit_event.is_set():
+            _receive_transitions(master, transition_queue, not trained)
+            trained = master.train()
+
+            train_step = master.get_train_step()
+            if train_step - sync_step >= weight_sync_step:
+                _publish_weights(master, weight_queue)
+                sync_step = train_step
+
+            now = time.time()
+            if now - stat_time >= STAT_INTERVAL:
+                LOG.info('learner runs {:.2f} steps/s at train step {}'.format(
+                    (train_step - stat_step) / (now - stat_time), train_step))
+                stat_step = train_step
+                stat_time = now
+    except Exception as err:
+        # the process exits, the server stops when it finds the learner is not alive
+        LOG.exception('learner process failed, err: {}'.format(err))
+        raise
+    finally:
+        master.save_memory()
+        LOG.info('learner process exit')
+
+
+class LearnerProcess(object):
+    """
+    learner process, trains the model on the transitions sent by the workers, and publishes the weights to
+    the inference agent of the I/O process every weight sync step
+    """
+
+    def __init__(self, weight_sync_step, transition_queue_size, shared_memory=False):
+        # CUDA can not be used in a forked process
+        context = mp.get_context('spawn')
+        self.__transition_queue = context.Queue(maxsize=transition_queue_size)
+        self.__weight_queue = context.Queue(maxsize=1)
+        self.__exit_event = context.Event()
+        self.__process = context.Process(target=_learner_main,
+                                         args=(self.__transition_queue, self.__weight_queue, self.__exit_event,
+                                               weight_sync_step, shared_memory),
+                                         daemon=True)
+        self.__drop_count = 0
+        # send_transition is called by the worker threads, release_worker by the I/O thread
+        self.__lock = threading.Lock()
+        # workers which lost transitions, their episodes are broken before the next transition is sent
+        self.__broken_workers = set()
+        # released workers whose release message did not fit in the queue, sent before any later message
+        self.__pending_releases = list()
+
+    def start(self):
+        self.__process.start()
+        LOG.info('start learner process {}'.format(self.__process.pid))
+
+    def stop(self):
+        self.__exit_event.set()
+        if self.__process.is_alive():
+            self.__process.join()
+        LOG.info('stop learner process')
+
+    def is_alive(self):
+        return self.__process.is_alive()
+
+    def get_weight_queue(self):
+        return self.__weight_queue
+
+    def send_transition(self, index, frame, action_index, reward, done):
+        """
+        send a transition of worker index to the learner process, dropped if the learner falls too far behind.
+        a terminal transition waits for the queue a while before it is dropped. after a drop the episode of the
+        worker is ended in the replay memory before its next transition, so no frames around the lost one are joined
+        """
+        with self.__lock:
+            # the transition of a new worker must not reach the memory of the released worker of the same index
+            if not self._send_pending_releases() and index in self.__pending_releases:
+                self._drop_transition(index)
+                return
+
+            if index in self.__broken_workers:
+                try:
+                    self.__transition_queue.put_nowait((MSG_EPISODE_BREAK, index))
+                except queue.Full:
+                    self._drop_transition(index)
+                    return
+                self.__broken_workers.discard(index)
+
+        try:
+            if done:
+                self.__transition_queue.put((MSG_TRANSITION, (index, frame, action_index, reward, done)),
+                                            timeout=TERMINAL_TRANSITION_TIMEOUT)
+            else:
+                self.__transition_queue.put_nowait((MSG_TRANSITION, (index, frame, action_index, reward, done)))
+        except queue.Full:
+            with self.__lock:
+                self._drop_transition(index)
+
+    def _drop_transition(self, index):
+        self.__broken_workers.add(index)
+        self.__drop_count += 1
+        if self.__drop_count % DROP_LOG_FREQUENCY == 1:
+            LOG.warning('transition queue full, {} transitions dropped'.format(self.__drop_count))
+
+    def release_worker(self, index):
+        """
+        release the replay data of worker index after its client disconnects, never blocks. if the queue is full,
+        the release is sent by a later call of send_transition or retry_release_workers
+        """
+        with self.__lock:
+            # the release ends the episode of the worker
+            self.__broken_workers.discard(index)
+            if index not in self.__pending_releases:
+                self.__pending_releases.append(index)
+            if not self._send_pending_releases():
+                LOG.warning('transition queue full, release of worker {} is pending'.format(index))
+
+    def retry_release_workers(self):
+        """
+        send the pending releases, called periodically by the I/O thread in case no transition is sent
+        """
+        with self.__lock:
+            self._send_pending_releases()
+
+    def _send_pending_releases(self):
+        while self.__pending_releases:
+            try:
+                self.__transition_queue.put_nowait((MSG_RELEASE_WORKER, self.__pending_releases[0]))
+            except queue.Full:
+                return False
+            self.__pending_releases.pop(0)
+        return True
@@ -9,6 +9,7 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
 import argparse
+import os
 import queue
 import time
 import numpy as np
@@ -18,57 +19,157 @@ from log.log import LOG
 from model.agent import Agent
 from model.memory import ReplayMemory
 
-MAX_WORKER_COUNT = 6
 ACTION_SPACE = 3
 LOG_FREQUENCY = 1000
+SHARED_MEMORY_KEY = 'shared'
 
 
 class Master:
     """
     master, train AI model
+    the replay memory of a worker is created with its first transition and released when its client disconnects,
+    or all workers share one replay memory, which stores the episodes of a worker once they finish
     """
 
-    def __init__(self):
-        LOG.info('init master')
+    def __init__(self, shared_memory=False):
+        LOG.info('init master, shared memory: {}'.format(shared_memory))
 
         self.__loop_count = 0
         self.__train_step = 0
 
-        self.__args = self._set_args()
+        self.__args = get_args()
         LOG.info("the args is{}".format(self.__args))
         self.rainbow = Agent(self.__args, ACTION_SPACE)
         self.rainbow.train()
 
-        self.__count_list = list()
-        self.__queue_list = list()
-        self.__memory_list = list()
-        for _ in range(MAX_WORKER_COUNT):
-            self.__count_list.append(0)
-            self.__queue_list.append(queue.Queue())
-            self.__memory_list.append(ReplayMemory(self.__args, self.__args.memory_capacity))
+        # 以worker序号(共享时为SHARED_MEMORY_KEY)为键的回放内存和样本数, 以及worker的transition队列
+        self.__shared_memory = shared_memory
+        self.__count_dict = dict()
+        self.__memory_dict = dict()
+        self.__queue_dict = dict()
+        # 共享回放内存时, 每个worker未结束的episode
+        self.__episode_dict = dict()
+        if self.__shared_memory:
+            self.__create_memory(SHARED_MEMORY_KEY)
 
         self.__priority_weight_increase = (1 - self.__args.priority_weight) / (
                 self.__args.T_max - self.__args.learn_start)
 
-    def send_transition(self, index, state, action_index, reward, done):
-        self.__queue_list[index].put((state, action_index, reward, done))
-        return
+    def send_transition(self, index, frame, action_index, reward, done):
+        """
+        add a transition of worker index, frame is the last uint8 frame of the state the action is predicted on
+        :return: number of transitions of the worker waiting for train
+        """
+        if index not in self.__queue_dict:
+            self.__queue_dict[index] = queue.Queue()
+            if self.__shared_memory:
+                self.__episode_dict[index] = list()
+            else:
+                self.__create_memory(index)
+
+        self.__queue_dict[index].put((frame, action_index, reward, done))
+        return self.__queue_dict[index].qsize()
+
+    def end_episode(self, index):
+        """
+        end the current episode of worker index, after transitions of the worker are lost
+        """
+        if index in self.__queue_dict:
+            self.__queue_dict[index].put(None)
+
+    def release_worker(self, index):
+        """
+        release the replay data of worker index after its client disconnects, the private replay memory is saved
+        on disk if --memory-path is set, and resumed when a worker of the same index is created
+        """
+        if index not in self.__queue_dict:
+            return
+
+        while self.__get_action_data(index):
+            pass
+        del self.__queue_dict[index]
 
+        if self.__shared_memory:
+            # the episode of a disconnected client never ends, terminate it so that the n-step returns
+            # do not run into the next episode in the shared memory
+            self.__end_worker_episode(index)
+            del self.__episode_dict[index]
+        else:
+            # the next client of the same index starts a new episode in the resumed memory
+            self.__memory_dict[index].end_episode()
+            if self.__args.memory_path:
+                self.__memory_dict[index].save()
+            del self.__memory_dict[index]
+            del self.__count_dict[index]
+
+        LOG.info('release worker {}, {} workers left'.format(index, len(self.__queue_dict)))
+
+    def get_train_step(self):
+        return self.__train_step
+
+    def __create_memory(self, key):
+        memory_path = None
+        if self.__args.memory_path:
+            name = key if key == SHARED_MEMORY_KEY else 'worker_{}'.format(key)
+            memory_path = os.path.join(self.__args.memory_path, name)
+        memory = ReplayMemory(self.__args, self.__args.memory_capacity, memory_path)
+        if memory.size() > 0:
+            LOG.info('resume memory of {} from {}, size: {}'.format(key, memory_path, memory.size()))
+
+        self.__count_dict[key] = memory.size()
+        self.__memory_dict[key] = memory
+
+    def __append_episode(self, episode):
+        # 一个episode连续存入共享回放内存, 保证历史帧和n步回报不跨worker
+        memory = self.__memory_dict[SHARED_MEMORY_KEY]
+        for frame, action_index, reward, done in episode:
+            memory.append_frame(frame, action_index, reward, done)
+        self.__count_dict[SHARED_MEMORY_KEY] += len(episode)
+
+    # 取worker的一个transition存入回放内存, 返回存入的回放内存的键
     def __get_action_data(self, idx):
-        while True:
-            if not self.__queue_list[idx].empty():
-                (state, action_index, reward, done) = self.__queue_list[idx].get()
-                self.__memory_list[idx].append(state, action_index, reward, done)
-                self.__count_list[idx] += 1
-                return True
-            return False
+        try:
+            transition = self.__queue_dict[idx].get_nowait()
+        except queue.Empty:
+            return None
+
+        if transition is None:
+            self.__end_worker_episode(idx)
+            return idx if not self.__shared_memory else SHARED_MEMORY_KEY
+
+        (frame, action_index, reward, done) = transition
+        if not self.__shared_memory:
+            self.__memory_dict[idx].append_frame(frame, action_index, reward, done)
+            self.__count_dict[idx] += 1
+            return idx
+
+        episode = self.__episode_dict[idx]
+        episode.append((frame, action_index, reward, done))
+        if done:
+            self.__append_episode(episode)
+            self.__episode_dict[idx] = list()
+        return SHARED_MEMORY_KEY
+
+    # 结束worker未完成的episode, 之后的transition属于新的episode
+    def __end_worker_episode(self, idx):
+        if not self.__shared_memory:
+            self.__memory_dict[idx].end_episode()
+            return
+
+        episode = self.__episode_dict[idx]
+        if episode:
+            frame, action_index, reward, _ = episode[-1]
+            episode[-1] = (frame, action_index, reward, True)
+            self.__append_episode(episode)
+            self.__episode_dict[idx] = list()
 
     def __get_train_data(self):
-        index_list = list()
-        for idx in range(MAX_WORKER_COUNT):
-            if self.__get_action_data(idx) is True:
-                index_list.append(idx)
-        return index_list
+        key_list = list()
+        for idx in list(self.__queue_dict.keys()):
+            key = self.__get_action_data(idx)
+            if key is not None and key not in key_list:
+                key_list.append(key)
+        return key_list
 
     def __save_train_model(self):
         if self.__train_step % 2e4 == 0:
@@ -77,6 +178,19 @@ class Master:
             et = time.time()
             cost_ime = ((et - st) * 1000)
             LOG.info('saving rainbow costs {} ms at train step {}'.format(cost_ime, self.__train_step))
+            self.save_memory()
+
+    def save_memory(self):
+        """
+        checkpoint the replay memories on disk, only valid if --memory-path is set
+        """
+        if not self.__args.memory_path:
+            return
+
+        st = time.time()
+        for memory in self.__memory_dict.values():
+            memory.save()
+        LOG.info('saving memory costs {} ms at train step {}'.format((time.time() - st) * 1000, self.__train_step))
 
     def __print_progress_log(self, start_time):
         if self.__loop_count % LOG_FREQUENCY == 0:
@@ -86,24 +200,24 @@ class Master:
     def train(self):
 
         start_time = time.time()
-        index_list = self.__get_train_data()
+        key_list = self.__get_train_data()
 
-        if len(index_list) == 0:
-            return
+        if len(key_list) == 0:
+            return False
 
         for _ in range(3):
-            i = np.random.randint(len(index_list))
-            idx = index_list[i]
+            i = np.random.randint(len(key_list))
+            key = key_list[i]
 
-            if self.__count_list[idx] >= self.__args.learn_start:
+            if self.__count_dict[key] >= self.__args.learn_start:
 
                 # Anneal importance sampling weight β to 1
-                self.__memory_list[idx].priority_weight = min(
-                    self.__memory_list[idx].priority_weight + self.__priority_weight_increase, 1)
+                self.__memory_dict[key].priority_weight = min(
+                    self.__memory_dict[key].priority_weight + self.__priority_weight_increase, 1)
 
                 if self.__loop_count % self.__args.replay_frequency == 0:
                     start_time = time.time()
-                    self.rainbow.learn(self.__memory_list[idx])  # Train with n-step distributional double-Q learning
+                    self.rainbow.learn(self.__memory_dict[key])  # Train with n-step distributional double-Q learning
                     self.__print_progress_log(start_time)
                     self.__save_train_model()
                     self.__train_step += 1
@@ -119,66 +233,72 @@ class Master:
 
         self.__loop_count += 1
 
-        return
-
-    # pylint: disable=R0201
-    def _set_args(self):
-        parser = argparse.ArgumentParser(description='Rainbow')
-        parser.add_argument('--enable-cuda', action='store_true', help='Enable CUDA')
-        parser.add_argument('--enable-cudnn', action='store_true', help='Enable cuDNN')
-
-        parser.add_argument('--T-max', type=int, default=int(50e6), metavar='STEPS',
-                            help='Number of training steps (4x number of frames)')
-
-        parser.add_argument('--architecture', type=str, default='canonical', choices=['canonical', 'data-efficient'],
-                            metavar='ARCH', help='Network architecture')
-        parser.add_argument('--history-length', type=int, default=4, metavar='T',
-                            help='Number of consecutive states processed')
-        parser.add_argument('--hidden-size', type=int, default=512, metavar='SIZE', help='Network hidden size')
-        parser.add_argument('--noisy-std', type=float, default=0.1, metavar='σ',
-                            help='Initial standard deviation of noisy linear layers')
-        parser.add_argument('--atoms', type=int, default=51, metavar='C', help='Discretised size of value distribution')
-        parser.add_argument('--V-min', type=float, default=-10, metavar='V',
-                            help='Minimum of value distribution support')
-        parser.add_argument('--V-max', type=float, default=10, metavar='V',
-                            help='Maximum of value distribution support')
-
-        parser.add_argument('--model', type=str, metavar='PARAMS', help='Pretrained model (state dict)')
-        parser.add_argument('--memory-capacity', type=int, default=int(40000), metavar='CAPACITY',
-                            help='Experience replay memory capacity')
-        parser.add_argument('--replay-frequency', type=int, default=1, metavar='k',
-                            help='Frequency of sampling from memory')
-        parser.add_argument('--priority-exponent', type=float, default=0.5, metavar='ω',
-                            help='Prioritised experience replay exponent (originally denoted α)')
-        parser.add_argument('--priority-weight', type=float, default=0.4, metavar='β',
-                            help='Initial prioritised experience replay importance sampling weight')
-        parser.add_argument('--multi-step', type=int, default=3, metavar='n',
-                            help='Number of steps for multi-step return')
-        parser.add_argument('--discount', type=float, default=0.99, metavar='γ', help='Discount factor')
-        parser.add_argument('--target-update', type=int, default=int(1e3), metavar='τ',
-                            help='Number of steps after which to update target network')
-        parser.add_argument('--learning-rate', type=float, default=1e-4, metavar='η', help='Learning rate')
-        parser.add_argument('--adam-eps', type=float, default=1.5e-4, metavar='ε', help='Adam epsilon')
-        parser.add_argument('--batch-size', type=int, default=32, metavar='SIZE', help='Batch size')
-        parser.add_argument('--learn-start', type=int, default=int(400), metavar='STEPS',
-                            help='Number of steps before starting training')
-
-        # Setup
-        args = parser.parse_args()
-
-        # set random seed
-        np.random.seed(123)
-        torch.manual_seed(np.random.randint(1, 10000))
-
-        args.enable_cuda = True
-        args.enable_cudnn = True
-
-        # set torch device
-        if torch.cuda.is_available() and args.enable_cuda:
-            args.device = torch.device('cuda')
-            torch.cuda.manual_seed(np.random.randint(1, 10000))
-            torch.backends.cudnn.enabled = args.enable_cudnn
-        else:
-            args.device = torch.device('cpu')
+        return True
 
-        return args
+
+def get_args():
+    """
+    rainbow args, shared by the learner and the inference agent
+    """
+    parser = argparse.ArgumentParser(description='Rainbow')
+    parser.add_argument('--enable-cuda', action='store_true', help='Enable CUDA')
+    parser.add_argument('--enable-cudnn', action='store_true', help='Enable cuDNN')
+
+    parser.add_argument('--T-max', type=int, default=int(50e6), metavar='STEPS',
+                        help='Number of training steps (4x number of frames)')
+
+    parser.add_argument('--architecture', type=str, default='canonical', choices=['canonical', 'data-efficient'],
+                        metavar='ARCH', help='Network architecture')
+    parser.add_argument('--history-length', type=int, default=4, metavar='T',
+                        help='Number of consecutive states processed')
+    parser.add_argument('--hidden-size', type=int, default=512, metavar='SIZE', help='Network hidden size')
+    parser.add_argument('--noisy-std', type=float, default=0.1, metavar='σ',
+                        help='Initial standard deviation of noisy linear layers')
+    parser.add_argument('--atoms', type=int, default=51, metavar='C', help='Discretised size of value distribution')
+    parser.add_argument('--V-min', type=float, default=-10, metavar='V',
+                        help='Minimum of value distribution support')
+    parser.add_argument('--V-max', type=float, default=10, metavar='V',
+                        help='Maximum of value distribution support')
+
+    parser.add_argument('--model', type=str, metavar='PARAMS', help='Pretrained model (state dict)')
+    parser.add_argument('--memory-capacity', type=int, default=int(40000), metavar='CAPACITY',
+                        help='Experience replay memory capacity')
+    parser.add_argument('--memory-path', type=str, default=None, metavar='PATH',
+                        help='Directory of the memmap replay memory, which is resumed on restart; '
+                             'the memory is in process memory if not set')
+    parser.add_argument('--replay-frequency', type=int, default=1, metavar='k',
+                        help='Frequency of sampling from memory')
+    parser.add_argument('--priority-exponent', type=float, default=0.5, metavar='ω',
+                        help='Prioritised experience replay exponent (originally denoted α)')
+    parser.add_argument('--priority-weight', type=float, default=0.4, metavar='β',
+                        help='Initial prioritised experience replay importance sampling weight')
+    parser.add_argument('--multi-step', type=int, default=3, metavar='n',
+                        help='Number of steps for multi-step return')
+    parser.add_argument('--discount', type=float, default=0.99, metavar='γ', help='Discount factor')
+    parser.add_argument('--target-update', type=int, default=int(1e3), metavar='τ',
+                        help='Number of steps after which to update target network')
+    parser.add_argument('--learning-rate', type=float, default=1e-4, metavar='η', help='Learning rate')
+    parser.add_argument('--adam-eps', type=float, default=1.5e-4, metavar='ε', help='Adam epsilon')
+    parser.add_argument('--batch-size', type=int, default=32, metavar='SIZE', help='Batch size')
+    parser.add_argument('--learn-start', type=int, default=int(400), metavar='STEPS',
+                        help='Number of steps before starting training')
+
+    # Setup
+    args = parser.parse_args()
+
+    # set random seed
+    np.random.seed(123)
+    torch.manual_seed(np.random.randint(1, 10000))
+
+    args.enable_cuda = True
+    args.enable_cudnn = True
+
+    # set torch device
+    if torch.cuda.is_available() and args.enable_cuda:
+        args.device = torch.device('cuda')
+        torch.cuda.manual_seed(np.random.randint(1, 10000))
+        torch.backends.cudnn.enabled = args.enable_cudnn
+    else:
+        args.device = torch.device('cpu')
+
+    return args
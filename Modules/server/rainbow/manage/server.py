@@ -10,24 +10,31 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 
 import select
 import socket
-import struct
 import sys
 import threading
 import time
 import os
-import numpy as np
+from collections import OrderedDict, deque
 import configparser
-from manage.master import Master
+from manage.connection import Connection, ProtocolError
+from manage.master import get_args
 from manage.worker import Worker
+from manage.inference_batcher import InferenceBatcher
+from manage.learner import LearnerProcess
+from model.agent import Agent
 from log.log import LOG
 
 sys.path.append('manage')
-MAGIC_NUMBER = 967345
-MAX_WORKER_COUNT = 6
+MAX_CLIENT_COUNT = 6
+WORKER_JOIN_TIMEOUT = 1.
 SERVER_ADDRESS = ('0.0.0.0', 8888)
 ACTION_SPACE = 3
-IMAGE_WIDTH = 84
-IMAGE_HEIGHT = 84
+LATENCY_LOG_FREQUENCY = 5000
+POLL_TIMEOUT = 1.
+
+CLIENT_EVENTS = select.EPOLLIN | select.EPOLLRDHUP | select.EPOLLET
+CLIENT_WRITE_EVENTS = CLIENT_EVENTS | select.EPOLLOUT
+CLIENT_CLOSE_EVENTS = select.EPOLLHUP | select.EPOLLERR
 
 SERVER_CONFIG_FILE = 'cfg/server.ini'
 
@@ -36,46 +43,59 @@ class Server:
     def __init__(self):
         self.__server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.__epoll = select.epoll()
-        self.__fd_to_socket = {}
-        self.__fd_to_worker_index = {}
-        self.__worker_index_to_fd = []
-        self.__worker_threads = []
-
-        self.__master = None
-        self.__workers = []
+        self.__connections = {}
+        self.__worker_index_to_fd = {}
+
+        # worker线程产生操作后写入唤醒管道, 通知epoll线程发送
+        self.__wakeup_read, self.__wakeup_write = os.pipe()
+        self.__action_ready = deque()
+
+        self.__agent = None
+        self.__learner = None
+        self.__batcher = None
+        # 客户端连接时创建worker, 断开时销毁, 以worker序号为键
+        self.__workers = {}
+        self.__worker_threads = {}
+
+        # 每个worker收到帧的时间, 用于统计客户端的往返延迟
+        self.__frame_recv_times = {}
+        self.__latency_count = 0
+        self.__latency_time = 0.
+        self.__max_latency_time = 0.
 
         # 默认值
         self.server_ip = '0.0.0.0'
         self.server_port = 8888
-
-        self.__train_fps = 20
-        self.__train_time = 1.0 / self.__train_fps
-        self.__last_time = None
+        self.max_client_count = MAX_CLIENT_COUNT
+        self.max_batch_size = MAX_CLIENT_COUNT
+        self.max_wait_ms = 2.
+        self.weight_sync_step = 100
+        self.transition_queue_size = 10000
+        self.shared_memory = False
 
     def init(self):
         self._load_server_config()
         self._init_server()
         self._init_master()
-        self._init_worker()
         return True
 
     def run(self):
         self._start_worker()
 
-        self.__last_time = time.time()
+        # the model is trained in the learner process, this process only polls sockets and predicts actions
         while True:
             self._poll_data()
 
-            # control train frequency per second
-            now_time = time.time()
-            if now_time - self.__last_time > self.__train_time:
-                self.__master.train()
-                self.__last_time = now_time
-
-            time.sleep(0.002)
+            # the clients must not be served with frozen weights
+            if not self.__learner.is_alive():
+                LOG.error('learner process exited unexpectedly, stop the server')
+                return
+            self.__learner.retry_release_workers()
 
     def finish(self):
         self._stop_worker()
+        if self.__learner is not None:
+            self.__learner.stop()
         self._finish_server()
         return True
 
@@ -88,9 +108,13 @@ class Server:
         config_address = (self.server_ip, self.server_port)
         self.__server_socket.bind(config_address)
 
-        self.__server_socket.listen(MAX_WORKER_COUNT)
+        self.__server_socket.listen(self.max_client_count)
         self.__server_socket.setblocking(False)
-        self.__epoll.register(self.__server_socket.fileno(), select.EPOLLIN)
+        self.__epoll.register(self.__server_socket.fileno(), select.EPOLLIN | select.EPOLLET)
+
+        os.set_blocking(self.__wakeup_read, False)
+        os.set_blocking(self.__wakeup_write, False)
+        self.__epoll.register(self.__wakeup_read, select.EPOLLIN | select.EPOLLET)
 
         LOG.info('init server successful')
         return True
@@ -99,143 +123,242 @@ class Server:
         """
         Release tcp server and epoll
         """
+        for fd in list(self.__connections.keys()):
+            self._close_client(fd)
+
+        self.__epoll.unregister(self.__wakeup_read)
         self.__epoll.unregister(self.__server_socket.fileno())
         self.__epoll.close()
         self.__server_socket.close()
+        os.close(self.__wakeup_read)
+        os.close(self.__wakeup_write)
 
         LOG.info('finish server successful')
         return
 
     def _init_master(self):
-        self.__master = Master()
+        self.__learner = LearnerProcess(self.weight_sync_step, self.transition_queue_size, self.shared_memory)
+
+        # the inference agent only predicts actions, its weights are published by the learner process
+        self.__agent = Agent(get_args(), ACTION_SPACE)
+        self.__agent.train()
+        self.__batcher = InferenceBatcher(self.__agent, self.max_batch_size, self.max_wait_ms,
+                                          self.__learner.get_weight_queue())
 
         LOG.info('init master successful')
         return
 
-    def _init_worker(self):
-        for worker_index in range(MAX_WORKER_COUNT):
-            worker = Worker(worker_index, self.__master)
-            self.__workers.append(worker)
-            self.__worker_index_to_fd.append(-1)
+    def _start_worker(self):
+        self.__learner.start()
+        self.__batcher.start()
 
-        LOG.info('init {} workers successful'.format(MAX_WORKER_COUNT))
+        LOG.info('start learner and inference batcher successful, max client count: {}'.format(
+            self.max_client_count))
         return
 
-    def _start_worker(self):
+    def _stop_worker(self):
+        for index in list(self.__workers.keys()):
+            self._release_worker(index)
+        # the workers release their replay data when they exit, wait for them before the learner stops
+        for index, thread in self.__worker_threads.items():
+            thread.join(WORKER_JOIN_TIMEOUT)
+            if thread.is_alive():
+                LOG.warning('worker {} does not exit in {} s'.format(index, WORKER_JOIN_TIMEOUT))
+        self.__batcher.stop()
+
+        LOG.info('stop workers successful')
+        return
 
-        for worker in self.__workers:
-            thread = threading.Thread(target=lambda: worker.work())
-            thread.start()
-            self.__worker_threads.append(thread)
+    def _create_worker(self, fd):
+        # the index of a released worker is reused only after its thread exits, which releases its replay data
+        # after the last transition, so the transitions of the new worker never join the old episode
+        for index, thread in list(self.__worker_threads.items()):
+            if index not in self.__workers and not thread.is_alive():
+                del self.__worker_threads[index]
 
-        LOG.info('start {} workers successful'.format(MAX_WORKER_COUNT))
-        return
+        index = 0
+        while index in self.__workers or index in self.__worker_threads:
+            index += 1
 
-    def _stop_worker(self):
-        for thread in self.__worker_threads:
-            thread.join()
+        worker = Worker(index, self.__learner, self.__batcher, self._notify_action)
+        thread = threading.Thread(target=worker.work)
+        thread.daemon = True
+        thread.start()
+
+        self.__workers[index] = worker
+        self.__worker_threads[index] = thread
+        self.__worker_index_to_fd[index] = fd
+        self.__frame_recv_times[index] = OrderedDict()
+
+        LOG.info('assign fd {} to worker {}, {} workers running'.format(fd, index, len(self.__workers)))
+        return index
+
+    def _release_worker(self, index):
+        # 不等待worker退出, worker线程退出时释放其回放数据, 线程退出前该序号不会分配给新的worker
+        worker = self.__workers.pop(index)
+        worker.stop()
+
+        del self.__worker_index_to_fd[index]
+        del self.__frame_recv_times[index]
 
-        LOG.info('stop {} workers successful'.format(MAX_WORKER_COUNT))
+        LOG.info('release worker {}, {} workers running'.format(index, len(self.__workers)))
         return
 
     def _poll_data(self):
-        events = self.__epoll.poll()
+        events = self.__epoll.poll(POLL_TIMEOUT)
         for fd, event in events:
             if fd == self.__server_socket.fileno():
                 self._accept_client()
 
-            elif event & select.EPOLLHUP:
-                self._close_client(fd)
+            elif fd == self.__wakeup_read:
+                self._send_action_info()
 
-            elif event & select.EPOLLIN:
-                frame_info = self._receive_frame_info(fd)
-                if frame_info is not None:
-                    index = self.__fd_to_worker_index[fd]
-                    worker = self.__workers[index]
-                    worker.set_frame_info(frame_info)
+            else:
+                connection = self.__connections.get(fd)
+                if connection is None:
+                    continue
 
-                else:
-                    self._close_client(fd)
+                if event & (select.EPOLLIN | select.EPOLLRDHUP):
+                    if not self._receive_frame_info(connection):
+                        continue
 
-            elif event & select.EPOLLOUT:
-                index = self.__fd_to_worker_index[fd]
-                worker = self.__workers[index]
-                action_info = worker.get_action_info()
-                if action_info is not None:
-                    self._send_action_info(fd, action_info)
+                if event & select.EPOLLOUT:
+                    self._flush_client(connection)
 
+                elif event & CLIENT_CLOSE_EVENTS:
+                    self._close_client(fd)
+
+    # 边缘触发, 接收所有等待的客户端
     def _accept_client(self):
-        client_socket, _ = self.__server_socket.accept()
-        client_socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                client_socket, _ = self.__server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
 
-        fd = client_socket.fileno()
-        self.__epoll.register(fd, select.EPOLLIN | select.EPOLLOUT)
-        self.__fd_to_socket[fd] = client_socket
+            if len(self.__workers) >= self.max_client_count:
+                LOG.warning('reject client {}, {} clients connected'.format(client_socket.fileno(),
+                                                                             len(self.__workers)))
+                client_socket.close()
+                continue
 
-        for index in range(len(self.__workers)):
-            if self.__worker_index_to_fd[index] == -1:
-                self.__worker_index_to_fd[index] = fd
-                self.__fd_to_worker_index[fd] = index
+            client_socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            client_socket.setblocking(False)
 
-                LOG.info('assign fd {} to worker {}'.format(fd, index))
-                break
+            connection = Connection(client_socket)
+            self.__epoll.register(connection.fd, CLIENT_EVENTS)
+            self.__connections[connection.fd] = connection
+            connection.worker_index = self._create_worker(connection.fd)
 
-        LOG.info('accept client {} successful'.format(fd))
-        return
+            LOG.info('accept client {} successful'.format(connection.fd))
 
     # 关闭客户端
     def _close_client(self, fd):
+        connection = self.__connections.pop(fd)
         self.__epoll.unregister(fd)
-        self.__fd_to_socket[fd].close()
-        del self.__fd_to_socket[fd]
+        connection.socket.close()
 
-        index = self.__fd_to_worker_index[fd]
-        self.__worker_index_to_fd[index] = -1
-        del self.__fd_to_worker_index[fd]
+        if connection.worker_index in self.__workers:
+            self._release_worker(connection.worker_index)
 
         LOG.info('close client {} successful'.format(fd))
         return
 
-    # 介绍数据帧
-    def _receive_frame_info(self, fd):
-        client_socket = self.__fd_to_socket[fd]
+    # 接收数据帧, 不完整的帧保留在连接的读缓存中, 客户端关闭时返回False
+    def _receive_frame_info(self, connection):
+        try:
+            frames, closed = connection.read_frames()
+        except ProtocolError as err:
+            LOG.error('receive frame information from fd {} failed, err: {}'.format(connection.fd, err))
+            self._close_client(connection.fd)
+            return False
 
-        header = client_socket.recv(4, socket.MSG_WAITALL)
-        LOG.info("the length of header is {}, header:{}", len(header), header)
+        index = connection.worker_index
+        for frame_info in frames:
+            LOG.debug('receive frame information from fd {}: frame index = {}, reward = {}'.format(
+                connection.fd, frame_info[3], frame_info[1]))
+            self.__frame_recv_times[index][frame_info[3]] = time.time()
+            self.__workers[index].set_frame_info(frame_info)
 
-        if len(header) != 4:
-            LOG.error('header length is not 4')
-            return None
+        if closed:
+            self._close_client(connection.fd)
+            return False
+        return True
+
+    # worker线程调用, 通知epoll线程有操作需要发送
+    def _notify_action(self, index):
+        self.__action_ready.append(index)
+        try:
+            os.write(self.__wakeup_write, b'\0')
+        except BlockingIOError:
+            # 管道已满, epoll线程一定会被唤醒
+            pass
 
-        data_length = struct.unpack('i', header)[0]
-        data_bin = client_socket.recv(data_length, socket.MSG_WAITALL)
-        if len(data_bin) != data_length:
-            LOG.error('the length of dataBin is not equal to data length')
-            return None
+    # 发送操作信息
+    def _send_action_info(self):
+        try:
+            while os.read(self.__wakeup_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.__action_ready:
+            index = self.__action_ready.popleft()
+            worker = self.__workers.get(index)
+            if worker is None:
+                # the worker is released after its client disconnects
+                continue
+            connection = self.__connections.get(self.__worker_index_to_fd[index])
+
+            action_info = worker.get_action_info()
+            while action_info is not None:
+                if connection is not None:
+                    action_index, frame_index = action_info
+                    connection.write_action(action_index, frame_index)
+                    LOG.debug('send action information to fd {}, action index = {}'.format(connection.fd,
+                                                                                            action_index))
+                    self._update_latency(index, frame_index)
+                action_info = worker.get_action_info()
 
-        # 前面16个字节是魔数、补偿信息、是否终止、帧序号，后面是帧数据
-        magic_number, reward, terminal, frame_index = struct.unpack('ifii', data_bin[0:16])
-        if magic_number != MAGIC_NUMBER:
-            LOG.error('magic number error')
-            return None
+            if connection is not None:
+                self._flush_client(connection)
+
+    # 发送写缓存中的操作, 只有写缓存不为空时才监听EPOLLOUT
+    def _flush_client(self, connection):
+        try:
+            flushed = connection.flush()
+        except OSError as err:
+            LOG.warning('send action information to fd {} failed, err: {}'.format(connection.fd, err))
+            self._close_client(connection.fd)
+            return
+
+        if flushed == connection.want_write:
+            connection.want_write = not flushed
+            self.__epoll.modify(connection.fd, CLIENT_WRITE_EVENTS if connection.want_write else CLIENT_EVENTS)
+
+    # 统计从收到帧到发送操作的往返延迟, 不包括训练的耗时
+    def _update_latency(self, index, frame_index):
+        recv_times = self.__frame_recv_times.get(index)
+        if recv_times is None or frame_index not in recv_times:
+            return
+
+        # worker只预测最新的帧, 之前的帧不会再有操作返回
+        while True:
+            recv_frame_index, recv_time = recv_times.popitem(last=False)
+            if recv_frame_index == frame_index:
+                break
 
-        np_array = np.fromstring(data_bin[16:], np.uint8)
-        image = np.reshape(np_array, (IMAGE_WIDTH, IMAGE_HEIGHT))
-        done = bool(terminal == 1)
-        LOG.debug('receive frame information from fd {}: frame index = {}, reward = {}'.format(client_socket.fileno(),
-                                                                                               frame_index, reward))
-        return image, reward, done, frame_index
+        latency_time = time.time() - recv_time
+        self.__latency_time += latency_time
+        self.__max_latency_time = max(self.__max_latency_time, latency_time)
+        self.__latency_count += 1
 
-    # 发送操作信息
-    def _send_action_info(self, fd, action_info):
-        client_socket = self.__fd_to_socket[fd]
-
-        action_index = action_info[0]
-        frame_index = action_info[1]
-        data_bin = struct.pack("iii", MAGIC_NUMBER, action_index, frame_index)
-        client_socket.sendall(data_bin)
-        LOG.debug('send action information to fd {}, action index = {}'.format(fd, action_index))
-        return
+        if self.__latency_count % LATENCY_LOG_FREQUENCY == 0:
+            LOG.info('client round trip latency avg: {:.2f} ms, max: {:.2f} ms'.format(
+                1000 * self.__latency_time / self.__latency_count, 1000 * self.__max_latency_time))
+            self.__latency_count = 0
+            self.__latency_time = 0.
+            self.__max_latency_time = 0.
 
     #  加载服务器的配置, 方便服务器
     def _load_server_config(self):
@@ -253,5 +376,22 @@ class Server:
         # 从配置文件中读取IP和端口
         self.server_ip = server_config.get('SERVER', 'IP', fallback='0.0.0.0')
         self.server_port = server_config.getint('SERVER', 'Port', fallback=8888)
-        LOG.info("the server info as list, ip:{}, port:{}".format(self.server_ip, self.server_port))
+        # 最多连接的客户端数, 每个客户端对应一个worker
+        self.max_client_count = server_config.getint('SERVER', 'MaxClientCount', fallback=MAX_CLIENT_COUNT)
+        LOG.info("the server info as list, ip:{}, port:{}, max client count:{}".format(
+            self.server_ip, self.server_port, self.max_client_count))
+
+        # 推理批处理: 一次前向推理最多的状态数, 以及第一个状态最多等待的时间
+        self.max_batch_size = server_config.getint('INFERENCE', 'MaxBatchSize', fallback=self.max_client_count)
+        self.max_wait_ms = server_config.getfloat('INFERENCE', 'MaxWaitMS', fallback=2.)
+        LOG.info("the inference batch info, max batch size:{}, max wait:{} ms".format(self.max_batch_size,
+                                                                                     self.max_wait_ms))
+
+        # 训练进程: 每训练多少步向推理进程发布一次权重, 以及等待训练的transition队列长度
+        self.weight_sync_step = server_config.getint('LEARNER', 'WeightSyncStep', fallback=100)
+        self.transition_queue_size = server_config.getint('LEARNER', 'TransitionQueueSize', fallback=10000)
+        # 所有worker是否共享一个回放内存
+        self.shared_memory = server_config.getboolean('LEARNER', 'SharedMemory', fallback=False)
+        LOG.info("the learner info, weight sync step:{}, transition queue size:{}, shared memory:{}".format(
+            self.weight_sync_step, self.transition_queue_size, self.shared_memory))
         return True
@@ -10,6 +10,7 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 
 from collections import deque
 from log.log import LOG
+import numpy as np
 import queue
 import time
 import torch
@@ -23,10 +24,12 @@ LOG_FREQUENCY = 5000
 
 
 class Env(object):
-    def __init__(self, index):
+    def __init__(self, index, action_notify=None):
         self.__index = index
         self.__frame_info_queue = queue.Queue()  # 帧队列
         self.__action_info_queue = queue.Queue()  # 操作队列
+        self.__action_notify = action_notify  # 通知server发送操作
+        self.__exited = False
 
     def put_frame_info(self, frame_info):
         self.__frame_info_queue.put(frame_info)
@@ -35,11 +38,16 @@ class Env(object):
     def put_action_info(self, action_index, frame_index):
         action_info = (action_index, frame_index)
         self.__action_info_queue.put(action_info)
+        if self.__action_notify is not None:
+            self.__action_notify(self.__index)
         return
 
+    def stop(self):
+        self.__exited = True
+
     def get_frame_info(self):
         """
-        get newest frame information
+        get newest frame information, None if the env is stopped
         """
 
         prev = self._get_frame_info()
@@ -48,6 +56,8 @@ class Env(object):
             curr = self._get_frame_info()
             if curr is None:
                 if prev is None:
+                    if self.__exited:
+                        return None
                     time.sleep(0.003)
                     continue
                 else:
@@ -80,13 +90,14 @@ class Worker(object):
     worker, predict action
     """
 
-    def __init__(self, index, master):
+    def __init__(self, index, learner, batcher, action_notify=None):
         LOG.info('init worker-{}'.format(index))
 
         self.__index = index
-        self.__master = master
+        self.__learner = learner
+        self.__batcher = batcher
 
-        self.__env = Env(index)
+        self.__env = Env(index, action_notify)
 
         # self.__device = torch.device('cuda')
         self.__device = torch.device('cpu')
@@ -100,6 +111,14 @@ class Worker(object):
     def get_action_info(self):
         return self.__env.get_action_info()
 
+    def stop(self):
+        """
+        stop the worker after its client disconnects, work returns once no frame is left, and releases the replay
+        data of the worker in the learner after its last transition
+        """
+        self.__env.stop()
+        return
+
     def work(self):
         LOG.info('worker-{} is running'.format(self.__index))
         try:
@@ -110,14 +129,19 @@ class Worker(object):
                 for _ in range(HISTORY_LENGTH):
                     buffer.append(torch.zeros(INPUT_WIDTH, INPUT_HEIGHT, device=self.__device))
 
-                image, _, _, frame_index = self.__env.get_frame_info()
+                frame_info = self.__env.get_frame_info()
+                if frame_info is None:
+                    break
+                image, _, _, frame_index = frame_info
+                # the learner only stores the last frame of the state, send it as uint8 to keep the transition small
+                frame = np.asarray(image, dtype=np.uint8)
                 buffer.append(torch.tensor(image, dtype=torch.float32, device=self.__device).div_(255))
                 state = torch.stack(list(buffer), 0)
 
                 while True:
                     start_time = time.time()
                     LOG.info("begin to get action")
-                    action_index = self.__master.rainbow.act(state)
+                    action_index = self.__batcher.act(state)
                     LOG.info("get the action finished, action_index is {}".format(action_index))
 
                     end_time = time.time()
@@ -129,9 +153,14 @@ class Worker(object):
                     self.__env.put_action_info(action_index, frame_index)
 
                     LOG.info("begin to get the frame info")
-                    image, reward, done, frame_index = self.__env.get_frame_info()
+                    frame_info = self.__env.get_frame_info()
+                    if frame_info is None:
+                        LOG.info('worker-{} is stopped'.format(self.__index))
+                        return
+                    image, reward, done, frame_index = frame_info
                     LOG.info("get the frame info finished")
-                    self.__master.send_transition(self.__index, state, action_index, reward, done)
+                    self.__learner.send_transition(self.__index, frame, action_index, reward, done)
+                    frame = np.asarray(image, dtype=np.uint8)
                     buffer.append(torch.tensor(image, dtype=torch.float32, device=self.__device).div_(255))
                     state = torch.stack(list(buffer), 0)
 
@@ -146,4 +175,6 @@ class Worker(object):
             LOG.info('Work execute failed, err:{}'.format(err))
         finally:
             LOG.info('Work execute finally')
+            # released by the worker thread, so no transition of the worker is sent after the release
+            self.__learner.release_worker(self.__index)
         return
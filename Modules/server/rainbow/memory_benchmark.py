@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Sample throughput of the rainbow replay memory, in process memory vs memmap files on disk.
+Run from Modules/server/rainbow: python memory_benchmark.py --path /data/replay
+"""
+
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+
+from model.memory import ReplayMemory, STATE_SHAPE
+
+
+def fill_memory(memory, transition_count, episode_len=500):
+    state = torch.rand(4, *STATE_SHAPE)
+    for step in range(transition_count):
+        memory.append(state, step % 3, np.random.uniform(-1, 1), step % episode_len == episode_len - 1)
+
+
+def run_benchmark(memory, batch_size, batch_count):
+    memory.sample(batch_size)
+    start_time = time.time()
+    for _ in range(batch_count):
+        memory.sample(batch_size)
+    return batch_size * batch_count / (time.time() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rainbow replay memory benchmark')
+    parser.add_argument('--path', type=str, default='./replay_benchmark', help='directory of the memmap files')
+    parser.add_argument('--capacity', type=int, default=int(1e6), help='replay memory capacity')
+    parser.add_argument('--transitions', type=int, default=50000, help='transitions appended before sampling')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size')
+    parser.add_argument('--batches', type=int, default=200, help='number of sampled batches')
+    args = parser.parse_args()
+
+    memory_args = argparse.Namespace(device=torch.device('cpu'), history_length=4, discount=0.99, multi_step=3,
+                                     priority_weight=0.4, priority_exponent=0.5)
+    memory_path = os.path.join(args.path, 'rainbow')
+    shutil.rmtree(memory_path, ignore_errors=True)
+
+    np.random.seed(0)
+    ram_memory = ReplayMemory(memory_args, args.capacity)
+    fill_memory(ram_memory, args.transitions)
+    ram_speed = run_benchmark(ram_memory, args.batch_size, args.batches)
+    del ram_memory
+
+    disk_memory = ReplayMemory(memory_args, args.capacity, memory_path)
+    fill_memory(disk_memory, args.transitions)
+    disk_speed = run_benchmark(disk_memory, args.batch_size, args.batches)
+    disk_memory.save()
+    del disk_memory
+
+    start_time = time.time()
+    resume_memory = ReplayMemory(memory_args, args.capacity, memory_path)
+    resume_ms = 1000 * (time.time() - start_time)
+    resume_speed = run_benchmark(resume_memory, args.batch_size, args.batches)
+
+    print('ram memory: {:.0f} samples/s'.format(ram_speed))
+    print('memmap memory: {:.0f} samples/s'.format(disk_speed))
+    print('memmap memory resumed in {:.2f} ms, size: {}, {:.0f} samples/s'.format(
+        resume_ms, resume_memory.size(), resume_speed))
+
+
+if __name__ == '__main__':
+    main()
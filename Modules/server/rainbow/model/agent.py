@@ -67,6 +67,12 @@ class Agent:
         with torch.no_grad():
             return (self.online_net(state.unsqueeze(0)) * self.support).sum(2).argmax(1).item()
 
+    # Acts based on a batch of states, returns the action index list
+    def act_batch(self, states):
+        with torch.no_grad():
+            states = states.to(device=self.args.device)
+            return (self.online_net(states) * self.support).sum(2).argmax(1).tolist()
+
     # Acts with an ε-greedy policy (used for evaluation only)
     def act_e_greedy(self, state, epsilon=0.001):  # High ε can reduce evaluation scores drastically
         return np.random.randint(0, self.action_space) if np.random.random() < epsilon else self.act(state)
@@ -10,76 +10,148 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 
 from __future__ import division
 from collections import namedtuple
+import json
+import os
 import numpy as np
 import torch
 
 Transition = namedtuple('Transition', ('timestep', 'state', 'action', 'reward', 'nonterminal'))
-blank_trans = Transition(0, torch.zeros(84, 84, dtype=torch.uint8), None, 0, False)
+STATE_SHAPE = (84, 84)
+blank_trans = Transition(0, torch.zeros(*STATE_SHAPE, dtype=torch.uint8), None, 0, False)
+
+MEMORY_META_FILE = 'meta.json'
+
+
+# Array in process memory, or np.memmap file in memory_path if memory_path is set
+def _create_array(memory_path, name, shape, dtype, resume=False):
+    if memory_path is None:
+        return np.zeros(shape, dtype=dtype)
+
+    file_name = os.path.join(memory_path, name + '.dat')
+    return np.memmap(file_name, dtype=dtype, mode='r+' if resume else 'w+', shape=shape)
 
 
 # Segment tree data structure where parent node values are sum/max of children node values
 class SegmentTree:
-    def __init__(self, size):
+    def __init__(self, size, memory_path=None, resume=False):
         self.index = 0
         self.size = size  # 40000
         self.full = False  # Used to track actual capacity
-        self.sum_tree = np.zeros((2 * size - 1,),
-                                 dtype=np.float32)  # Initialise fixed size tree with all (priority) zeros
-        self.data = np.array([None] * size)  # Wrap-around cyclic buffer
+        # Initialise fixed size tree with all (priority) zeros
+        self.sum_tree = _create_array(memory_path, 'sum_tree', (2 * size - 1,), np.float32, resume)
+        # Wrap-around cyclic buffer, one array per field of the transition
+        self.timesteps = _create_array(memory_path, 'timestep', (size,), np.int64, resume)
+        self.states = _create_array(memory_path, 'state', (size,) + STATE_SHAPE, np.uint8, resume)
+        self.actions = _create_array(memory_path, 'action', (size,), np.int64, resume)
+        self.rewards = _create_array(memory_path, 'reward', (size,), np.float32, resume)
+        self.nonterminals = _create_array(memory_path, 'nonterminal', (size,), np.bool_, resume)
         self.max = 1  # Initial max value to return (1 = 1^ω)
 
-    # Propagates value up tree given a tree index
-    def _propagate(self, index, value):
-        parent = (index - 1) // 2
-        left, right = 2 * parent + 1, 2 * parent + 2
-        self.sum_tree[parent] = self.sum_tree[left] + self.sum_tree[right]
-        if parent != 0:
-            self._propagate(parent, value)
+    # Propagates value up tree given a tree index, one loop iteration per tree level
+    def _propagate(self, index):
+        while index != 0:
+            index = (index - 1) // 2
+            self.sum_tree[index] = self.sum_tree[2 * index + 1] + self.sum_tree[2 * index + 2]
+
+    # Propagates values up tree given tree indexes, level by level; with a size not power of 2 the leaves
+    # are on two levels, a node may be updated more than once, but always after its children.
+    # Duplicated indexes are not removed, they are set to the same sum
+    def _propagate_batch(self, indexes):
+        while True:
+            indexes = indexes[indexes != 0]
+            if len(indexes) == 0:
+                return
+            indexes = (indexes - 1) // 2
+            self.sum_tree[indexes] = self.sum_tree[2 * indexes + 1] + self.sum_tree[2 * indexes + 2]
 
     # Updates value given a tree index
     def update(self, index, value):
         self.sum_tree[index] = value  # Set new value
-        self._propagate(index, value)  # Propagate value
+        self._propagate(index)  # Propagate value
         self.max = max(value, self.max)
 
+    # Updates values given tree indexes
+    def update_batch(self, indexes, values):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        if len(indexes) == 0:
+            return
+
+        self.sum_tree[indexes] = values  # Set new values, the last one wins for duplicated indexes
+        self._propagate_batch(indexes)
+        self.max = max(float(values.max()), self.max)
+
     def append(self, data, value):
 
         # 开始的值设置为index
-        self.data[self.index] = data  # Store data in underlying data structure
+        # Store data in underlying data structure
+        self.timesteps[self.index] = data.timestep
+        self.states[self.index] = np.asarray(data.state)
+        self.actions[self.index] = data.action
+        self.rewards[self.index] = data.reward
+        self.nonterminals[self.index] = data.nonterminal
         self.update(self.index + self.size - 1, value)  # Update tree
 
         self.index = (self.index + 1) % self.size  # Update index
         self.full = self.full or self.index == 0  # Save when capacity reached
         self.max = max(value, self.max)
 
-    # Searches for the location of a value in sum tree
-    def _retrieve(self, index, value):
-        left, right = 2 * index + 1, 2 * index + 2
-
-        if left >= len(self.sum_tree):
-            return index
-
-        if value <= self.sum_tree[left]:
-            return self._retrieve(left, value)
-
-        return self._retrieve(right, value - self.sum_tree[left])
+    # Searches for the locations of values in sum tree, all values descend one tree level per loop iteration
+    def _retrieve_batch(self, values):
+        values = np.array(values, dtype=np.float64)
+        indexes = np.zeros(len(values), dtype=np.int64)
+
+        # the nodes above the last two levels are never leaves, descend them without masks
+        for _ in range(int(np.log2(self.size + 1)) - 1):
+            lefts = 2 * indexes + 1
+            left_values = self.sum_tree[lefts]
+            go_right = values > left_values
+            indexes = lefts + go_right
+            values -= left_values * go_right
+
+        tree_len = len(self.sum_tree)
+        while True:
+            lefts = 2 * indexes + 1
+            not_leaf = lefts < tree_len
+            if not not_leaf.any():
+                return indexes
+
+            lefts = lefts[not_leaf]
+            left_values = self.sum_tree[lefts]
+            go_right = values[not_leaf] > left_values
+            indexes[not_leaf] = lefts + go_right
+            values[not_leaf] -= np.where(go_right, left_values, 0)
 
     # Searches for a value in sum tree and returns value, data index and tree index
     def find(self, value):
-        index = self._retrieve(0, value)  # Search for index of item from root
-        data_index = index - self.size + 1
-        return (self.sum_tree[index], data_index, index)  # Return value, data index, tree index
+        values, data_indexes, indexes = self.find_batch([value])
+        return (values[0], data_indexes[0], indexes[0])  # Return value, data index, tree index
+
+    # Searches for values in sum tree and returns values, data indexes and tree indexes arrays
+    def find_batch(self, values):
+        indexes = self._retrieve_batch(values)  # Search for indexes of items from root
+        return self.sum_tree[indexes], indexes - self.size + 1, indexes
 
     # Returns data given a data index
     def get(self, data_index):
-        return self.data[data_index % self.size]
+        index = data_index % self.size
+        return Transition(int(self.timesteps[index]), torch.from_numpy(np.array(self.states[index])),
+                          int(self.actions[index]), float(self.rewards[index]), bool(self.nonterminals[index]))
 
     def total(self):
         return self.sum_tree[0]
 
+    # Flush the memmap files
+    def flush(self):
+        for array in (self.sum_tree, self.timesteps, self.states, self.actions, self.rewards, self.nonterminals):
+            if isinstance(array, np.memmap):
+                array.flush()
+
 
 class ReplayMemory:
-    def __init__(self, args, capacity):
+    # If memory_path is set, the transitions and priorities are np.memmap files in memory_path,
+    # and the memory is resumed from the last checkpoint saved by save()
+    def __init__(self, args, capacity, memory_path=None):
         self.device = args.device
         self.capacity = capacity  # 40000
         self.history = args.history_length  # 4
@@ -89,72 +161,120 @@ class ReplayMemory:
         self.priority_weight = args.priority_weight
         self.priority_exponent = args.priority_exponent  # 0.5
         self.t = 0  # Internal episode timestep counter
-        self.transitions = SegmentTree(
-            capacity)  # Store transitions in a wrap-around cyclic buffer within a sum tree for querying priorities
+        self.memory_path = memory_path
+
+        meta = self._load_meta()
+        # Store transitions in a wrap-around cyclic buffer within a sum tree for querying priorities
+        self.transitions = SegmentTree(capacity, memory_path, resume=meta is not None)
+        if meta is not None:
+            self.transitions.index = meta['index']
+            self.transitions.full = meta['full']
+            self.transitions.max = meta['max']
+            self.t = meta['t']
+            self.priority_weight = meta['priority_weight']
+
+    def _load_meta(self):
+        if self.memory_path is None:
+            return None
+
+        if not os.path.exists(self.memory_path):
+            os.makedirs(self.memory_path)
+
+        meta_file = os.path.join(self.memory_path, MEMORY_META_FILE)
+        if not os.path.exists(meta_file):
+            return None
+
+        with open(meta_file, 'r') as file:
+            meta = json.load(file)
+        # A memory of another capacity can not be resumed, create a new one
+        if meta.get('capacity') != self.capacity:
+            return None
+        return meta
+
+    # Checkpoint the buffer indexes and priorities, only valid if memory_path is set
+    def save(self):
+        if self.memory_path is None:
+            return False
+
+        self.transitions.flush()
+        meta = {'capacity': self.capacity,
+                'index': self.transitions.index,
+                'full': self.transitions.full,
+                'max': float(self.transitions.max),
+                't': self.t,
+                'priority_weight': self.priority_weight}
+        meta_file = os.path.join(self.memory_path, MEMORY_META_FILE)
+        with open(meta_file + '.tmp', 'w') as file:
+            json.dump(meta, file)
+        os.replace(meta_file + '.tmp', meta_file)
+        return True
+
+    # Number of transitions in memory
+    def size(self):
+        return self.capacity if self.transitions.full else self.transitions.index
 
     # Adds state and action at time t, reward and terminal at time t + 1
     def append(self, state, action, reward, terminal):
         state = state[-1].mul(255).to(dtype=torch.uint8,
                                       device=torch.device('cpu'))  # Only store last frame and discretise to save memory
-        self.transitions.append(Transition(self.t, state, action, reward, not terminal),
+        self.append_frame(state, action, reward, terminal)
+
+    # Adds the last frame (uint8) of state and action at time t, reward and terminal at time t + 1
+    def append_frame(self, frame, action, reward, terminal):
+        self.transitions.append(Transition(self.t, frame, action, reward, not terminal),
                                 self.transitions.max)  # Store new transition with maximum priority
         self.t = 0 if terminal else self.t + 1  # Start new episodes with t = 0
 
-    # Returns a transition with blank states where appropriate
-    def _get_transition(self, idx):
-        transition = np.array([None] * (self.history + self.n))  # 数组为7的列表
-        transition[self.history - 1] = self.transitions.get(idx)
-        for t in range(self.history - 2, -1, -1):  # e.g. 2 1 0
-            if transition[t + 1].timestep == 0:
-                transition[t] = blank_trans  # If future frame has timestep 0
-            else:
-                transition[t] = self.transitions.get(idx - self.history + 1 + t)
-
-        for t in range(self.history, self.history + self.n):  # e.g. 4 5 6
-            if transition[t - 1].nonterminal:
-                transition[t] = self.transitions.get(idx - self.history + 1 + t)
-            else:
-                transition[t] = blank_trans  # If prev (next) frame is terminal
-        return transition
-
-    # Returns a valid sample from a segment
-    def _get_sample_from_segment(self, segment, i):
-        valid = False
-        while not valid:
-
+    # Terminates the current episode, the last transition becomes terminal and the next one starts a new episode
+    def end_episode(self):
+        if self.t == 0:
+            return
+        self.transitions.nonterminals[(self.transitions.index - 1) % self.capacity] = False
+        self.t = 0
+
+    # Returns the transitions of the whole batch (from t - h to t + n), blank transitions where appropriate
+    # are masked out: zero frame, zero reward and terminal
+    def _get_transitions(self, idxs):
+        # (batch_size, h + n) transition indexes, column h - 1 is the sampled transition
+        transition_idxs = (idxs[:, np.newaxis] + np.arange(-self.history + 1, self.n + 1)) % self.capacity
+        timesteps = self.transitions.timesteps[transition_idxs]
+        nonterminals = self.transitions.nonterminals[transition_idxs]
+
+        # A history frame is blank if any future frame up to the sampled one has timestep 0
+        history_blank = np.flip(np.logical_or.accumulate(np.flip(timesteps[:, 1:self.history] == 0, 1), 1), 1)
+        # A n-step frame is blank if any previous frame from the sampled one is terminal
+        future_blank = np.logical_or.accumulate(~nonterminals[:, self.history - 1:-1], 1)
+        valid = np.concatenate((~history_blank, np.ones((len(idxs), 1), dtype=np.bool_), ~future_blank), 1)
+
+        # 历史数据的图片值和将来数据的图片值, gathered by one fancy indexing
+        frames = np.asarray(self.transitions.states[transition_idxs])
+        frames[~valid] = 0
+        rewards = self.transitions.rewards[transition_idxs] * valid
+        nonterminals &= valid
+        return frames, rewards, nonterminals
+
+    # Returns valid samples, one from each segment
+    def _get_samples_from_segments(self, segment, batch_size):
+        probs = np.zeros(batch_size, dtype=np.float32)
+        idxs = np.zeros(batch_size, dtype=np.int64)
+        tree_idxs = np.zeros(batch_size, dtype=np.int64)
+        invalid = np.arange(batch_size)
+        while len(invalid) > 0:
             # 从片段中随机获取一个值
-            sample = np.random.uniform(i * segment,
-                                       (i + 1) * segment)  # Uniformly sample an element from within a segment
+            # Uniformly sample an element from within each segment
+            samples = np.random.uniform(invalid * segment, (invalid + 1) * segment)
 
             # value, 数组索引，数的索引值
-            prob, idx, tree_idx = self.transitions.find(
-                sample)  # Retrieve sample from tree with un-normalised probability
+            # Retrieve samples from tree with un-normalised probability
+            probs[invalid], idxs[invalid], tree_idxs[invalid] = self.transitions.find_batch(samples)
 
             # Resample if transition straddled current index or probablity 0
-            if (self.transitions.index - idx) % self.capacity > self.n and (
-                    idx - self.transitions.index) % self.capacity >= self.history and prob != 0:
-                valid = True  # Note that conditions are valid but extra conservative around buffer index 0
-
-        # Retrieve all required transition data (from t - h to t + n)
-        transition = self._get_transition(idx)  # 供7个数
-
-        # Create un-discretised state and nth next state
-        # 历史数据的图片值和将来数据的图片值
-        state = torch.stack([trans.state for trans in transition[:self.history]]).to(device=self.device).to(
-            dtype=torch.float32).div_(255)
-        next_state = torch.stack([trans.state for trans in transition[self.n:self.n + self.history]]).to(
-            device=self.device).to(dtype=torch.float32).div_(255)
-
-        # Discrete action to be used as index， 获取当前操作
-        action = torch.tensor([transition[self.history - 1].action], dtype=torch.int64, device=self.device)
-
-        r = torch.tensor([sum(self.discount ** n * transition[self.history + n - 1].reward for n in range(self.n))],
-                         dtype=torch.float32, device=self.device)
-        # Mask for non-terminal nth next states
-        nonterminal = torch.tensor([transition[self.history + self.n - 1].nonterminal], dtype=torch.float32,
-                                   device=self.device)
-
-        return prob, idx, tree_idx, state, action, r, next_state, nonterminal
+            # Note that conditions are valid but extra conservative around buffer index 0
+            valid = ((self.transitions.index - idxs[invalid]) % self.capacity > self.n) & \
+                    ((idxs[invalid] - self.transitions.index) % self.capacity >= self.history) & \
+                    (probs[invalid] != 0)
+            invalid = invalid[~valid]
+        return probs, idxs, tree_idxs
 
     # 数据采样
     def sample(self, batch_size):
@@ -167,16 +287,30 @@ class ReplayMemory:
         segment = p_total / batch_size  # Batch size number of segments, based on sum over all probabilities
 
         # 获取的样本数组，从每个片段获取一个值
-        batch = [self._get_sample_from_segment(segment, i) for i in range(batch_size)]  # Get batch of valid samples
+        # value, 数组索引，数索引
+        probs, idxs, tree_idxs = self._get_samples_from_segments(segment, batch_size)  # Get batch of valid samples
 
-        # [value, 数组索引，数索引， 当前状态， 操作， reward, 下个状态， 是否终止] 列表
-        probs, _, tree_idxs, states, actions, returns, next_states, nonterminals = zip(*batch)
+        # Retrieve all required transition data (from t - h to t + n) of the batch
+        frames, rewards, nonterminals = self._get_transitions(idxs)
 
-        states, next_states, = torch.stack(states), torch.stack(next_states)
+        # Create un-discretised state and nth next state, frames are moved to device before converted to float
+        frames = torch.from_numpy(frames).to(device=self.device)
+        states = frames[:, :self.history].to(dtype=torch.float32).div_(255)
+        next_states = frames[:, self.n:self.n + self.history].to(dtype=torch.float32).div_(255)
 
-        actions, returns, nonterminals = torch.cat(actions), torch.cat(returns), torch.stack(nonterminals)
+        # Discrete action to be used as index， 获取当前操作
+        actions = torch.from_numpy(self.transitions.actions[idxs].astype(np.int64)).to(device=self.device)
+
+        # n-step discounted return from the sampled transition
+        discounts = self.discount ** np.arange(self.n)
+        returns = np.sum(rewards[:, self.history - 1:self.history - 1 + self.n] * discounts, 1)
+        returns = torch.tensor(returns, dtype=torch.float32, device=self.device)
+
+        # Mask for non-terminal nth next states
+        nonterminals = torch.tensor(nonterminals[:, self.history + self.n - 1:], dtype=torch.float32,
+                                    device=self.device)
 
-        probs = np.array(probs, dtype=np.float32) / p_total  # Calculate normalised probabilities 概率值数组
+        probs = probs / p_total  # Calculate normalised probabilities 概率值数组
         capacity = self.capacity if self.transitions.full else self.transitions.index
         weights = (capacity * probs) ** -self.priority_weight  # Compute importance-sampling weights w
 
@@ -188,8 +322,8 @@ class ReplayMemory:
     def update_priorities(self, idxs, priorities):
         priorities = np.power(priorities, self.priority_exponent)  # 用损失函数作为优先级
 
-        # 遍历id和其损失函数值
-        [self.transitions.update(idx, priority) for idx, priority in zip(idxs, priorities)]
+        # id和其损失函数值
+        self.transitions.update_batch(idxs, priorities)
 
     # Set up internal state for iterator
     def __iter__(self):
@@ -202,13 +336,13 @@ class ReplayMemory:
             raise StopIteration
         # Create stack of states
         state_stack = [None] * self.history
-        state_stack[-1] = self.transitions.data[self.current_idx].state
-        prev_timestep = self.transitions.data[self.current_idx].timestep
+        state_stack[-1] = self.transitions.get(self.current_idx).state
+        prev_timestep = self.transitions.get(self.current_idx).timestep
         for t in reversed(range(self.history - 1)):
             if prev_timestep == 0:
                 state_stack[t] = blank_trans.state  # If future frame has timestep 0
             else:
-                state_stack[t] = self.transitions.data[self.current_idx + t - self.history + 1].state
+                state_stack[t] = self.transitions.get(self.current_idx + t - self.history + 1).state
                 prev_timestep -= 1
         # Agent will turn into batch
         state = torch.stack(state_stack, 0).to(dtype=torch.float32, device=self.device).div_(255)
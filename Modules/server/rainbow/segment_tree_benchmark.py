@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Prioritized sampling throughput of the segment tree: per element recursive find/update (the implementation
+before batching) vs find_batch/update_batch.
+Run from Modules/server/rainbow: python segment_tree_benchmark.py
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from model.memory import SegmentTree
+
+
+def _legacy_propagate(tree, index):
+    parent = (index - 1) // 2
+    tree.sum_tree[parent] = tree.sum_tree[2 * parent + 1] + tree.sum_tree[2 * parent + 2]
+    if parent != 0:
+        _legacy_propagate(tree, parent)
+
+
+def _legacy_update(tree, index, value):
+    tree.sum_tree[index] = value
+    _legacy_propagate(tree, index)
+    tree.max = max(value, tree.max)
+
+
+def _legacy_retrieve(tree, index, value):
+    left, right = 2 * index + 1, 2 * index + 2
+    if left >= len(tree.sum_tree):
+        return index
+    if value <= tree.sum_tree[left]:
+        return _legacy_retrieve(tree, left, value)
+    return _legacy_retrieve(tree, right, value - tree.sum_tree[left])
+
+
+def legacy_step(tree, batch_size, priorities):
+    segment = tree.total() / batch_size
+    tree_idxs = [_legacy_retrieve(tree, 0, np.random.uniform(i * segment, (i + 1) * segment))
+                 for i in range(batch_size)]
+    [_legacy_update(tree, idx, priority) for idx, priority in zip(tree_idxs, priorities)]
+
+
+def batch_step(tree, batch_size, priorities):
+    segment = tree.total() / batch_size
+    samples = np.random.uniform(np.arange(batch_size) * segment, np.arange(1, batch_size + 1) * segment)
+    _, _, tree_idxs = tree.find_batch(samples)
+    tree.update_batch(tree_idxs, priorities)
+
+
+def run_benchmark(step_func, tree, batch_size, batch_count):
+    priorities = np.random.uniform(0.1, 2, (batch_count, batch_size)).astype(np.float32)
+    start_time = time.time()
+    for batch in range(batch_count):
+        step_func(tree, batch_size, priorities[batch])
+    return batch_size * batch_count / (time.time() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='segment tree benchmark')
+    parser.add_argument('--capacity', type=int, default=int(1e6), help='segment tree capacity')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size')
+    parser.add_argument('--batches', type=int, default=2000, help='number of sampled batches')
+    args = parser.parse_args()
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 1000))
+    np.random.seed(0)
+    # the transitions of 1M capacity do not fit in memory of most nodes, keep them in sparse memmap files
+    with tempfile.TemporaryDirectory() as memory_path:
+        tree = SegmentTree(args.capacity, memory_path)
+        tree.update_batch(np.arange(args.capacity) + args.capacity - 1,
+                          np.random.uniform(0.1, 2, args.capacity).astype(np.float32))
+
+        legacy_speed = run_benchmark(legacy_step, tree, args.batch_size, args.batches)
+        batch_speed = run_benchmark(batch_step, tree, args.batch_size, args.batches)
+        del tree
+
+    print('capacity {}, batch size {}'.format(args.capacity, args.batch_size))
+    print('legacy find/update: {:.0f} samples/s'.format(legacy_speed))
+    print('find_batch/update_batch: {:.0f} samples/s'.format(batch_speed))
+    print('speedup: {:.2f}x'.format(batch_speed / legacy_speed))
+
+
+if __name__ == '__main__':
+    main()
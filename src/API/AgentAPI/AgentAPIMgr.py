@@ -18,7 +18,7 @@ import sys
 from util.config_path_mgr import SYS_CONFIG_DIR
 
 from .AgentMsgMgr import MsgMgr, MSG_SEND_TASK_CONF, MSG_SEND_GROUP_ID, MSG_SEND_TASK_FLAG, MSG_SEND_ADD_TASK, \
-    MSG_SEND_DEL_TASK, MSG_SEND_CHG_TASK
+    MSG_SEND_DEL_TASK, MSG_SEND_CHG_TASK, RESULT_FORMAT_DICT, RESULT_FORMAT_ARRAY
 
 LOG = logging.getLogger('agent')
 
@@ -60,16 +60,20 @@ class AgentAPIMgr(object):
         self.__debug = False
 
     def Initialize(self, confFile, referFile=None, index=1, selfAddr=None,
-                   cfgPath=None):
+                   cfgPath=None, resultFormat=RESULT_FORMAT_DICT):
         """
         Initialize:
         Initialize MsgMgr object,
         load and send task configure file,
         refer configure file
+        resultFormat: RESULT_FORMAT_DICT or RESULT_FORMAT_ARRAY(numpy structured arrays)
         """
         if cfgPath is None:
             cfgPath = os.path.join(SYS_CONFIG_DIR, TBUS_CFG_PATH)
-        self.__msgMgr = MsgMgr(cfgPath, index)
+        if resultFormat not in (RESULT_FORMAT_DICT, RESULT_FORMAT_ARRAY):
+            LOG.error('input result format [%s] invalid, please check', resultFormat)
+            return False
+        self.__msgMgr = MsgMgr(cfgPath, index, resultFormat)
         self._Register()
         self._ParseArg()
 
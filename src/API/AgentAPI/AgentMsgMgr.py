@@ -11,10 +11,14 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 import configparser
 import logging
 import os
+import time
 
 import numpy as np
 import tbus
 
+from .ArrayResult import ARRAY_UNSERIAL_HANDLE_DICT, PointsToArray
+from .FrameTrace import FrameTrace, TRACE_STAGE_REG_RESULT
+from .LazyResult import LazyResultDict
 from .protocol import common_pb2
 from .protocol import gameregProtoc_pb2
 
@@ -40,6 +44,14 @@ MSG_REGER_MULTCOLORVAR_TYPE = 'multcolorvar'
 MSG_REGER_SHOOTGAMEBLOOD_TYPE = 'shoot game blood'
 MSG_REGER_SHOOTGAMEHURT_TYPE = 'shoot game hurt'
 
+# format of the recognize results, 'dict' for one dict per element/box/point,
+# 'array' for numpy structured arrays, see ArrayResult.py
+RESULT_FORMAT_DICT = 'dict'
+RESULT_FORMAT_ARRAY = 'array'
+
+# dtype of the points in pixel result, a point is read as point['x'], point['y'] like a dict
+POINT_DTYPE = np.dtype([('x', np.int32), ('y', np.int32)])
+
 LOG = logging.getLogger('agent')
 
 
@@ -47,15 +59,18 @@ class MsgMgr(object):
     """
     message manager implement
     """
-    def __init__(self, cfgPath='../cfg/bus.ini', index=1):
+    def __init__(self, cfgPath='../cfg/bus.ini', index=1, resultFormat=RESULT_FORMAT_DICT):
         self.__selfAddr = None
         self.__gameRegAddr = None
         self.__sdkToolAddr = None
+        self.__mcAddr = None
         self.__cfgPath = cfgPath
         self.__index = index
+        self.__resultFormat = resultFormat
         self.__serialMsgHandle = dict()
         self.__serialRegerHandle = dict()
         self.__unSeiralRegerHandle = dict()
+        self.__frameTrace = FrameTrace()
 
     def Initialize(self, selfAddr=None):
         """
@@ -73,6 +88,8 @@ class MsgMgr(object):
             if selfAddr is None:
                 AgentAddr = "Agent" + str(self.__index) + "Addr"
                 strselfAddr = config.get('BusConf', AgentAddr)
+                # only the agent returns frame credits to MC, other users(SDKTool) have no MC channel
+                self.__mcAddr = tbus.GetAddress(config.get('BusConf', 'MCAddr'))
             else:
                 strselfAddr = config.get('BusConf', selfAddr)
             self.__gameRegAddr = tbus.GetAddress(strgameRegAddr)
@@ -144,16 +161,20 @@ class MsgMgr(object):
             msgBuff = tbus.RecvFrom(self.__gameRegAddr)
 
         if msgBuffRet is not None:
+            recvTime = time.time()
             # msg = msgpack.unpackb(msgBuffRet, object_hook=mn.decode, encoding='utf-8')
             msg = self._UnSerialResultMsg(msgBuffRet)
 
             frameSeq = msg['value'].get('frameSeq')
+            self.__frameTrace.Stamp(frameSeq, TRACE_STAGE_REG_RESULT, recvTime)
+            self._SendFrameCredit(frameSeq)
             img_data = msg['value'].get('image')
             if img_data is not None:
                 h, w = img_data.shape[:2]
                 result = msg['value'].get('result')
                 if result:
-                    LOG.debug('recv frame data, frameIndex=%s, h:%s, w:%s, result:%s', frameSeq, h, w, str(result))
+                    # result is formatted only when debug is on, formatting unserializes all the tasks
+                    LOG.debug('recv frame data, frameIndex=%s, h:%s, w:%s, result:%s', frameSeq, h, w, result)
 
             return msg
         return None
@@ -165,6 +186,7 @@ class MsgMgr(object):
         """
         LOG.info('tbus exit...')
         tbus.Exit(self.__selfAddr)
+        self.__frameTrace.Finish()
 
     def _CreateMsg(self, msgID, msgValue):
         msgDic = dict()
@@ -182,6 +204,17 @@ class MsgMgr(object):
             return False
         return True
 
+    def _SendFrameCredit(self, frameSeq):
+        if self.__mcAddr is None:
+            return
+
+        msg = common_pb2.tagMessage()
+        msg.eMsgID = common_pb2.MSG_FRAME_CREDIT
+        msg.stFrameCredit.uFrameSeq = frameSeq
+        ret = tbus.SendTo(self.__mcAddr, msg.SerializeToString())
+        if ret != 0:
+            LOG.warning('TBus Send frame credit To MC return code[%s]', ret)
+
     def SendImageToTool(self, srcImgDict):
         msg = common_pb2.tagMessage()
         msg.eMsgID = common_pb2.MSG_SRC_IMAGE_INFO
@@ -275,6 +308,9 @@ class MsgMgr(object):
         self.__unSeiralRegerHandle[gameregProtoc_pb2.TYPE_SHOOTHURT] = \
             self._UnSerialShootGameHurtRegResult
 
+        if self.__resultFormat == RESULT_FORMAT_ARRAY:
+            self.__unSeiralRegerHandle.update(ARRAY_UNSERIAL_HANDLE_DICT)
+
     def _SerialSendMsg(self, msgDic):
         msg = common_pb2.tagMessage()
         msg.eMsgID = common_pb2.MSG_GAMEREG_INFO
@@ -588,20 +624,22 @@ class MsgMgr(object):
         ResDict['value']['deviceIndex'] = Result.stPBResultValue.nDeviceIndex
         ResDict['value']['strJsonData'] = Result.stPBResultValue.strJsonData
         ResDict['value']['groupID'] = 1  # for test
-        data = np.fromstring(Result.stPBResultValue.byImgData, np.uint8)
+        # read only view on the message buffer without copy, copy it before drawing on it
+        data = np.frombuffer(Result.stPBResultValue.byImgData, np.uint8)
         ResDict['value']['image'] = np.reshape(
             data, (Result.stPBResultValue.nHeight, Result.stPBResultValue.nWidth, 3)
         )
 
-        ResDict['value']['result'] = {}
+        # the result of a task is unserialized when it is accessed
+        ResDict['value']['result'] = LazyResultDict()
         for result in Result.stPBResultValue.stPBResult:
             if result.eRegType == gameregProtoc_pb2.TYPE_PIXREG:
-                ResDict['value']['result'][result.nTaskID] = \
-                    self.__unSeiralRegerHandle[result.eRegType] \
-                        (result, Result.stPBResultValue.nHeight, Result.stPBResultValue.nWidth)
+                ResDict['value']['result'].AddPending(
+                    result.nTaskID, self.__unSeiralRegerHandle[result.eRegType],
+                    result, Result.stPBResultValue.nHeight, Result.stPBResultValue.nWidth)
             else:
-                ResDict['value']['result'][result.nTaskID] = \
-                    self.__unSeiralRegerHandle[result.eRegType](result)
+                ResDict['value']['result'].AddPending(
+                    result.nTaskID, self.__unSeiralRegerHandle[result.eRegType], result)
 
         return ResDict
 
@@ -801,17 +839,13 @@ class MsgMgr(object):
     @staticmethod
     def _UnSerialPixRegResult(result, height, width):
 
-        LOG.debug('_UnSerialPixRegResult, result:%s, height:%s, width:%s', result, height, width)
+        LOG.debug('_UnSerialPixRegResult, height:%s, width:%s', height, width)
         ResList = []
         for res in result.stPBResultRes:
             pixSingleDict = {}
             pixSingleDict['flag'] = bool(res.nFlag)
-            pixSingleDict['points'] = []
-            for point in res.stPBPoints:
-                ResPoint = {}
-                ResPoint['x'] = point.nX
-                ResPoint['y'] = point.nY
-                pixSingleDict['points'].append(ResPoint)
+            # one row per point instead of one dict per point, point['x'] still works
+            pixSingleDict['points'] = PointsToArray(res.stPBPoints).view(POINT_DTYPE).reshape(-1)
             ResList.append(pixSingleDict)
 
         return ResList
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import itertools
+import operator
+
+import numpy as np
+
+from .protocol import gameregProtoc_pb2
+
+# the result of each element is one row of a structured array, instead of one dict per element
+STUCK_DTYPE = np.dtype([('flag', np.bool_), ('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32)])
+
+NUMBER_DTYPE = np.dtype([('flag', np.bool_), ('num', np.float32),
+                         ('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32)])
+
+BLOOD_BAR_DTYPE = np.dtype([('flag', np.bool_), ('percent', np.float32),
+                            ('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+                            ('roiX', np.int32), ('roiY', np.int32), ('roiW', np.int32), ('roiH', np.int32)])
+
+HURT_DTYPE = np.dtype([('flag', np.bool_),
+                       ('roiX', np.int32), ('roiY', np.int32), ('roiW', np.int32), ('roiH', np.int32)])
+
+BOX_DTYPE = np.dtype([('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+                      ('score', np.float32), ('scale', np.float32), ('classID', np.int32), ('tmplName', 'U64')])
+
+BLOOD_DTYPE = np.dtype([('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+                        ('level', np.int32), ('score', np.float32), ('percent', np.float32),
+                        ('classID', np.int32), ('name', 'U64')])
+
+
+_GetPointXY = operator.attrgetter('nX', 'nY')
+
+
+def _Rect(rect):
+    return rect.nX, rect.nY, rect.nW, rect.nH
+
+
+def _ROIDict(rect):
+    return {'x': rect.nX, 'y': rect.nY, 'w': rect.nW, 'h': rect.nH}
+
+
+def PointsToArray(points):
+    """
+    Nx2 int32 array of the points, column 0 is x and column 1 is y
+    """
+    # fill a flat array from the coordinates without building a tuple list first
+    coords = np.fromiter(itertools.chain.from_iterable(map(_GetPointXY, points)), dtype=np.int32,
+                         count=2 * len(points))
+    return coords.reshape((-1, 2))
+
+
+def _Boxes(boxes):
+    return np.array([_Rect(box.stPBRect) + (box.fScore, box.fScale, box.nClassID, box.strTmplName)
+                     for box in boxes], dtype=BOX_DTYPE)
+
+
+def UnSerialStuckRegResult(result):
+    """
+    :return: STUCK_DTYPE array, one row per element
+    """
+    return np.array([(bool(res.nFlag),) + _Rect(res.stPBRect) for res in result.stPBResultRes],
+                    dtype=STUCK_DTYPE)
+
+
+def UnSerialNumberRegResult(result):
+    """
+    :return: NUMBER_DTYPE array, one row per element
+    """
+    return np.array([(bool(res.nFlag), res.fNum) + _Rect(res.stPBRect) for res in result.stPBResultRes],
+                    dtype=NUMBER_DTYPE)
+
+
+def UnSerialBloodBarRegResult(result):
+    """
+    result of fix blood and shoot game blood
+    :return: BLOOD_BAR_DTYPE array, one row per element
+    """
+    return np.array([(bool(res.nFlag), res.fNum) + _Rect(res.stPBRect) + _Rect(res.stPBROI)
+                     for res in result.stPBResultRes], dtype=BLOOD_BAR_DTYPE)
+
+
+def UnSerialShootGameHurtRegResult(result):
+    """
+    :return: HURT_DTYPE array, one row per element
+    """
+    return np.array([(bool(res.nFlag),) + _Rect(res.stPBROI) for res in result.stPBResultRes],
+                    dtype=HURT_DTYPE)
+
+
+def UnSerialFixObjRegResult(result):
+    """
+    :return: list of {'flag', 'ROI', 'boxes'}, boxes is a BOX_DTYPE array
+    """
+    return [{'flag': bool(res.nFlag), 'ROI': _ROIDict(res.stPBROI), 'boxes': _Boxes(res.stPBBoxs)}
+            for res in result.stPBResultRes]
+
+
+def UnSerialDeformRegResult(result):
+    """
+    :return: list of {'flag', 'boxes'}, boxes is a BOX_DTYPE array
+    """
+    return [{'flag': bool(res.nFlag), 'boxes': _Boxes(res.stPBBoxs)} for res in result.stPBResultRes]
+
+
+def UnSerialKingGloryBloodResult(result):
+    """
+    :return: list of {'flag', 'ROI', 'bloods'}, bloods is a BLOOD_DTYPE array
+    """
+    resList = []
+    for res in result.stPBResultRes:
+        bloods = np.array([_Rect(blood.stPBRect) + (blood.nLevel, blood.fScore, blood.fPercent, blood.nClassID,
+                                                    blood.strName)
+                           for blood in res.stPBBloods], dtype=BLOOD_DTYPE)
+        resList.append({'flag': bool(res.nFlag), 'ROI': _ROIDict(res.stPBROI), 'bloods': bloods})
+    return resList
+
+
+def UnSerialPixRegResult(result, height, width):
+    """
+    :return: list of {'flag', 'points'}, points is a Nx2 int32 array
+    """
+    return [{'flag': bool(res.nFlag), 'points': PointsToArray(res.stPBPoints)} for res in result.stPBResultRes]
+
+
+def UnSerialMapRegResult(result):
+    """
+    :return: list of {'flag', 'ROI', 'viewAnglePoint', 'myLocPoint', 'friendsLocPoints'},
+             friendsLocPoints is a Nx2 int32 array
+    """
+    resList = []
+    for res in result.stPBResultRes:
+        resList.append({'flag': bool(res.nFlag),
+                        'ROI': _ROIDict(res.stPBROI),
+                        'viewAnglePoint': {'x': res.stPBViewAnglePoint.nX, 'y': res.stPBViewAnglePoint.nY},
+                        'myLocPoint': {'x': res.stPBMyLocPoint.nX, 'y': res.stPBMyLocPoint.nY},
+                        'friendsLocPoints': PointsToArray(res.stPBPoints)})
+    return resList
+
+
+def UnSerialMultColorVar(result):
+    """
+    :return: list of {'flag', 'colorMeanVar'}, colorMeanVar is a float32 array
+    """
+    return [{'flag': bool(res.nFlag), 'colorMeanVar': np.array(res.fColorMeanVars, dtype=np.float32)}
+            for res in result.stPBResultRes]
+
+
+# unserialize functions of the array result format, the reg types not listed use the dict format
+ARRAY_UNSERIAL_HANDLE_DICT = {
+    gameregProtoc_pb2.TYPE_STUCKREG: UnSerialStuckRegResult,
+    gameregProtoc_pb2.TYPE_FIXOBJREG: UnSerialFixObjRegResult,
+    gameregProtoc_pb2.TYPE_PIXREG: UnSerialPixRegResult,
+    gameregProtoc_pb2.TYPE_DEFORMOBJ: UnSerialDeformRegResult,
+    gameregProtoc_pb2.TYPE_NUMBER: UnSerialNumberRegResult,
+    gameregProtoc_pb2.TYPE_FIXBLOOD: UnSerialBloodBarRegResult,
+    gameregProtoc_pb2.TYPE_KINGGLORYBLOOD: UnSerialKingGloryBloodResult,
+    gameregProtoc_pb2.TYPE_MAPREG: UnSerialMapRegResult,
+    gameregProtoc_pb2.TYPE_MULTCOLORVAR: UnSerialMultColorVar,
+    gameregProtoc_pb2.TYPE_SHOOTBLOOD: UnSerialBloodBarRegResult,
+    gameregProtoc_pb2.TYPE_SHOOTHURT: UnSerialShootGameHurtRegResult,
+}
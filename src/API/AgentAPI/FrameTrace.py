@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import logging
+import mmap
+import os
+import platform
+import struct
+import time
+import zlib
+
+import numpy as np
+
+LOG = logging.getLogger('agent')
+
+# the trace table is created by IOService, MC and AgentAI stamp into it with the same name
+TRACE_SHM_NAME = 'ai_sdk_trace'
+TRACE_SLOT_NUM = 256
+
+# stages of a frame, in the order they happen
+TRACE_STAGE_CLIENT_RECV = 0
+TRACE_STAGE_DECODE = 1
+TRACE_STAGE_MC_FORWARD = 2
+TRACE_STAGE_REG_RESULT = 3
+TRACE_STAGE_AGENT_DECISION = 4
+TRACE_STAGE_ACTION_SEND = 5
+TRACE_STAGE_NUM = 6
+
+TRACE_STAGE_NAME_LIST = ['client_recv', 'decode', 'mc_forward', 'reg_result', 'agent_decision', 'action_send']
+
+SHM_DIR = '/dev/shm'
+TRACE_MAGIC = b'AIFT'
+# magic, layout, slotNum
+TRACE_HEADER_FMT = '<4sII'
+TRACE_HEADER_SIZE = 64
+TRACE_SLOT_DTYPE = np.dtype([('seq', '<u8'), ('ts', '<f8', (TRACE_STAGE_NUM,))])
+# IOService, MC and AgentAI each ship a copy of this module, the creator stores the signature of its layout in the
+# header and the others refuse a different one. Bump the version when the meaning of the layout changes
+TRACE_LAYOUT_VERSION = 1
+TRACE_LAYOUT = zlib.crc32(repr((TRACE_LAYOUT_VERSION, TRACE_HEADER_FMT, TRACE_HEADER_SIZE, TRACE_SLOT_DTYPE.descr,
+                                TRACE_STAGE_NAME_LIST)).encode('utf-8'))
+
+# seconds between two tries of opening the table, the creator may start later than the reader
+OPEN_RETRY_INTERVAL = 5
+
+
+class FrameTrace(object):
+    """
+    Shared memory table of the stage timestamps of the recent frames, shared between IOService, MC
+    and AgentAI. The creator begins a row in slot (frameSeq % slotNum) when a frame is received,
+    the other processes stamp their stage into the row if it still belongs to the frame.
+    The memory is fixed, old frames are overwritten by new ones.
+    """
+    def __init__(self, name=TRACE_SHM_NAME, slotNum=TRACE_SLOT_NUM):
+        self.__name = name
+        self.__slotNum = slotNum
+        self.__mmap = None
+        self.__fd = None
+        self.__table = None
+        self.__lastOpenTime = 0
+
+    def Create(self):
+        """
+        Create the shared memory as the creator
+        :return: True or false
+        """
+        totalSize = TRACE_HEADER_SIZE + self.__slotNum * TRACE_SLOT_DTYPE.itemsize
+        try:
+            self.__mmap = self._Map(totalSize, create=True)
+        except (OSError, ValueError) as err:
+            LOG.error('FrameTrace create shared memory[%s] failed, err: %s', self.__name, err)
+            return False
+
+        struct.pack_into(TRACE_HEADER_FMT, self.__mmap, 0, TRACE_MAGIC, TRACE_LAYOUT, self.__slotNum)
+        self.__table = np.ndarray(shape=(self.__slotNum,), dtype=TRACE_SLOT_DTYPE, buffer=self.__mmap,
+                                  offset=TRACE_HEADER_SIZE)
+        self.__table['seq'] = 0
+        LOG.info('FrameTrace create shared memory[%s], slotNum[%s]', self.__name, self.__slotNum)
+        return True
+
+    def Open(self):
+        """
+        Open the shared memory created by IOService, the slot number is read from the header
+        :return: True or false
+        """
+        self.__lastOpenTime = time.time()
+        try:
+            self.__mmap = self._Map(TRACE_HEADER_SIZE, create=False)
+            magic, layout, slotNum = struct.unpack_from(TRACE_HEADER_FMT, self.__mmap, 0)
+            if magic != TRACE_MAGIC:
+                LOG.debug('FrameTrace shared memory[%s] is not ready', self.__name)
+                self.Finish()
+                return False
+
+            if layout != TRACE_LAYOUT:
+                LOG.error('FrameTrace shared memory[%s] has layout[%s], expect[%s], the FrameTrace of IOService, '
+                          'MC and AgentAI are different', self.__name, layout, TRACE_LAYOUT)
+                self.Finish()
+                return False
+
+            self.__mmap.close()
+            self.__mmap = None
+            self.__slotNum = slotNum
+            self.__mmap = self._Map(TRACE_HEADER_SIZE + slotNum * TRACE_SLOT_DTYPE.itemsize, create=False)
+        except (OSError, ValueError) as err:
+            LOG.debug('FrameTrace open shared memory[%s] failed, err: %s', self.__name, err)
+            self.Finish()
+            return False
+
+        self.__table = np.ndarray(shape=(self.__slotNum,), dtype=TRACE_SLOT_DTYPE, buffer=self.__mmap,
+                                  offset=TRACE_HEADER_SIZE)
+        LOG.info('FrameTrace open shared memory[%s], slotNum[%s]', self.__name, self.__slotNum)
+        return True
+
+    def IsOpened(self):
+        """
+        Whether the shared memory is mapped
+        :return: True or false
+        """
+        return self.__table is not None
+
+    def Begin(self, frameSeq, timestamp=None):
+        """
+        Take the slot of the frame and stamp TRACE_STAGE_CLIENT_RECV, called by the creator
+        :param frameSeq: frame sequence, must be greater than 0
+        :param timestamp: time of the stage, now if None
+        :return:
+        """
+        if self.__table is None or frameSeq <= 0:
+            return
+
+        row = self.__table[frameSeq % self.__slotNum]
+        # invalidate the row first, so a late stamp of the old frame is dropped
+        row['seq'] = 0
+        row['ts'] = 0
+        row['ts'][TRACE_STAGE_CLIENT_RECV] = time.time() if timestamp is None else timestamp
+        row['seq'] = frameSeq
+
+    def Stamp(self, frameSeq, stage, timestamp=None):
+        """
+        Stamp the stage of the frame, the first stamp of a stage wins
+        :param frameSeq: frame sequence
+        :param stage: TRACE_STAGE_*
+        :param timestamp: time of the stage, now if None
+        :return: True if stamped
+        """
+        if frameSeq <= 0 or not self._CheckOpened():
+            return False
+
+        row = self.__table[frameSeq % self.__slotNum]
+        if row['seq'] != frameSeq or row['ts'][stage] != 0:
+            return False
+
+        row['ts'][stage] = time.time() if timestamp is None else timestamp
+        return True
+
+    def Get(self, frameSeq):
+        """
+        Get the stage timestamps of the frame
+        :param frameSeq: frame sequence
+        :return: copy of the timestamps, 0 for the stages not stamped, None if the frame is overwritten
+        """
+        if frameSeq <= 0 or self.__table is None:
+            return None
+
+        row = self.__table[frameSeq % self.__slotNum]
+        timestamps = row['ts'].copy()
+        if row['seq'] != frameSeq:
+            return None
+        return timestamps
+
+    def Finish(self):
+        """
+        Unmap the shared memory
+        :return:
+        """
+        self.__table = None
+        if self.__mmap is not None:
+            try:
+                self.__mmap.close()
+            except BufferError:
+                LOG.warning('FrameTrace shared memory[%s] still in use', self.__name)
+            self.__mmap = None
+
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def _CheckOpened(self):
+        if self.__table is not None:
+            return True
+
+        if time.time() - self.__lastOpenTime < OPEN_RETRY_INTERVAL:
+            return False
+        return self.Open()
+
+    def _Map(self, size, create):
+        if platform.system() == 'Windows':
+            # named shared memory, the tagname is visible to all processes of the session
+            return mmap.mmap(-1, size, tagname=self.__name)
+
+        if self.__fd is None:
+            path = os.path.join(SHM_DIR, self.__name)
+            if create:
+                self.__fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+                os.ftruncate(self.__fd, size)
+            else:
+                self.__fd = os.open(path, os.O_RDWR)
+        return mmap.mmap(self.__fd, size)
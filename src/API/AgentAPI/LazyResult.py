@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+from collections.abc import MutableMapping
+
+
+class LazyResultDict(MutableMapping):
+    """
+    Dict of taskID to the recognize result of the task, the protobuf result of a task is only
+    unserialized when the task is accessed. Agents usually read a few tasks of each frame, so the
+    results of the other tasks are never unserialized.
+    """
+    def __init__(self):
+        self.__resultDict = dict()
+        self.__pendingDict = dict()
+
+    def AddPending(self, taskID, unSerialFunc, *args):
+        """
+        Add the result of a task, unSerialFunc(*args) is called on the first access
+        :param taskID: task ID
+        :param unSerialFunc: unserialize function of the result
+        :param args: arguments of unSerialFunc
+        :return:
+        """
+        self.__resultDict[taskID] = None
+        self.__pendingDict[taskID] = (unSerialFunc, args)
+
+    def __getitem__(self, taskID):
+        value = self.__resultDict[taskID]
+        pending = self.__pendingDict.pop(taskID, None)
+        if pending is not None:
+            unSerialFunc, args = pending
+            value = unSerialFunc(*args)
+            self.__resultDict[taskID] = value
+        return value
+
+    def __setitem__(self, taskID, value):
+        self.__pendingDict.pop(taskID, None)
+        self.__resultDict[taskID] = value
+
+    def __delitem__(self, taskID):
+        del self.__resultDict[taskID]
+        self.__pendingDict.pop(taskID, None)
+
+    def __iter__(self):
+        return iter(self.__resultDict)
+
+    def __len__(self):
+        return len(self.__resultDict)
+
+    def __contains__(self, taskID):
+        return taskID in self.__resultDict
+
+    def __repr__(self):
+        return repr(dict(self.items()))
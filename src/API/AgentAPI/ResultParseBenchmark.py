@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Parse time per frame of the recognize results, dict format vs array format.
+Run from src/API: python -m AgentAPI.ResultParseBenchmark
+"""
+
+import argparse
+import time
+
+from .AgentMsgMgr import MsgMgr, RESULT_FORMAT_DICT, RESULT_FORMAT_ARRAY
+from .protocol import gameregProtoc_pb2
+
+
+def _FillRect(rect, x, y, w, h):
+    rect.nX = x
+    rect.nY = y
+    rect.nW = w
+    rect.nH = h
+
+
+def CreateResultMsg(args):
+    """
+    Create a serialized result msg of a frame, the tasks are like a usual game task config
+    :param args: task numbers, see main
+    :return: msg buff
+    """
+    msg = gameregProtoc_pb2.tagPBAgentMsg()
+    value = msg.stPBResultValue
+    value.nFrameSeq = 1
+    value.nWidth = args.width
+    value.nHeight = args.height
+    value.byImgData = bytes(args.width * args.height * 3)
+
+    taskID = 1
+    for _ in range(args.fixobj):
+        result = value.stPBResult.add()
+        result.nTaskID = taskID
+        result.eRegType = gameregProtoc_pb2.TYPE_FIXOBJREG
+        res = result.stPBResultRes.add()
+        res.nFlag = 1
+        _FillRect(res.stPBROI, 0, 0, args.width, args.height)
+        for index in range(args.boxes):
+            box = res.stPBBoxs.add()
+            box.strTmplName = 'tmpl{}'.format(index)
+            box.fScore = 0.9
+            box.fScale = 1.
+            _FillRect(box.stPBRect, index * 10, index * 10, 50, 50)
+        taskID += 1
+
+    for _ in range(args.pix):
+        result = value.stPBResult.add()
+        result.nTaskID = taskID
+        result.eRegType = gameregProtoc_pb2.TYPE_PIXREG
+        res = result.stPBResultRes.add()
+        res.nFlag = 1
+        for index in range(args.points):
+            point = res.stPBPoints.add()
+            point.nX = index % args.width
+            point.nY = index // args.width
+        taskID += 1
+
+    for _ in range(args.blood):
+        result = value.stPBResult.add()
+        result.nTaskID = taskID
+        result.eRegType = gameregProtoc_pb2.TYPE_FIXBLOOD
+        res = result.stPBResultRes.add()
+        res.nFlag = 1
+        res.fNum = 0.5
+        _FillRect(res.stPBRect, 10, 10, 200, 10)
+        _FillRect(res.stPBROI, 0, 0, 300, 30)
+        taskID += 1
+
+    for _ in range(args.number):
+        result = value.stPBResult.add()
+        result.nTaskID = taskID
+        result.eRegType = gameregProtoc_pb2.TYPE_NUMBER
+        res = result.stPBResultRes.add()
+        res.nFlag = 1
+        res.fNum = 123
+        _FillRect(res.stPBRect, 10, 10, 50, 20)
+        taskID += 1
+
+    for _ in range(args.king):
+        result = value.stPBResult.add()
+        result.nTaskID = taskID
+        result.eRegType = gameregProtoc_pb2.TYPE_KINGGLORYBLOOD
+        res = result.stPBResultRes.add()
+        res.nFlag = 1
+        for index in range(args.bloods):
+            blood = res.stPBBloods.add()
+            blood.nLevel = 1
+            blood.fScore = 0.9
+            blood.fPercent = 0.5
+            blood.strName = 'blood{}'.format(index)
+            _FillRect(blood.stPBRect, index * 20, 0, 60, 8)
+        taskID += 1
+
+    return msg.SerializeToString()
+
+
+def RunBenchmark(msgBuff, resultFormat, frameNum):
+    """
+    :param msgBuff: serialized result msg
+    :param resultFormat: RESULT_FORMAT_DICT or RESULT_FORMAT_ARRAY
+    :param frameNum: number of frames to parse
+    :return: (ms per frame reading one task, ms per frame reading all tasks)
+    """
+    msgMgr = MsgMgr(resultFormat=resultFormat)
+    # only the unserialize handlers are needed, tbus is not initialized
+    msgMgr._Register()
+
+    costList = []
+    for readAll in (False, True):
+        beginTime = time.time()
+        for _ in range(frameNum):
+            result = msgMgr._UnSerialResultMsg(msgBuff)['value']['result']
+            if readAll:
+                for _ in result.values():
+                    pass
+            else:
+                result.get(1)
+        costList.append(1000 * (time.time() - beginTime) / frameNum)
+    return costList
+
+
+def main():
+    """
+    benchmark entry
+    """
+    parser = argparse.ArgumentParser(description='recognize result parse benchmark')
+    parser.add_argument('--frames', type=int, default=200, help='number of frames')
+    parser.add_argument('--width', type=int, default=1280, help='image width')
+    parser.add_argument('--height', type=int, default=720, help='image height')
+    parser.add_argument('--fixobj', type=int, default=8, help='number of fix object tasks')
+    parser.add_argument('--boxes', type=int, default=5, help='boxes of each fix object task')
+    parser.add_argument('--pix', type=int, default=1, help='number of pixel tasks')
+    parser.add_argument('--points', type=int, default=2000, help='points of each pixel task')
+    parser.add_argument('--blood', type=int, default=2, help='number of fix blood tasks')
+    parser.add_argument('--number', type=int, default=2, help='number of number tasks')
+    parser.add_argument('--king', type=int, default=1, help='number of king glory blood tasks')
+    parser.add_argument('--bloods', type=int, default=10, help='bloods of each king glory blood task')
+    args = parser.parse_args()
+
+    msgBuff = CreateResultMsg(args)
+    print('result msg size: {}B'.format(len(msgBuff)))
+    for resultFormat in (RESULT_FORMAT_DICT, RESULT_FORMAT_ARRAY):
+        oneTaskMS, allTaskMS = RunBenchmark(msgBuff, resultFormat, args.frames)
+        print('{:>5}: read one task {:.3f}ms/frame, read all tasks {:.3f}ms/frame'.format(
+            resultFormat, oneTaskMS, allTaskMS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Per action latency and peak allocated bytes of the action send path in ActionMgr, the legacy path (protobuf
+serialized once per peer node, json dumped unless the regaction logger level is set above debug) vs the msg
+serialized once for all peer nodes. The buffers are built but not sent by tbus.
+Run from src/AgentAI: python -m actionmanager.ActionBenchmark
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import msgpack
+import msgpack_numpy as mn
+import numpy as np
+
+from protocol import common_pb2
+
+from .ActionMgr import MSG_ID_AI_ACTION, PackActionMsg
+
+PEER_NODE_NUM = 2
+
+
+def _LegacyPackActionMsg(actionID, actionData, frameSeq, jsonDump):
+    """
+    The send path before packing once: the msg is serialized by SendMsg of each peer node
+    """
+    actionData['msg_id'] = MSG_ID_AI_ACTION
+    actionData['action_id'] = actionID
+    actionBuff = msgpack.packb(actionData, default=mn.encode, use_bin_type=True)
+
+    msg = common_pb2.tagMessage()
+    msg.eMsgID = common_pb2.MSG_AI_ACTION
+    msg.stAIAction.nFrameSeq = frameSeq
+    msg.stAIAction.byAIActionBuff = actionBuff
+
+    if jsonDump:
+        json.dumps(actionData)
+
+    return [msg.SerializeToString() for _ in range(PEER_NODE_NUM)]
+
+
+def _PackActionMsg(actionID, actionData, frameSeq, jsonDump):
+    msgBuff = PackActionMsg(actionID, actionData, frameSeq)
+    if jsonDump:
+        json.dumps(actionData)
+    return [msgBuff] * PEER_NODE_NUM
+
+
+def _CreateActionData(index):
+    # a click of MobileActionMgrExt
+    return {'px': index % 1280, 'py': index % 720, 'contact': 0, 'during_time': 50, 'img_id': index}
+
+
+def RunBenchmark(packFunc, actionNum, jsonDump):
+    """
+    Latency in us and peak allocated bytes of each action
+    """
+    latencyList = list()
+    for index in range(actionNum):
+        actionData = _CreateActionData(index)
+        startTime = time.time()
+        packFunc(4, actionData, index, jsonDump)
+        latencyList.append((time.time() - startTime) * 1000000)
+
+    # traced separately, tracemalloc slows down the allocations
+    peakList = list()
+    for index in range(actionNum):
+        actionData = _CreateActionData(index)
+        tracemalloc.start()
+        packFunc(4, actionData, index, jsonDump)
+        peakList.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return np.array(latencyList), np.array(peakList)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='action send path benchmark')
+    parser.add_argument('--actions', type=int, default=20000, help='number of packed actions')
+    parser.add_argument('--legacy-json-dump', type=int, default=1, choices=[0, 1],
+                        help='whether the legacy path json dumps the action, it does when the regaction logger '
+                             'level is not set')
+    args = parser.parse_args()
+
+    for name, packFunc, jsonDump in (('legacy', _LegacyPackActionMsg, args.legacy_json_dump == 1),
+                                     ('serialize once', _PackActionMsg, False)):
+        latency, peak = RunBenchmark(packFunc, args.actions, jsonDump)
+        print('{}: avg {:.2f} us, p50 {:.2f} us, p99 {:.2f} us, peak allocated {:.0f} bytes per action'.format(
+            name, latency.mean(), np.percentile(latency, 50), np.percentile(latency, 99), peak.mean()))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,7 @@ import logging
 
 import msgpack
 import msgpack_numpy as mn
+from AgentAPI.FrameTrace import FrameTrace, TRACE_STAGE_AGENT_DECISION
 from connect.BusConnect import BusConnect
 
 from protocol import common_pb2
@@ -22,6 +23,26 @@ MSG_ID_AI_ACTION = 2000
 LOG = logging.getLogger('agent')
 LOG_REGACTION = logging.getLogger('regaction')
 
+
+def PackActionMsg(actionID, actionData, frameSeq=-1):
+    """
+    Serialize the action msg, the buffer is sent to all peer nodes
+    :param actionID: the self-defined action ID
+    :param actionData: the context data of the action ID
+    :param frameSeq: the frame sequence, default is -1
+    :return: the serialized msg
+    """
+    actionData['msg_id'] = MSG_ID_AI_ACTION
+    actionData['action_id'] = actionID
+    actionBuff = msgpack.packb(actionData, default=mn.encode, use_bin_type=True)
+
+    msg = common_pb2.tagMessage()
+    msg.eMsgID = common_pb2.MSG_AI_ACTION
+    msg.stAIAction.nFrameSeq = frameSeq
+    msg.stAIAction.byAIActionBuff = actionBuff
+    return msg.SerializeToString()
+
+
 class ActionMgr(object):
     """
     ActionMgr implement for remote action
@@ -29,6 +50,7 @@ class ActionMgr(object):
     def __init__(self):
         self.__initialized = False
         self.__connect = BusConnect()
+        self.__frameTrace = FrameTrace()
 
     def Initialize(self):
         """
@@ -46,6 +68,7 @@ class ActionMgr(object):
         if self.__initialized:
             LOG.info('Close connection...')
             self.__connect.Close()
+            self.__frameTrace.Finish()
             self.__initialized = False
 
     def SendAction(self, actionID, actionData, frameSeq=-1):
@@ -60,23 +83,18 @@ class ActionMgr(object):
             LOG.warning('Call Initialize first!')
             return False
 
-        actionData['msg_id'] = MSG_ID_AI_ACTION
-        actionData['action_id'] = actionID
-        actionBuff = msgpack.packb(actionData, default=mn.encode, use_bin_type=True)
+        self.__frameTrace.Stamp(frameSeq, TRACE_STAGE_AGENT_DECISION)
 
-        msg = common_pb2.tagMessage()
-        msg.eMsgID = common_pb2.MSG_AI_ACTION
-        msg.stAIAction.nFrameSeq = frameSeq
-        msg.stAIAction.byAIActionBuff = actionBuff
-        #msgBuff = msg.SerializeToString()
+        msgBuff = PackActionMsg(actionID, actionData, frameSeq)
 
-        if LOG_REGACTION.level <= logging.DEBUG:
+        if LOG_REGACTION.isEnabledFor(logging.DEBUG):
             actionStr = json.dumps(actionData)
             LOG_REGACTION.debug('{}||action||{}'.format(frameSeq, actionStr))
 
-        self.__connect.SendMsg(msg, BusConnect.PEER_NODE_SDKTOOL)
+        # SDKTool is optional, it is skipped while not attached
+        self.__connect.SendBuff(msgBuff, BusConnect.PEER_NODE_SDKTOOL, optional=True)
 
-        ret = self.__connect.SendMsg(msg, BusConnect.PEER_NODE_MC)
+        ret = self.__connect.SendBuff(msgBuff, BusConnect.PEER_NODE_MC)
         if ret != 0:
             LOG.warning('TBus Send To MC return code[{0}]'.format(ret))
             return False
@@ -54,7 +54,7 @@ class DQNEnv(GameEnv):
         """
         Initialize game env object, create recognize task use AgentAPI
         """
-        ret = self.__agentAPI.Initialize(self.__recognizeCfgFile)
+        ret = self.__agentAPI.Initialize(self.__recognizeCfgFile, resultFormat=self.LoadResultFormat())
         if not ret:
             self.logger.error('Agent API Init Failed')
             return False
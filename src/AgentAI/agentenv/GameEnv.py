@@ -8,14 +8,18 @@ For full details, please refer to the file "LICENSE.txt" which is provided as pa
 Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
+import configparser
 import logging
 from abc import ABCMeta, abstractmethod
 
 from AgentAPI import AgentAPIMgr
 from connect.BusConnect import BusConnect
+from util import util
 
 from protocol import common_pb2
 
+PLUGIN_CFG_FILE = 'cfg/task/agent/AgentAI.ini'
+
 
 class GameEnv(object):
     """
@@ -48,6 +52,25 @@ class GameEnv(object):
         stateMsg.stAgentState.strAgentState = stateDescription
         return self.__connect.SendMsg(stateMsg, BusConnect.PEER_NODE_MC)
 
+    def LoadResultFormat(self):
+        """
+        Load the format of recognize results from ResultFormat in AGENT_ENV section of agent config file,
+        dict by default, array for numpy structured arrays
+        """
+        pluginCfgPath = util.ConvertToSDKFilePath(PLUGIN_CFG_FILE)
+        config = configparser.ConfigParser()
+        config.read(pluginCfgPath)
+
+        envSection = 'AgentEnv' if config.has_section('AgentEnv') else 'AGENT_ENV'
+        resultFormat = config.get(envSection, 'ResultFormat', fallback=AgentAPIMgr.RESULT_FORMAT_DICT)
+        if resultFormat not in (AgentAPIMgr.RESULT_FORMAT_DICT, AgentAPIMgr.RESULT_FORMAT_ARRAY):
+            self.logger.error('Invalid ResultFormat %s in %s, use %s', resultFormat, pluginCfgPath,
+                              AgentAPIMgr.RESULT_FORMAT_DICT)
+            resultFormat = AgentAPIMgr.RESULT_FORMAT_DICT
+
+        self.logger.info('the format of recognize results is %s', resultFormat)
+        return resultFormat
+
     @abstractmethod
     def Init(self):
         """
@@ -65,7 +65,8 @@ class ImitationEnv(GameEnv):
         """
         taskCfgFile = util.ConvertToSDKFilePath(TASK_CFG_FILE)
         taskReferCfgFile = util.ConvertToSDKFilePath(TASK_REFER_CFG_FILE)
-        if not self.__agentAPI.Initialize(taskCfgFile, referFile=taskReferCfgFile):
+        if not self.__agentAPI.Initialize(taskCfgFile, referFile=taskReferCfgFile,
+                                          resultFormat=self.LoadResultFormat()):
             self.logger.error('Agent API Init Failed')
             return False
 
@@ -217,7 +218,7 @@ class ImitationEnv(GameEnv):
             self.__imgWidth = image.shape[1]
 
             self.logger.debug("the result of game reg is %s, beginTask: %s, endTask: %s",
-                              str(result), str(self.__beginTaskID), str(self.__overTaskID))
+                              result, self.__beginTaskID, self.__overTaskID)
 
             self._ParseGameState(result)
             self._ParseBtnPostion(result)
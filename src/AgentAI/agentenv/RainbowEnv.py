@@ -72,7 +72,7 @@ class RainbowEnv(GameEnv):
             self.logger.error('initialize action controller failed')
             return False
 
-        ret = self.__agentAPI.Initialize(self.__taskCfgPath)
+        ret = self.__agentAPI.Initialize(self.__taskCfgPath, resultFormat=self.LoadResultFormat())
         if not ret:
             self.logger.error('initialize agent API failed')
             return False
@@ -100,6 +100,12 @@ class CfgParse(object):
                 self.data['useClassBalance'] = networkCfg.get('useClassBalance', True)
                 # Whether use resNet
                 self.data['useResNet'] = networkCfg.get('useResNet', True)
+                # Random seed of the sample order of training
+                self.data['randomSeed'] = networkCfg.get('randomSeed', 0)
+                # Number of threads preparing training data
+                self.data['dataWorkerNum'] = networkCfg.get('dataWorkerNum', 4)
+                # Whether cache the CNN features for LSTM training on disk
+                self.data['cacheLSTMFeature'] = networkCfg.get('cacheLSTMFeature', False)
 
                 actionCfg = aiCfg.get('action')
                 if actionCfg is None:
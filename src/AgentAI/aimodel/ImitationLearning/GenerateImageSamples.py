@@ -10,12 +10,34 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 
 import csv
 import logging
+import multiprocessing
 import operator
 import os
 import shutil
+from functools import partial
 import numpy as np
 import cv2
-from .util import ObtainTaskDict, FindIndex, RepeatList
+from .util import ObtainTaskDict, FindIndex, RepeatList, GetNetImageSize, DATASET_IMAGE_FILE, DATASET_LABEL_FILE
+
+IMAGE_CHANNEL = 3
+LOAD_IMAGE_CHUNK_SIZE = 16
+COPY_IMAGE_CHUNK_SIZE = 1024
+SAMPLE_TXT_FILES = ('dataOri.txt', 'data.txt')
+
+
+def _LoadImage(imageName, roiRegion, imageSize):
+    """
+    Decode, crop and resize a recorded frame, runs in the processes of the pool
+    """
+    image = cv2.imread(imageName)
+    if image is None:
+        return None
+
+    if roiRegion is not None:
+        image = image[roiRegion[1]: roiRegion[1] + roiRegion[3],
+                      roiRegion[0]: roiRegion[0] + roiRegion[2], :]
+
+    return cv2.resize(image, (imageSize, imageSize))
 
 
 class GenerateImageSamples(object):
@@ -37,12 +59,19 @@ class GenerateImageSamples(object):
         self.roiRegion = cfgData.get('roiRegion')
         self.classImageTimes = cfgData['classImageTimes']
 
-        self.imageSize = cfgData['imageSize']
+        # the samples are packed at the input size of the network, so that training reads them without resizing
+        self.imageSize = GetNetImageSize(cfgData.get('isSmallNet'))
+        self.processNum = multiprocessing.cpu_count()
         self.actionAheadNum = cfgData['actionAheadNum']
         self.actionDefine = cfgData.get('actionDefine')
 
         self.taskList, self.taskActionDict, self.actionNameDict = ObtainTaskDict(self.actionDefine)
 
+        # the recorded frames, sample names and labels of the split, in the order of dataOri.txt
+        self.srcImageNameList = list()
+        self.datasetNameList = list()
+        self.datasetLabelList = list()
+
         if os.path.exists(self.trainClassDir):
             shutil.rmtree(self.trainClassDir)
         if not os.path.exists(self.trainClassDir):
@@ -55,8 +84,11 @@ class GenerateImageSamples(object):
 
     def LoadDataSave(self, sampleDir, mode='train'):
         """
-        Load image samples
+        Load image samples, and save them to the packed dataset of the split
         """
+        self.srcImageNameList = list()
+        self.datasetNameList = list()
+        self.datasetLabelList = list()
         for item in os.listdir(sampleDir):
             filePath = os.path.join(sampleDir, item)
             if os.path.isdir(filePath):
@@ -64,6 +96,9 @@ class GenerateImageSamples(object):
                 csvFilePath = os.path.join(filePath, csvFileName)
                 self.LoadSampleSave(csvFilePath, mode)
 
+        outFileDir = self.trainClassDir if mode == 'train' else self.testClassDir
+        self.SaveDataset(outFileDir)
+
     def LoadSampleSave(self, csvFilePath, mode):
         """
         Load label and image
@@ -209,36 +244,109 @@ class GenerateImageSamples(object):
 
     def SaveImageAhead(self, actionList, imageNameList, outFileDir):
         """
-        Save image according to time of action delay
+        Add image to the dataset according to time of action delay, the images are decoded by SaveDataset.
+        The sample name is still the image name in the class directory, which identifies the sample in txt files
         """
         actionListNew = list()
         imageNameListNew = list()
         for n in range(len(actionList) - self.actionAheadNum):
-            image = cv2.imread(imageNameList[n])
             label = actionList[n + self.actionAheadNum]
 
-            if self.roiRegion is not None:
-                image = image[self.roiRegion[1]: self.roiRegion[1] + self.roiRegion[3],
-                              self.roiRegion[0]: self.roiRegion[0] + self.roiRegion[2], :]
-
-            img = cv2.resize(image, (self.imageSize, self.imageSize))
-
             (prefileName1, tempfilename) = os.path.split(imageNameList[n])
             (_, prefileName2) = os.path.split(prefileName1)
 
-            outFileDir2 = os.path.join(outFileDir, prefileName2)
-
-            if not os.path.exists(outFileDir2):
-                os.mkdir(outFileDir2)
-
-            outImageName = os.path.join(outFileDir2, tempfilename[1:-4] + '.jpg')
-            cv2.imwrite(outImageName, img)
+            outImageName = os.path.join(outFileDir, prefileName2, tempfilename[1:-4] + '.jpg')
 
             actionListNew.append(label)
             imageNameListNew.append(outImageName)
+            self.srcImageNameList.append(imageNameList[n])
 
+        self.datasetNameList.extend(imageNameListNew)
+        self.datasetLabelList.extend(actionListNew)
         return imageNameListNew, actionListNew
 
+    def SaveDataset(self, outFileDir):
+        """
+        Decode and resize the images of the split with a process pool, and write them once into the packed
+        uint8 dataset, which is memory mapped by training. The samples whose images can not be read are dropped
+        """
+        imageNum = len(self.srcImageNameList)
+        imageShape = (imageNum, self.imageSize, self.imageSize, IMAGE_CHANNEL)
+        imageFile = os.path.join(outFileDir, DATASET_IMAGE_FILE)
+        self.logger.info('save %d images to %s with %d processes', imageNum, imageFile, self.processNum)
+
+        failedIndexes = list()
+        if imageNum == 0:
+            np.save(imageFile, np.zeros(imageShape, dtype=np.uint8))
+        else:
+            images = np.lib.format.open_memmap(imageFile, mode='w+', dtype=np.uint8, shape=imageShape)
+            loadImage = partial(_LoadImage, roiRegion=self.roiRegion, imageSize=self.imageSize)
+            pool = multiprocessing.Pool(self.processNum)
+            try:
+                for n, image in enumerate(pool.imap(loadImage, self.srcImageNameList, LOAD_IMAGE_CHUNK_SIZE)):
+                    if image is None:
+                        self.logger.error('read image %s failed, drop the sample', self.srcImageNameList[n])
+                        failedIndexes.append(n)
+                        continue
+                    # the images are packed in the order of the samples which are kept
+                    images[n - len(failedIndexes)] = image
+            finally:
+                pool.close()
+                pool.join()
+
+            images.flush()
+            shrinkFile = None
+            if failedIndexes:
+                shrinkFile = self._ShrinkImages(imageFile, images, imageNum - len(failedIndexes))
+            # the dataset is replaced after it is unmapped
+            del images
+            if shrinkFile is not None:
+                os.replace(shrinkFile, imageFile)
+
+        if failedIndexes:
+            self._DropSamples(outFileDir, failedIndexes)
+
+        labelArray = np.array(self.datasetLabelList, dtype=np.int32).reshape((len(self.datasetLabelList),
+                                                                              len(self.taskList)))
+        np.save(os.path.join(outFileDir, DATASET_LABEL_FILE), labelArray)
+
+    @staticmethod
+    def _ShrinkImages(imageFile, images, imageNum):
+        """
+        Copy the first imageNum images of the packed dataset into a new file
+        :return: the path of the new file
+        """
+        shrinkFile = imageFile + '.tmp.npy'
+        shrinkImages = np.lib.format.open_memmap(shrinkFile, mode='w+', dtype=np.uint8,
+                                                 shape=(imageNum,) + images.shape[1:])
+        for begin in range(0, imageNum, COPY_IMAGE_CHUNK_SIZE):
+            end = min(begin + COPY_IMAGE_CHUNK_SIZE, imageNum)
+            shrinkImages[begin:end] = images[begin:end]
+        shrinkImages.flush()
+        del shrinkImages
+        return shrinkFile
+
+    def _DropSamples(self, outFileDir, failedIndexes):
+        """
+        Remove the samples whose images can not be read from the labels and the txt files of the split
+        """
+        failedNameSet = set(self.datasetNameList[n] for n in failedIndexes)
+        failedIndexSet = set(failedIndexes)
+        self.datasetLabelList = [label for n, label in enumerate(self.datasetLabelList) if n not in failedIndexSet]
+        self.datasetNameList = [name for n, name in enumerate(self.datasetNameList) if n not in failedIndexSet]
+        self.srcImageNameList = [name for n, name in enumerate(self.srcImageNameList) if n not in failedIndexSet]
+
+        for txtName in SAMPLE_TXT_FILES:
+            txtFile = os.path.join(outFileDir, txtName)
+            if not os.path.exists(txtFile):
+                continue
+
+            with open(txtFile, 'r') as fd:
+                lines = fd.readlines()
+            with open(txtFile, 'w') as fd:
+                fd.writelines(line for line in lines if line.split(' ')[0] not in failedNameSet)
+        self.logger.warning('drop %d samples of %s, their images can not be read', len(failedIndexes), outFileDir)
+
     @staticmethod
     def SaveTxt(outFileDir, imageNameList, actionList, name='data.txt'):
         """
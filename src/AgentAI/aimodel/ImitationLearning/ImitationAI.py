@@ -10,7 +10,6 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 
 import time
 
-import numpy as np
 from aimodel.AIModel import AIModel
 
 from .MainImitationLearning import MainImitationLearning
@@ -35,7 +34,6 @@ class ImitationAI(AIModel):
 
         self.agentEnv = None
         self.imgList = []
-        self.featureConcat = []
 
         self.__timeCheckAI = -1
         self.__timeCheckAIWait = 1./self.actionPerSecond
@@ -70,7 +68,8 @@ class ImitationAI(AIModel):
         Start Episode
         """
         self.imgList = []
-        self.featureConcat = []
+        if self.useLstm:
+            self.network.ResetFeatureWindow()
         self.agentEnv.OnEpisodeStart()
 
     def OnEpisodeOver(self):
@@ -115,22 +114,11 @@ class ImitationAI(AIModel):
             self.logger.info("the predict action, action: %s", str(action))
             self.OutputResults(action, 'Net')
         else:
-
-            timeStep = self.network.timeStep
-            featureTmp = self.network.ExtractFeature(image)
-            self.featureConcat.append(featureTmp)
-
-            if len(self.featureConcat) < timeStep:
+            # one call of CNN and LSTM fused, the network keeps the features of the previous frames
+            action = self.network.PredictImageLSTM(image)
+            if action is None:
                 return
 
-            if len(self.featureConcat) > timeStep:
-                self.featureConcat.pop(0)
-
-            featureConcat = np.zeros([1, timeStep, featureTmp.shape[1]])
-            for n in range(timeStep):
-                featureConcat[0, n, :] = self.featureConcat[n]
-
-            action = self.network.PredictLSTM(featureConcat)
             self.logger.info("the predict action with lstm, action: %s", str(action))
             self.OutputResults(action, 'NetLstm')
 
@@ -8,11 +8,13 @@ For full details, please refer to the file "LICENSE.txt" which is provided as pa
 Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
+import hashlib
 import logging
 import os
 import shutil
 import cv2
 import random
+import time
 import numpy as np
 import tensorflow as tf
 
@@ -22,11 +24,13 @@ from tensorflow.python.keras.applications.resnet50 import conv_block, identity_b
 from tensorflow.python.keras.layers import Convolution2D, ZeroPadding2D
 from tensorflow.python.keras.layers import Input, Activation, BatchNormalization, Flatten, Conv2D
 from tensorflow.python.keras.layers import MaxPooling2D, Dense, GlobalAveragePooling2D, PReLU, LSTM
+from tensorflow.python.keras.layers import Concatenate, Reshape
 from tensorflow.python.keras.models import Model
 from util.util import ConvertToSDKFilePath
 
 from .ProgressReport import ProgressReport
-from .util import ObtainTaskDict, ReadTxt, DataGenerator, PreprocessImage, GetFeatureAndLabel
+from .util import ObtainTaskDict, ReadTxt, DataGenerator, PreprocessImage, GetFeatureAndLabel, GetNetImageSize, \
+    LoadDataset, DATASET_IMAGE_FILE
 
 K.set_image_data_format('channels_last')
 
@@ -35,6 +39,9 @@ DATA_ROOT_DIR = ConvertToSDKFilePath('')
 # if os.environ.get('AI_SDK_PATH') is not None:
 #     DATA_ROOT_DIR = os.environ.get('AI_SDK_PATH') + '/'
 
+# CNN features of the packed dataset for LSTM training, cached in the directory of the split
+FEATURE_CACHE_PREFIX = 'lstmFeature_'
+
 
 class Network(object):
     """
@@ -56,11 +63,12 @@ class Network(object):
         self.randomRatio = self.randomRatio * 1000
         self.useClassBalance = cfgData.get('useClassBalance')
         self.useResNet = cfgData.get('useResNet')
+        self.randomSeed = cfgData.get('randomSeed') or 0
+        self.dataWorkerNum = cfgData.get('dataWorkerNum') or 4
+        self.dataPrefetchNum = 2 * self.dataWorkerNum
+        self.cacheLSTMFeature = cfgData.get('cacheLSTMFeature') or False
 
-        if self.isSmallNet:
-            self.imageSize = 50
-        else:
-            self.imageSize = 150
+        self.imageSize = GetNetImageSize(self.isSmallNet)
 
         self.progressReport = ProgressReport()
         self.progressReport.Init()
@@ -102,12 +110,30 @@ class Network(object):
         self.netBatchSize = 32
         self.kerasModel = None
         self.netLSTMBatchSize = 64
+        self.netFeatureBatchSize = 256
         self.kerasModelLSTM = None
 
         self.trainLabel = None
         self.trainLabelOri = None
         self.kerasModelExtFea = None
 
+        # packed datasets of the splits, and the index of each image name in them
+        self.trainImages = None
+        self.trainImageIndexDict = None
+        self.testImages = None
+        self.testImageIndexDict = None
+
+        self.predictFunc = None
+        self.predictLSTMFunc = None
+        self.extractFeatureFunc = None
+        self.predictImageLSTMFunc = None
+
+        # ring buffer of the features of the last timeStep - 1 frames for online LSTM predict. Each feature is
+        # written twice, timeStep - 1 apart, so the window from the oldest frame is always a contiguous slice
+        self.featureWindow = None
+        self.featureWindowHead = 0
+        self.featureWindowCount = 0
+
     def Init(self):
         """
         Initialize function
@@ -136,17 +162,23 @@ class Network(object):
         Train network using "fit_generator" function
         """
         if self.useClassBalance:
-            self.trainFileName, self.trainLabel = ReadTxt(os.path.join(self.trainClassDir,
-                                                                       'data.txt'))
+            self.trainFileName, _ = ReadTxt(os.path.join(self.trainClassDir, 'data.txt'))
         else:
-            self.trainFileName, self.trainLabel = ReadTxt(os.path.join(self.trainClassDir,
-                                                                       'dataOri.txt'))
+            self.trainFileName, _ = ReadTxt(os.path.join(self.trainClassDir, 'dataOri.txt'))
 
-        self.trainFileNameOri, self.trainLabelOri = ReadTxt(os.path.join(self.trainClassDir,
-                                                                         'dataOri.txt'))
+        self.trainFileNameOri, _ = ReadTxt(os.path.join(self.trainClassDir, 'dataOri.txt'))
 
-        self.testFileName, self.testLabel = ReadTxt(os.path.join(self.testClassDir,
-                                                                 'data.txt'))
+        self.testFileName, _ = ReadTxt(os.path.join(self.testClassDir, 'data.txt'))
+
+        # the labels of the samples are gathered from the labels of the packed dataset
+        self.trainImages, trainDatasetLabel, self.trainImageIndexDict = LoadDataset(self.trainClassDir)
+        self.testImages, testDatasetLabel, self.testImageIndexDict = LoadDataset(self.testClassDir)
+        trainImageIndexes = np.array([self.trainImageIndexDict[fileName] for fileName in self.trainFileName])
+        testImageIndexes = np.array([self.testImageIndexDict[fileName] for fileName in self.testFileName])
+        self.trainLabel = trainDatasetLabel[trainImageIndexes]
+        self.trainLabelOri = trainDatasetLabel[[self.trainImageIndexDict[fileName]
+                                                for fileName in self.trainFileNameOri]]
+        self.testLabel = testDatasetLabel[testImageIndexes]
 
         nb_train_samples = len(self.trainFileName)
         nb_val_samples = len(self.testFileName)
@@ -182,20 +214,30 @@ class Network(object):
             validation_steps = int(nb_val_samples / self.netBatchSize)
             self.logger.info("the nb_val_samples is %d, batchSize: %d, validation_steps:%d",
                              nb_val_samples, self.netBatchSize, validation_steps)
+            # the generators prefetch minibatches by their own threads, the seed differs in each iteration
             trainHistory = kerasModel.fit_generator(DataGenerator(self.actionSpaceList,
-                                                                  imgFiles=self.trainFileName,
+                                                                  images=self.trainImages,
+                                                                  imageIndexes=trainImageIndexes,
                                                                   labels=self.trainLabel,
                                                                   batchSize=self.netBatchSize,
-                                                                  dim=self.imageSize),
+                                                                  workerNum=self.dataWorkerNum,
+                                                                  prefetchNum=self.dataPrefetchNum,
+                                                                  seed=[self.randomSeed, trainIter],
+                                                                  name='train'),
                                                     steps_per_epoch=int(nb_train_samples / self.netBatchSize),
                                                     epochs=1,
                                                     verbose=1,
                                                     validation_data=DataGenerator(self.actionSpaceList,
-                                                                                  imgFiles=self.testFileName,
+                                                                                  images=self.testImages,
+                                                                                  imageIndexes=testImageIndexes,
                                                                                   labels=self.testLabel,
                                                                                   batchSize=self.netBatchSize,
-                                                                                  dim=self.imageSize),
-                                                    validation_steps=validation_steps)
+                                                                                  workerNum=self.dataWorkerNum,
+                                                                                  prefetchNum=self.dataPrefetchNum,
+                                                                                  seed=[self.randomSeed, trainIter],
+                                                                                  name='valid'),
+                                                    validation_steps=validation_steps,
+                                                    workers=0)
             trainAcc, valAcc = self.GetAcc(trainHistory)
             valAccList.append(valAcc + trainAcc)
 
@@ -443,89 +485,144 @@ class Network(object):
 
         return trainAcc, valAcc
 
-    def ExtractNetFeature(self, kerasModelExtFea, fileNameList, label):
+    def ExtractNetFeature(self, kerasModelExtFea, fileNameList, label, images, imageIndexDict, cacheDir=None):
         """
-        Extract feature for LSTM
+        Extract feature for LSTM, the images are read from the packed dataset of the split
+        :return: the windows of timeStep features, which is a float32 array of [num, timeStep, featureDim],
+        the dictionary from image name to the index of the window ending at the image, and the dictionary
+        from image name to its label
         """
-        featureFromNet = dict()
+        netFeature = self._LoadNetFeature(kerasModelExtFea, images, cacheDir)
+
         labelFromNet = dict()
         for n, fileName in enumerate(fileNameList):
-            img = cv2.imread(fileName).astype('float')
-            imgOut = PreprocessImage(img)
-            featureTmp = np.zeros([1,
-                                   self.imageSize,
-                                   self.imageSize,
-                                   self.imageChannel])
-            featureTmp[0,] = imgOut
-            featureFromNet[fileName] = kerasModelExtFea.predict(featureTmp)
             labelFromNet[fileName] = label[n]
 
-        featureConcat, labelConcat = self._ConcatFeature(featureFromNet,
-                                                         labelFromNet)
-
-        return featureConcat, labelConcat
+        windows, windowIndexDict = self._ConcatFeature(netFeature, list(labelFromNet.keys()), imageIndexDict)
+        return windows, windowIndexDict, labelFromNet
 
     def _ExtractFeature(self, kerasModelExtFea):
         """
         Extract feature of training and test image set for LSTM
         """
-        featureTrainOri, labelTrainOri = self.ExtractNetFeature(kerasModelExtFea,
-                                                                self.trainFileNameOri,
-                                                                self.trainLabelOri)
+        featureTrainOri, windowIndexTrain, labelTrainOri = self.ExtractNetFeature(
+            kerasModelExtFea,
+            self.trainFileNameOri,
+            self.trainLabelOri,
+            self.trainImages,
+            self.trainImageIndexDict,
+            self.trainClassDir if self.cacheLSTMFeature else None)
 
         featureTrain, labelTrain = GetFeatureAndLabel(featureTrainOri,
+                                                      windowIndexTrain,
                                                       labelTrainOri,
                                                       self.trainFileName,
                                                       self.actionSpaceList)
 
-        featureTestOri, labelTestOri = self.ExtractNetFeature(kerasModelExtFea,
-                                                              self.testFileName,
-                                                              self.testLabel)
+        featureTestOri, windowIndexTest, labelTestOri = self.ExtractNetFeature(
+            kerasModelExtFea,
+            self.testFileName,
+            self.testLabel,
+            self.testImages,
+            self.testImageIndexDict,
+            self.testClassDir if self.cacheLSTMFeature else None)
 
         featureTest, labelTest = GetFeatureAndLabel(featureTestOri,
+                                                    windowIndexTest,
                                                     labelTestOri,
                                                     self.testFileName,
                                                     self.actionSpaceList)
 
         return featureTrain, labelTrain, featureTest, labelTest
 
-    def _ConcatFeature(self, featureFromNet, label):
+    def _LoadNetFeature(self, kerasModelExtFea, images, cacheDir):
         """
-        Concat feature from network for lstm
+        Load the CNN features of all images in the packed dataset from the cache in cacheDir, which is keyed
+        by the CNN weights and the images file, or compute and cache them
         """
-        featureConcat = dict()
-        labelConCat = dict()
-        for fileName in featureFromNet.keys():
-            _, fileNameTmp = os.path.split(fileName)
-            fileNameNum = int(fileNameTmp.split('_')[-1][:-4])
+        if cacheDir is None:
+            return self._ComputeNetFeature(kerasModelExtFea, images)
+
+        md5 = hashlib.md5()
+        for weight in kerasModelExtFea.get_weights():
+            md5.update(np.ascontiguousarray(weight).tobytes())
+        imageStat = os.stat(os.path.join(cacheDir, DATASET_IMAGE_FILE))
+        md5.update('{} {}'.format(imageStat.st_size, imageStat.st_mtime).encode())
+        cacheFile = os.path.join(cacheDir, '{}{}.npy'.format(FEATURE_CACHE_PREFIX, md5.hexdigest()))
 
-            noFile = 0
-            for n in range(self.timeStep):
-                fileNameNumTmp = fileNameNum - self.timeStep + n + 1
-                fileNameTmp = fileName[:-len(fileNameTmp.split('_')[-1])] +\
-                              str(fileNameNumTmp) +\
-                              fileName[-4:]
+        if os.path.exists(cacheFile):
+            self.logger.info('load LSTM features from %s', cacheFile)
+            return np.load(cacheFile, mmap_mode='r')
 
-                if fileNameTmp not in featureFromNet.keys():
-                    noFile = 1
-                    break
-                else:
-                    noFile = 0
+        netFeature = self._ComputeNetFeature(kerasModelExtFea, images)
 
-            if noFile:
-                continue
+        # only the features of the current weights are kept
+        for fileName in os.listdir(cacheDir):
+            if fileName.startswith(FEATURE_CACHE_PREFIX):
+                os.remove(os.path.join(cacheDir, fileName))
 
-            featureTmp = np.zeros([self.timeStep, self.featureDim])
-            for n in range(self.timeStep):
-                fileNameNumTmp = fileNameNum - self.timeStep + n + 1
-                fileNameTmp = fileName[:-len(fileNameTmp.split('_')[-1])] + \
-                              str(fileNameNumTmp) + fileName[-4:]
-                featureTmp[n, :] = featureFromNet[fileNameTmp]
+        tmpFile = cacheFile + '.tmp'
+        with open(tmpFile, 'wb') as f:
+            np.save(f, netFeature)
+        os.rename(tmpFile, cacheFile)
+        self.logger.info('save LSTM features to %s', cacheFile)
+        return netFeature
 
-            featureConcat[fileName] = featureTmp
-            labelConCat[fileName] = label[fileName]
+    def _ComputeNetFeature(self, kerasModelExtFea, images):
+        """
+        Run the CNN over batches of the packed dataset, in the order of the images file
+        """
+        extractFeatureFunc = self._CompileModel(kerasModelExtFea)
+        netFeature = np.zeros([len(images), self.featureDim], dtype=np.float32)
+        startTime = time.time()
+        for start in range(0, len(images), self.netFeatureBatchSize):
+            end = min(start + self.netFeatureBatchSize, len(images))
+            inputData = PreprocessImage(images[start:end].astype(np.float32))
+            netFeature[start:end] = extractFeatureFunc(inputData)[0]
 
-        return featureConcat, labelConCat
+        self.logger.info('extract LSTM features of %d images in %.2f s', len(images), time.time() - startTime)
+        return netFeature
+
+    @staticmethod
+    def _SplitFileName(fileName):
+        """
+        Split the image name, such as ../name_12.png, into the name without frame number, the frame number
+        and the extension
+        """
+        _, fileNameTmp = os.path.split(fileName)
+        frameName = fileNameTmp.split('_')[-1]
+        return fileName[:-len(frameName)], int(frameName[:-4]), fileName[-4:]
+
+    def _ConcatFeature(self, netFeature, fileNameList, imageIndexDict):
+        """
+        Concat feature from network for lstm. The features are sorted by video and frame number, so the window
+        of timeStep frames ending at an image is a strided view of the sorted features
+        """
+        splitNameList = [self._SplitFileName(fileName) for fileName in fileNameList]
+        order = sorted(range(len(fileNameList)), key=lambda n: splitNameList[n])
+
+        windowNum = len(order) - self.timeStep + 1
+        if windowNum <= 0:
+            return np.zeros([0, self.timeStep, self.featureDim], dtype=np.float32), dict()
+
+        sortedFeature = np.ascontiguousarray(
+            netFeature[[imageIndexDict[fileNameList[n]] for n in order]], dtype=np.float32)
+        windows = np.lib.stride_tricks.as_strided(
+            sortedFeature,
+            shape=(windowNum, self.timeStep, self.featureDim),
+            strides=(sortedFeature.strides[0], sortedFeature.strides[0], sortedFeature.strides[1]),
+            writeable=False)
+
+        # the names are unique, a window is valid if its first and last frames are timeStep - 1 frames apart
+        # in the same video
+        windowIndexDict = dict()
+        for index in range(windowNum):
+            firstPrefix, firstNum, firstExt = splitNameList[order[index]]
+            lastPrefix, lastNum, lastExt = splitNameList[order[index + self.timeStep - 1]]
+            if firstPrefix == lastPrefix and firstExt == lastExt and lastNum - firstNum == self.timeStep - 1:
+                windowIndexDict[fileNameList[order[index + self.timeStep - 1]]] = index
+
+        return windows, windowIndexDict
 
     def LoadWeights(self):
         """
@@ -533,26 +630,102 @@ class Network(object):
         """
         self.kerasModel = self.KerasModel()
         self.kerasModel.load_weights(self.modelPath + 'my_model_weights.h5')
-        self.kerasModelExtFea = Model(inputs=self.kerasModel.input,
-                                      outputs=self.kerasModel.get_layer('fc_feature').output)
         if self.useLstm is True:
             self.kerasModelLSTM = self.KerasModelLSTM()
             self.kerasModelLSTM.load_weights(self.modelPath + 'my_model_weights_LSTM.h5')
 
+        self.CompilePredict()
+
+    def CompilePredict(self):
+        """
+        Compile predict functions of the loaded CNN and LSTM, each runs the model once for the scores of all tasks
+        """
+        self.kerasModelExtFea = Model(inputs=self.kerasModel.input,
+                                      outputs=self.kerasModel.get_layer('fc_feature').output)
+
+        self.predictFunc = self._CompileModel(self.kerasModel)
+        self.extractFeatureFunc = self._CompileModel(self.kerasModelExtFea)
+        if self.kerasModelLSTM is not None:
+            self.predictLSTMFunc = self._CompileModel(self.kerasModelLSTM)
+            self.predictImageLSTMFunc = self._CompileImageLSTM()
+            self.ResetFeatureWindow()
+
+    @staticmethod
+    def _CompileModel(model):
+        """
+        Keras function of the model: a batch in, the list of outputs out, without the per call overhead of
+        Model.predict (batch split, callbacks and data adapter)
+        """
+        func = K.function(model.inputs, model.outputs)
+        return lambda inputData: func([inputData])
+
+    def _CompileImageLSTM(self):
+        """
+        Keras function of CNN and LSTM fused: the image and the features of the previous timeStep - 1 frames in,
+        the outputs of LSTM and the feature of the image out
+        """
+        feature = self.kerasModelExtFea.output
+        window = Reshape((1, self.featureDim))(feature)
+        inputs = [self.kerasModelExtFea.input]
+        if self.timeStep > 1:
+            prevFeatureInput = Input(shape=(self.timeStep - 1, self.featureDim))
+            window = Concatenate(axis=1)([prevFeatureInput, window])
+            inputs.append(prevFeatureInput)
+
+        outputs = self.kerasModelLSTM(window)
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+        return K.function(inputs, outputs + [feature])
+
+    def ResetFeatureWindow(self):
+        """
+        Clear the features of the previous frames, such as at the start of an episode
+        """
+        self.featureWindow = np.zeros([1, 2 * (self.timeStep - 1), self.featureDim], dtype=np.float32)
+        self.featureWindowHead = 0
+        self.featureWindowCount = 0
+
+    def PredictImageLSTM(self, image):
+        """
+        Output action given a test image based on CNN and LSTM, with the features of the previous frames.
+        Return None until the features of timeStep frames are obtained.
+        """
+        inputData = [self.PrepareData(image)]
+        prevNum = self.timeStep - 1
+        if prevNum > 0:
+            inputData.append(self.featureWindow[:, self.featureWindowHead:self.featureWindowHead + prevNum])
+
+        outputs = self.predictImageLSTMFunc(inputData)
+        self.featureWindowCount += 1
+
+        if prevNum > 0:
+            feature = outputs[-1][0]
+            self.featureWindow[0, self.featureWindowHead] = feature
+            self.featureWindow[0, self.featureWindowHead + prevNum] = feature
+            self.featureWindowHead = (self.featureWindowHead + 1) % prevNum
+
+        if self.featureWindowCount < self.timeStep:
+            return None
+        return self._ChooseTaskAction(outputs[:-1])
+
     def Predict(self, image):
         """
         Output action given a test image based on CNN
         """
         inputData = self.PrepareData(image)
+        actionScores = self.predictFunc(inputData)
+        return self._ChooseTaskAction(actionScores)
 
+    def _ChooseTaskAction(self, actionScores):
+        """
+        Choose action of each task from the outputs of the task heads
+        """
         if len(self.taskList) == 2:
             predAction = list()
             for n in range(len(self.taskList)):
-                actionScore = self.kerasModel.predict(inputData)[n][0]
-                predAction.append(self.ChooseAction(actionScore, n))
+                predAction.append(self.ChooseAction(actionScores[n][0], n))
         else:
-            actionScore = self.kerasModel.predict(inputData)[0]
-            predAction = self.ChooseAction(actionScore, 0)
+            predAction = self.ChooseAction(actionScores[0][0], 0)
         return predAction
 
     def PrepareData(self, image):
@@ -567,7 +740,7 @@ class Network(object):
             image = cv2.resize(image, (self.imageSize, self.imageSize))
 
         image = PreprocessImage(image)
-        inputData = np.zeros([1, self.imageSize, self.imageSize, self.imageChannel])
+        inputData = np.zeros([1, self.imageSize, self.imageSize, self.imageChannel], dtype=np.float32)
         inputData[0, :, :, :] = image
         return inputData
 
@@ -575,16 +748,8 @@ class Network(object):
         """
         Output action given a test feature based on LSTM
         """
-        if len(self.taskList) == 2:
-            predAction = list()
-            for n in range(len(self.taskList)):
-                actionScore = self.kerasModelLSTM.predict(inputData)[n][0]
-                predAction.append(self.ChooseAction(actionScore, n))
-        else:
-            actionScore = self.kerasModelLSTM.predict(inputData)[0]
-            predAction = self.ChooseAction(actionScore, 0)
-
-        return predAction
+        actionScores = self.predictLSTMFunc(np.asarray(inputData, dtype=np.float32))
+        return self._ChooseTaskAction(actionScores)
 
     def ChooseAction(self, actionScore, taskIndex):
         """
@@ -631,5 +796,5 @@ class Network(object):
         Extract feature of the input image
         """
         inputData = self.PrepareData(image)
-        feature = self.kerasModelExtFea.predict(inputData)
+        feature = self.extractFeatureFunc(inputData)[0]
         return feature
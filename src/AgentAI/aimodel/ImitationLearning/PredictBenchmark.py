@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Per frame latency of the imitation learning inference, Model.predict per task head (the legacy path) vs the
+compiled predict function which runs the model once for all heads, for each network type. For LSTM the compiled
+path runs CNN and LSTM fused in one call.
+Run from src/AgentAI: python -m aimodel.ImitationLearning.PredictBenchmark
+"""
+
+import argparse
+import os
+import time
+
+# benchmark on CPU, must be set before tensorflow is imported
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+import numpy as np
+
+from .Network import Network
+
+MODEL_TYPE_LIST = ['SmallNet50', 'SmallNet150', 'ResNet', 'LSTM']
+
+
+def CreateNetwork(modelType, taskCount, actionCount):
+    """
+    Create a network of model type with random weights
+    """
+    actionDefine = list()
+    for task in range(taskCount):
+        for action in range(actionCount):
+            actionDefine.append({'task': [task], 'name': 'task{}_action{}'.format(task, action), 'prior': 1})
+
+    cfgData = {
+        'isSmallNet': modelType in ('SmallNet50', 'LSTM'),
+        'useResNet': modelType == 'ResNet',
+        'useLstm': modelType == 'LSTM',
+        'isMax': True,
+        'timeStep': 5,
+        'actionAheadNum': 1,
+        'classImageTimes': 1,
+        'inputHeight': 360,
+        'inputWidth': 640,
+        'actionDefine': actionDefine,
+    }
+    network = Network(None, None, None, None, cfgData)
+    network.kerasModel = network.KerasModel()
+    if network.useLstm:
+        network.kerasModelLSTM = network.KerasModelLSTM()
+    network.CompilePredict()
+    return network
+
+
+def _LegacyPredict(network, image):
+    """
+    The predict step before compiling: Model.predict once per task head
+    """
+    inputData = network.PrepareData(image)
+    if len(network.taskList) == 2:
+        return [network.ChooseAction(network.kerasModel.predict(inputData)[n][0], n)
+                for n in range(len(network.taskList))]
+    return network.ChooseAction(network.kerasModel.predict(inputData)[0], 0)
+
+
+def _LegacyPredictLSTM(network, image, featureConcat):
+    feature = network.kerasModelExtFea.predict(network.PrepareData(image))
+    featureConcat = np.concatenate([featureConcat[:, 1:], feature[:, np.newaxis]], 1)
+    if len(network.taskList) == 2:
+        return [network.ChooseAction(network.kerasModelLSTM.predict(featureConcat)[n][0], n)
+                for n in range(len(network.taskList))]
+    return network.ChooseAction(network.kerasModelLSTM.predict(featureConcat)[0], 0)
+
+
+def RunBenchmark(network, legacy, imageList, warmUp):
+    """
+    Latency in ms of each frame
+    """
+    featureConcat = np.zeros([1, network.timeStep, network.featureDim], dtype=np.float32)
+    if network.useLstm:
+        network.ResetFeatureWindow()
+    latencyList = list()
+    for index, image in enumerate(imageList):
+        startTime = time.time()
+        if network.useLstm:
+            if legacy:
+                _LegacyPredictLSTM(network, image, featureConcat)
+            else:
+                network.PredictImageLSTM(image)
+        else:
+            if legacy:
+                _LegacyPredict(network, image)
+            else:
+                network.Predict(image)
+
+        if index >= warmUp:
+            latencyList.append((time.time() - startTime) * 1000)
+    return np.array(latencyList)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='imitation learning predict benchmark')
+    parser.add_argument('--models', type=str, nargs='+', default=MODEL_TYPE_LIST, choices=MODEL_TYPE_LIST,
+                        help='network types')
+    parser.add_argument('--tasks', type=int, default=2, choices=[1, 2], help='number of task heads')
+    parser.add_argument('--actions', type=int, default=4, help='number of actions of each task')
+    parser.add_argument('--frames', type=int, default=200, help='number of predicted frames')
+    parser.add_argument('--warm-up', type=int, default=10, help='number of frames not counted')
+    args = parser.parse_args()
+
+    randomState = np.random.RandomState(0)
+    imageList = [randomState.randint(0, 256, (360, 640, 3)).astype(np.uint8)
+                 for _ in range(args.frames + args.warm_up)]
+
+    for modelType in args.models:
+        network = CreateNetwork(modelType, args.tasks, args.actions)
+        for legacy in (True, False):
+            latency = RunBenchmark(network, legacy, imageList, args.warm_up)
+            print('{} {}: avg {:.2f} ms, p50 {:.2f} ms, p99 {:.2f} ms'.format(
+                modelType, 'Model.predict per head' if legacy else 'compiled predict',
+                latency.mean(), np.percentile(latency, 50), np.percentile(latency, 99)))
+
+
+if __name__ == '__main__':
+    main()
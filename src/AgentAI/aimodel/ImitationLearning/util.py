@@ -8,13 +8,20 @@ For full details, please refer to the file "LICENSE.txt" which is provided as pa
 Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
+import logging
+import os
 import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tensorflow import keras
 
-import cv2
-
 import numpy as np
 
+# packed dataset of a split: uint8 images resized to the network input, and the labels of dataOri.txt
+DATASET_IMAGE_FILE = 'images.npy'
+DATASET_LABEL_FILE = 'labels.npy'
+
 
 def ShuffleArray(feature, label):
     """
@@ -146,48 +153,108 @@ def ObtainTaskDict(actionDefine):
     return taskList, taskActionDict, actionNameDict
 
 
-def DataGenerator(actionSpaceList, imgFiles=None, labels=None, batchSize=64, dim=150):
+def GetNetImageSize(isSmallNet):
     """
-    Generator for fit_generator
-    :param actionSpaceList: action number for different tasks, which is a list.
-    :param imgFiles: list of image file name.
-    :param labels: the classes for different tasks, whicn is an array.
-    :param batchSize: the image number for one batch.
-    :param dim: the size of input image. The image is resized to [dim, dim]
-    :return: the batch of input images, the one-hot label array for different tasks.
+    Get the size of the network input image
+    :param isSmallNet: whether use small network.
+    :return: the image is resized to [size, size]
+    """
+    if isSmallNet:
+        return 50
+    return 150
+
+
+def LoadDataset(classDir):
+    """
+    Load the packed dataset of a split written by GenerateImageSamples
+    :param classDir: the directory of the split, such as Class_train.
+    :return: the images, which is a memory mapped uint8 array of [num, size, size, 3], the labels,
+    which is an array of [num, taskNum], and the dictionary from image name in the txt files to its
+    index in images and labels.
+    """
+    images = np.load(os.path.join(classDir, DATASET_IMAGE_FILE), mmap_mode='r')
+    labels = np.load(os.path.join(classDir, DATASET_LABEL_FILE))
+    fileNameList, _ = ReadTxt(os.path.join(classDir, 'dataOri.txt'))
+    imageIndexDict = {fileName: index for index, fileName in enumerate(fileNameList)}
+    return images, labels, imageIndexDict
+
+
+def _MinibatchIndexGenerator(sampleNum, batchSize, seed):
+    """
+    Generate the epoch, the minibatch number in the epoch and the sample indexes of each minibatch.
+    The samples of an epoch are shuffled by the seed and the epoch, so the order is reproducible.
     """
-    m = len(imgFiles)
-    numMinibatches = int(m / batchSize)
+    numMinibatches = int(sampleNum / batchSize)
+    epoch = 0
     while 1:
-        permutation = list(np.random.permutation(m))
+        permutation = np.random.RandomState(np.append(seed, epoch)).permutation(sampleNum)
         for i in range(numMinibatches):
-            minibatchesX = np.empty((batchSize, dim, dim, 3))
-            minibatchesY0 = np.empty((batchSize), dtype=int)
-            minibatchesY1 = np.empty((batchSize), dtype=int)
+            # sorted samples read the memory mapped images in file order
+            yield epoch, i, np.sort(permutation[i * batchSize:(i + 1) * batchSize])
+        epoch += 1
 
-            index = permutation[i * batchSize:(i + 1) * batchSize]
-            for j, ind in enumerate(index):
-                img = cv2.imread(imgFiles[ind]).astype('float')
-                imgOut = PreprocessImage(img)
-                minibatchesX[j,] = imgOut
-                if len(actionSpaceList) == 1:
-                    minibatchesY0[j] = labels[ind, 0]
 
-                else:
-                    minibatchesY0[j] = labels[ind, 0]
-                    minibatchesY1[j] = labels[ind, 1]
+def _LoadMinibatch(actionSpaceList, images, imageIndexes, labels, index):
+    """
+    Gather the images of a minibatch as float32 and the one-hot labels for different tasks
+    """
+    minibatchesX = PreprocessImage(images[imageIndexes[index]].astype(np.float32))
+    minibatchesY0 = keras.utils.to_categorical(labels[index, 0].astype(int),
+                                               num_classes=actionSpaceList[0])
+    if len(actionSpaceList) == 1:
+        return minibatchesX, minibatchesY0
 
-            minibatchesY0 = keras.utils.to_categorical(minibatchesY0,
-                                                       num_classes=actionSpaceList[0])
+    minibatchesY1 = keras.utils.to_categorical(labels[index, 1].astype(int),
+                                               num_classes=actionSpaceList[1])
+    return minibatchesX, [minibatchesY0, minibatchesY1]
 
-            if len(actionSpaceList) == 2:
-                minibatchesY1 = keras.utils.to_categorical(minibatchesY1,
-                                                           num_classes=actionSpaceList[1])
 
-            if len(actionSpaceList) == 1:
-                yield minibatchesX, minibatchesY0
-            else:
-                yield minibatchesX, [minibatchesY0, minibatchesY1]
+def DataGenerator(actionSpaceList, images=None, imageIndexes=None, labels=None, batchSize=64,
+                  workerNum=4, prefetchNum=8, seed=0, name='train'):
+    """
+    Generator for fit_generator, the minibatches are gathered by worker threads ahead of training.
+    Use it with workers=0 in fit_generator, the prefetch is done here.
+    :param actionSpaceList: action number for different tasks, which is a list.
+    :param images: the packed uint8 images of the split, which is an array of [num, dim, dim, 3].
+    :param imageIndexes: the index in images of each sample, which is an array.
+    :param labels: the classes for different tasks, whicn is an array.
+    :param batchSize: the image number for one batch.
+    :param workerNum: the number of threads gathering minibatches.
+    :param prefetchNum: the max number of minibatches prepared ahead.
+    :param seed: the random seed of the sample order, an int or a list of int. The minibatches
+    do not depend on workerNum.
+    :param name: the name of the generator in the log of input stall time.
+    :return: the batch of float32 input images, the one-hot label array for different tasks.
+    """
+    logger = logging.getLogger('agent')
+    numMinibatches = int(len(imageIndexes) / batchSize)
+    indexGenerator = _MinibatchIndexGenerator(len(imageIndexes), batchSize, seed)
+    executor = ThreadPoolExecutor(max(1, workerNum))
+    futures = deque()
+    stallTime = 0.
+    epochStartTime = time.time()
+    try:
+        while 1:
+            while len(futures) < max(1, prefetchNum):
+                epoch, i, index = next(indexGenerator)
+                futures.append((epoch, i, executor.submit(_LoadMinibatch, actionSpaceList, images,
+                                                          imageIndexes, labels, index)))
+
+            epoch, i, future = futures.popleft()
+            waitTime = time.time()
+            minibatch = future.result()
+            stallTime += time.time() - waitTime
+
+            if i == numMinibatches - 1:
+                epochTime = time.time() - epochStartTime
+                logger.info('%s data epoch %d: input stall %.2f s of %.2f s (%.1f%%)', name, epoch,
+                            stallTime, epochTime, 100 * stallTime / max(epochTime, 1e-6))
+                stallTime = 0.
+                epochStartTime = time.time()
+
+            yield minibatch
+    finally:
+        executor.shutdown(wait=False)
 
 
 def PreprocessImage(img):
@@ -201,10 +268,11 @@ def PreprocessImage(img):
     return imgOut
 
 
-def GetFeatureAndLabel(feature, label, fileName, actionSpaceList):
+def GetFeatureAndLabel(feature, featureIndex, label, fileName, actionSpaceList):
     """
     Get feature and label
-    :param feature: the original feature for each image, which is a dictionary. The key
+    :param feature: the feature windows, which is an array of [num, timeStep, featureDim].
+    :param featureIndex: the index of the window of each image, which is a dictionary. The key
     is the name of image file.
     :param label: the label of feature, which is a dictionary. The key
     is the name of image file.
@@ -212,31 +280,15 @@ def GetFeatureAndLabel(feature, label, fileName, actionSpaceList):
     :param actionSpaceList: action number for different tasks, which is a list.
     :return: the feature array and one-hot label list for multi-task
     """
-    for key in feature.keys():
-        timeStep = feature[key].shape[0]
-        featureDim = feature[key].shape[1]
-        taskNum = label[key].shape[0]
-        break
-    featureMulti = np.zeros([len(fileName), timeStep, featureDim])
-    labelMulti = np.zeros([len(fileName), taskNum])
-
-    index = list()
-    for n, fileNameTmp in enumerate(fileName):
-        if fileNameTmp in feature.keys():
-            featureMulti[n, :] = feature[fileNameTmp]
-            labelMulti[n, :] = label[fileNameTmp]
-            index.append(n)
-        else:
-            continue
-
-    if len(index) == 0:
+    fileNameOut = [fileNameTmp for fileNameTmp in fileName if fileNameTmp in featureIndex]
+    if len(fileNameOut) == 0:
         return None, None
 
-    featureMultiOut = featureMulti[index, :]
-    labelMultiOut = labelMulti[index, :]
+    featureMultiOut = feature[[featureIndex[fileNameTmp] for fileNameTmp in fileNameOut]]
+    labelMultiOut = np.array([label[fileNameTmp] for fileNameTmp in fileNameOut])
 
     labelMultiVecOut = list()
-    for n in range(taskNum):
+    for n in range(labelMultiOut.shape[1]):
         labelMultiVecOut.append(keras.utils.to_categorical(labelMultiOut[:, n],
                                                            num_classes=actionSpaceList[n]))
     return featureMultiOut, labelMultiVecOut
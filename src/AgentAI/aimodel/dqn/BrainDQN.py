@@ -13,6 +13,7 @@ import random
 import numpy as np
 
 from .QNetwork import QNetwork
+from .DQNLearner import DQNLearner
 
 class BrainDQN(object):
     """
@@ -35,18 +36,45 @@ class BrainDQN(object):
         self.stateStep = 0
         self.qNetWork = QNetwork(args)
 
+        self.learner = None
+        if args.get('async_learn', False):
+            self.learner = DQNLearner(self.qNetWork,
+                                      actorSyncStep=args.get('actor_sync_step', 100),
+                                      maxPendingStep=args.get('learner_max_pending_step', 10))
+            self.learner.start()
+
         self.currentState = None
 
         self.logger.debug("the observeState is {}".format( self.observeState))
 
     def Learn(self):
         """
-        QNetwork learning, trian DQN network
+        QNetwork learning, trian DQN network, only grant a train step to the learner thread in async learn mode
         """
         if self.stateStep > self.observeState:
             self.logger.debug("begin to train the model, stateStep:{}, observeState:{}".format(self.stateStep
                               , self.observeState))
-            self.qNetWork.Train()
+            if self.learner is not None:
+                self.learner.AddStep()
+            else:
+                self.qNetWork.Train()
+
+    def GetLearnerStat(self):
+        """
+        Statistics of the learner thread, None in sync learn mode
+        """
+        if self.learner is None:
+            return None
+        return self.learner.GetStat()
+
+    def Finish(self):
+        """
+        Stop the learner thread and checkpoint the replay memory
+        """
+        if self.learner is not None:
+            self.learner.Stop()
+            self.learner = None
+        self.qNetWork.SaveMemory()
 
     def GetAction(self, extraEpsilon=0.):
         """
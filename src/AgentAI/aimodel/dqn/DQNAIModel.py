@@ -20,6 +20,9 @@ from .BrainDQN import BrainDQN
 
 LEARN_CFG_FILE = 'cfg/task/agent/DQNLearning.json'
 
+# log the actor latency and the learner statistics every METRICS_LOG_STEP frames
+METRICS_LOG_STEP = 500
+
 class DQNAIModel(AIModel):
     """
     DQN AIModel implement, train AI model and predict action
@@ -37,6 +40,9 @@ class DQNAIModel(AIModel):
         self.brain = None
         self.testAgent = False
         self.lastFrameTime = None
+        self.actorLatencySum = 0.
+        self.actorLatencyMax = 0.
+        self.actorLatencyCount = 0
 
 
     def Init(self, agentEnv):
@@ -66,7 +72,8 @@ class DQNAIModel(AIModel):
         """
         Exit DQN AIModel after object used
         """
-        pass
+        if self.brain is not None:
+            self.brain.Finish()
 
     def _LoadDQNPrams(self):
         learnArgs = {}
@@ -102,6 +109,10 @@ class DQNAIModel(AIModel):
             learnArgs['checkpoint_path'] = config['network']['checkPointPath']
             learnArgs['train_frame_rate'] = config['network']['trainFrameRate']
             learnArgs['run_type'] = config['network']['runType']
+            learnArgs['async_learn'] = bool(config['network'].get('asyncLearn', 0))
+            learnArgs['actor_sync_step'] = config['network'].get('actorSyncStep', 100)
+            learnArgs['learner_max_pending_step'] = config['network'].get('learnerMaxPendingStep', 10)
+            learnArgs['memory_path'] = config['network'].get('memoryPath', '')
 
             self.logger.info("the learnArgs is {0}".format(learnArgs))
 
@@ -149,6 +160,8 @@ class DQNAIModel(AIModel):
     def _ProcArgs(self, learnArgs):
         learnArgs['action_space'] = self.actionSpace
         learnArgs['checkpoint_path'] = util.ConvertToSDKFilePath(learnArgs['checkpoint_path'])
+        if learnArgs['memory_path']:
+            learnArgs['memory_path'] = util.ConvertToSDKFilePath(learnArgs['memory_path'])
 
         runType = learnArgs['run_type']
         if runType == 0:
@@ -156,6 +169,8 @@ class DQNAIModel(AIModel):
         elif runType == 1:
             self.testAgent = True
             learnArgs['memory_size'] = 200
+            # do not overwrite the replay memory of training on disk
+            learnArgs['memory_path'] = ''
             learnArgs['initial_epsilon'] = 0.001
         else:
             pass
@@ -163,6 +178,7 @@ class DQNAIModel(AIModel):
     def _FrameStep(self, action):
         if self.agentEnv.IsTrainable() is True:
             self.agentEnv.DoAction(action)
+        self._UpdateActorLatency()
 
         #train the q-network
         begin = time.time()
@@ -193,6 +209,30 @@ class DQNAIModel(AIModel):
 
         return img, reward, terminal
 
+    def _UpdateActorLatency(self):
+        # actor latency: from the state got to the action done, include action predicting
+        if self.lastFrameTime is None:
+            return
+
+        latency = time.time() - self.lastFrameTime
+        self.actorLatencySum += latency
+        self.actorLatencyMax = max(self.actorLatencyMax, latency)
+        self.actorLatencyCount += 1
+        if self.actorLatencyCount < METRICS_LOG_STEP:
+            return
+
+        self.logger.info('actor latency avg: {:.2f} ms, max: {:.2f} ms'.format(
+            1000 * self.actorLatencySum / self.actorLatencyCount, 1000 * self.actorLatencyMax))
+        learnerStat = self.brain.GetLearnerStat()
+        if learnerStat is not None:
+            self.logger.info('learner trainStep: {}, {:.2f} steps/s, train time avg: {:.2f} ms, loss: {:.6f}'.format(
+                learnerStat['trainStep'], learnerStat['stepsPerSec'], learnerStat['avgTrainMS'],
+                learnerStat['loss']))
+
+        self.actorLatencySum = 0.
+        self.actorLatencyMax = 0.
+        self.actorLatencyCount = 0
+
     def _RunOneStep(self):
         if self.firstRunning == 0:
             action = np.zeros(self.actionSpace, np.uint8)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import logging
+import threading
+import time
+
+WAIT_STEP_TIMEOUT = 0.1
+
+
+class DQNLearner(threading.Thread):
+    """
+    Background learner of DQN, trains the Q network on the replay memory while the frame loop
+    keeps acting, and periodically syncs the trained weights to the actor Q network
+    """
+
+    def __init__(self, qNetWork, actorSyncStep, maxPendingStep):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.logger = logging.getLogger('agent')
+
+        self.__qNetWork = qNetWork
+        self.__actorSyncStep = max(1, actorSyncStep)
+        self.__maxPendingStep = max(1, maxPendingStep)
+        self.__exited = False
+
+        # one train step is granted for each acting step, so the learner never trains more often
+        # than the synchronous mode, but it may fall behind when a train step is slower than a frame
+        self.__stepCond = threading.Condition()
+        self.__pendingStep = 0
+
+        self.__trainStep = 0
+        self.__trainTime = 0.
+        self.__statStep = 0
+        self.__statTime = time.time()
+
+    def run(self):
+        # Tensor.eval and Operation.run use the default session, which is thread local
+        with self.__qNetWork.session.as_default():
+            while not self.__exited:
+                if not self._WaitStep():
+                    continue
+
+                begin = time.time()
+                if not self.__qNetWork.Train():
+                    continue
+
+                self.__trainTime += time.time() - begin
+                self.__trainStep += 1
+                if self.__trainStep % self.__actorSyncStep == 0:
+                    self.__qNetWork.SyncActorNet()
+
+        self.logger.info('DQN learner exit, trainStep: {}'.format(self.__trainStep))
+
+    def AddStep(self):
+        """
+        Grant one train step to the learner, called by the frame loop after each acting step
+        """
+        with self.__stepCond:
+            if self.__pendingStep < self.__maxPendingStep:
+                self.__pendingStep += 1
+            self.__stepCond.notify()
+
+    def Stop(self):
+        """
+        Stop the learner and wait the running train step finished
+        """
+        self.__exited = True
+        with self.__stepCond:
+            self.__stepCond.notify()
+        if self.is_alive():
+            self.join()
+
+    def GetStat(self):
+        """
+        Learner statistics since the last call
+        :return: dict of trainStep, stepsPerSec, avgTrainMS and loss of the last train step
+        """
+        now = time.time()
+        stepNum = self.__trainStep - self.__statStep
+        stepsPerSec = stepNum / max(now - self.__statTime, 1e-6)
+        avgTrainMS = 1000. * self.__trainTime / stepNum if stepNum > 0 else 0.
+
+        self.__statStep = self.__trainStep
+        self.__statTime = now
+        self.__trainTime = 0.
+        return {'trainStep': self.__trainStep, 'stepsPerSec': stepsPerSec, 'avgTrainMS': avgTrainMS,
+                'loss': self.__qNetWork.lastCost}
+
+    def _WaitStep(self):
+        with self.__stepCond:
+            if self.__pendingStep == 0:
+                self.__stepCond.wait(WAIT_STEP_TIMEOUT)
+            if self.__pendingStep == 0 or self.__exited:
+                return False
+            self.__pendingStep -= 1
+            return True
@@ -9,12 +9,17 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
 import logging
+import threading
+import time
 
 import tensorflow as tf
 import numpy as np
 
 from .ReplayMemory import ReplayMemory
 
+# log the train speed and loss every TRAIN_LOG_STEP train steps
+TRAIN_LOG_STEP = 100
+
 class QNetwork(object):
     """
     Q-Network implement
@@ -37,22 +42,30 @@ class QNetwork(object):
         self.gpuMemoryGrowth = args['gpu_memory_growth']
         self.checkPointPath = args['checkpoint_path']
         self.showImgState = args['show_img_state']
+        self.asyncLearn = args.get('async_learn', False)
 
         self.trainStep = 0
         self.trainStepBase = 0
+        self.lastCost = 0.
+        self.trainLogTime = time.time()
         self.logger = logging.getLogger('agent')
 
+        # the replay memory is shared by the frame loop and the learner thread in async learn mode
+        self.memoryLock = threading.Lock()
+
         # init replay memory
         self.memory = ReplayMemory(maxSize=self.memorySize, \
                             termDelayFrame=self.termDelayFrame, \
                             stateRecentFrame=self.stateRecentFrame, \
-                            showState=self.showImgState)
+                            showState=self.showImgState, \
+                            memoryPath=args.get('memory_path'))
 
         #init q-network
         self.Create()
 
-        # saving and loading networks
-        self.saver = tf.train.Saver()
+        # saving and loading networks, the actor network is only a copy of the current network
+        saveVars = [var for var in tf.global_variables() if not var.name.startswith('Actor_Q_Network')]
+        self.saver = tf.train.Saver(saveVars)
 
         #set gpu memory percent
         gpuConfig = tf.ConfigProto()
@@ -67,6 +80,7 @@ class QNetwork(object):
 
         #try to load params from checkpoint
         self.Restore()
+        self.SyncActorNet()
 
     def Create(self):
         """
@@ -90,6 +104,18 @@ class QNetwork(object):
                 syncOp = paramsT.assign(params)
                 self.copyTargetQNet.append(syncOp)
 
+        # actor Q network, used to predict action while the current network is trained by the learner
+        self.copyActorQNet = []
+        if self.asyncLearn:
+            with tf.name_scope('Actor_Q_Network'):
+                self.stateInputA, self.QValueA, self.networkParamsA = self.BuildNet()
+
+            with tf.name_scope('copy_actor'):
+                for paramsA, params in zip(self.networkParamsA, self.networkParams):
+                    self.copyActorQNet.append(paramsA.assign(params))
+        else:
+            self.stateInputA, self.QValueA = self.stateInput, self.QValue
+
         # cost operation
         with tf.name_scope('cost'):
             self.actionInput = tf.placeholder("float", [None, self.actionSpace])
@@ -105,52 +131,37 @@ class QNetwork(object):
     def Train(self):
         """
         Train Q-Network use replay memory
+        :return: True if the network is trained, False if the memory is not enough
         """
         # Step 1: obtain random minibatch from replay memory
         self.logger.debug("begin to train, trainStep:{}".format(self.trainStep))
-        minibatch = self.memory.Random(self.miniBatchSize)
+        with self.memoryLock:
+            minibatch = self.memory.Random(self.miniBatchSize)
         if len(minibatch) == 0:
             self.logger.warning("the size of memory hasn't reach the mini bach")
-            return
+            return False
 
         self.logger.debug("the size of memory reach the mini bach")
-        stateBatch = [data[0] for data in minibatch]
-        actionBatch = [data[1] for data in minibatch]
-        rewardBatch = [data[2] for data in minibatch]
-        nextStateBatch = [data[3] for data in minibatch]
-        terminalBatch = [data[4] for data in minibatch]
-
-        # Step 2: calculate y label
-        yBatch = []
+        stateBatch, actionBatch, rewardBatch, nextStateBatch, terminalBatch = self._StackBatch(minibatch)
+
+        # Step 2: calculate y label, the forward passes of next state run in one session call
         if self.trainWithDoubleQ:
-            qValueBatch = self.QValue.eval(feed_dict={self.stateInput : nextStateBatch})
-            actionIndexBatch = [np.argmax(qv) for qv in qValueBatch]
-            qValueTBatch = self.QValueT.eval(feed_dict={self.stateInputT : nextStateBatch})
-
-            min_batch_size = int(self.miniBatchSize)
-            for i in range(0, min_batch_size):
-                terminal = terminalBatch[i]
-                if terminal:
-                    yBatch.append(rewardBatch[i])
-                else:
-                    actionIndex = actionIndexBatch[i]
-                    yBatch.append(rewardBatch[i] + self.gama * qValueTBatch[i][actionIndex])
+            qValueBatch, qValueTBatch = self.session.run([self.QValue, self.QValueT],
+                                                         feed_dict={self.stateInput: nextStateBatch,
+                                                                    self.stateInputT: nextStateBatch})
+            actionIndexBatch = np.argmax(qValueBatch, axis=1)
+            nextQValue = qValueTBatch[np.arange(len(actionIndexBatch)), actionIndexBatch]
         else:
-            qValueBatch = self.QValueT.eval(feed_dict={self.stateInputT : nextStateBatch})
-            for i in range(0, self.miniBatchSize):
-                terminal = terminalBatch[i]
-                if terminal:
-                    yBatch.append(rewardBatch[i])
-                else:
-                    yBatch.append(rewardBatch[i] + self.gama * np.max(qValueBatch[i]))
-
-        #self.cost(yBatch)
-
-        # Step 3: optimize network params
-        self.trainOptimizer.run(feed_dict={self.yInput: yBatch,
-                                           self.actionInput: actionBatch,
-                                           self.stateInput: stateBatch})
+            qValueTBatch = self.session.run(self.QValueT, feed_dict={self.stateInputT: nextStateBatch})
+            nextQValue = np.max(qValueTBatch, axis=1)
+        yBatch = rewardBatch + self.gama * nextQValue * (1. - terminalBatch)
 
+        # Step 3: optimize network params, once per train step
+        _, cost = self.session.run([self.trainOptimizer, self.cost],
+                                   feed_dict={self.yInput: yBatch,
+                                              self.actionInput: actionBatch,
+                                              self.stateInput: stateBatch})
+        self.lastCost = float(cost)
 
         # save network every 10000 iteration
         if self.trainStep % 10000 == 0 and self.trainStep != 0:
@@ -161,32 +172,67 @@ class QNetwork(object):
         if self.trainStep % self.qnetUpdateStep == 0:
             self.session.run(self.copyTargetQNet)
 
-        self.session.run([self.trainOptimizer, self.cost], feed_dict={self.yInput: yBatch,
-                                                                      self.actionInput: actionBatch,
-                                                                      self.stateInput: stateBatch})
         self.trainStep += 1
         self.logger.debug("the train finished, trainStep: %d", self.trainStep)
+        if self.trainStep % TRAIN_LOG_STEP == 0:
+            self._LogTrainSpeed()
+        return True
+
+    @staticmethod
+    def _StackBatch(minibatch):
+        """
+        Convert the minibatch arrays into contiguous float32 arrays to feed
+        """
+        stateBatch, actionBatch, rewardBatch, nextStateBatch, terminalBatch = minibatch[:5]
+        return (np.ascontiguousarray(stateBatch, dtype=np.float32),
+                actionBatch.astype(np.float32),
+                rewardBatch.astype(np.float32),
+                np.ascontiguousarray(nextStateBatch, dtype=np.float32),
+                terminalBatch.astype(np.float32))
+
+    def _LogTrainSpeed(self):
+        now = time.time()
+        stepsPerSec = TRAIN_LOG_STEP / max(now - self.trainLogTime, 1e-6)
+        self.trainLogTime = now
+        self.logger.info('train step: {}, {:.2f} steps/s, loss: {:.6f}'.format(self.trainStep, stepsPerSec,
+                                                                               self.lastCost))
 
     def EvalQValue(self, state):
         """
         Interface of evaluate Q-Network Q value when predict action
         """
-        qValue = self.QValue.eval(feed_dict={self.stateInput : [state]})[0]
+        qValue = self.session.run(self.QValueA, feed_dict={self.stateInputA : [state]})[0]
         return qValue
 
+    def SyncActorNet(self):
+        """
+        Sync network params, from current network to actor network
+        """
+        if self.copyActorQNet:
+            self.session.run(self.copyActorQNet)
+
     def StoreTransition(self, action, reward, nextState, terminal):
         """
         Save replay (s, a, r, t) to replay memory
         """
-        self.memory.Add(action, reward, nextState, terminal)
+        with self.memoryLock:
+            self.memory.Add(action, reward, nextState, terminal)
 
     def Save(self):
         """
-        Save network-model and params
+        Save network-model and params, and checkpoint the replay memory if it is on disk
         """
         globalStepSaved = self.trainStep + self.trainStepBase
         self.saver.save(self.session, self.checkPointPath + 'network-dqn',
                         global_step=globalStepSaved)
+        self.SaveMemory()
+
+    def SaveMemory(self):
+        """
+        Checkpoint the replay memory, only valid if the memory is on disk
+        """
+        with self.memoryLock:
+            self.memory.Save()
 
     def Restore(self):
         """
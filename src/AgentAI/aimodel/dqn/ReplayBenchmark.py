@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Sample throughput of the DQN replay memory, in process memory vs memmap files on disk.
+Run from src/AgentAI: python -m aimodel.dqn.ReplayBenchmark --path /data/replay
+"""
+
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .ReplayMemory import ReplayMemory
+
+
+def FillMemory(memory, replayNum, actionSpace, episodeLen=500):
+    """
+    Add replayNum random replays of 108x176 frames
+    """
+    randomState = np.random.RandomState(0)
+    state = randomState.randint(0, 256, (108, 176), dtype=np.uint8)
+    for index in range(replayNum):
+        action = np.zeros(actionSpace, np.uint8)
+        action[index % actionSpace] = 1
+        memory.Add(action, randomState.uniform(-1, 1), state, index % episodeLen == episodeLen - 1)
+
+
+def RunBenchmark(memory, batchSize, batchNum):
+    """
+    :return: samples per second
+    """
+    memory.Random(batchSize)
+    beginTime = time.time()
+    for _ in range(batchNum):
+        memory.Random(batchSize)
+    return batchSize * batchNum / (time.time() - beginTime)
+
+
+def main():
+    """
+    benchmark entry
+    """
+    parser = argparse.ArgumentParser(description='DQN replay memory benchmark')
+    parser.add_argument('--path', type=str, default='./replay_benchmark', help='directory of the memmap files')
+    parser.add_argument('--capacity', type=int, default=200000, help='replay memory capacity')
+    parser.add_argument('--replays', type=int, default=50000, help='replays added before sampling')
+    parser.add_argument('--batch', type=int, default=32, help='mini batch size')
+    parser.add_argument('--batches', type=int, default=500, help='number of sampled batches')
+    parser.add_argument('--actions', type=int, default=6, help='action space')
+    args = parser.parse_args()
+
+    memoryPath = os.path.join(args.path, 'dqn')
+    shutil.rmtree(memoryPath, ignore_errors=True)
+
+    ramMemory = ReplayMemory(args.capacity, 6, 4, False)
+    FillMemory(ramMemory, args.replays, args.actions)
+    ramSpeed = RunBenchmark(ramMemory, args.batch, args.batches)
+    del ramMemory
+
+    diskMemory = ReplayMemory(args.capacity, 6, 4, False, memoryPath=memoryPath)
+    FillMemory(diskMemory, args.replays, args.actions)
+    diskSpeed = RunBenchmark(diskMemory, args.batch, args.batches)
+    diskMemory.Save()
+    replayNum = diskMemory.replayNum
+    del diskMemory
+
+    beginTime = time.time()
+    resumeMemory = ReplayMemory(args.capacity, 6, 4, False, memoryPath=memoryPath)
+    resumeMS = 1000 * (time.time() - beginTime)
+    resumeSpeed = RunBenchmark(resumeMemory, args.batch, args.batches)
+
+    print('ram memory: {:.0f} samples/s'.format(ramSpeed))
+    print('memmap memory: {:.0f} samples/s'.format(diskSpeed))
+    print('memmap memory resumed in {:.2f} ms, replayNum: {}/{}, {:.0f} samples/s'.format(
+        resumeMS, resumeMemory.replayNum, replayNum, resumeSpeed))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,47 +8,148 @@ For full details, please refer to the file "LICENSE.txt" which is provided as pa
 Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
-import random
+import json
 import logging
+import os
 from collections import deque
 
 import numpy as np
 import cv2
 
+MEMORY_META_FILE = 'meta.json'
+
+
 class ReplayMemory(object):
     """
-    Experience replay memory for dqn
+    Experience replay memory for dqn, every frame is stored once in a preallocated ring buffer,
+    the states of a minibatch are gathered from the ring buffer by fancy indexing.
+    If memoryPath is set, the ring buffer is a set of np.memmap files in memoryPath instead of
+    process memory, and the memory is resumed from the last checkpoint saved by Save()
     """
 
-    def __init__(self, maxSize, termDelayFrame, stateRecentFrame, showState):
-        #store replay (key, value) in dict
+    def __init__(self, maxSize, termDelayFrame, stateRecentFrame, showState, memoryPath=None):
         self.maxSize = maxSize
         self.termDelayFrame = termDelayFrame
         self.stateRecentFrame = stateRecentFrame
         self.showState = showState
+        self.memoryPath = memoryPath or None
         self.replayNum = 0
         self.keyIndicate = 0
-        self.replayTable = [None for x in range(0, maxSize)]
+
+        #logger handle
+        self.logger = logging.getLogger('agent')
+
+        # ring buffer of replays, frameTable and actionTable are allocated when the first replay inserted,
+        # as the frame shape and the action space are known then
+        self.frameTable = None
+        self.actionTable = None
+        self.validNum = 0
+        # variables are not used by DQN, they are kept in process memory only
+        self.variableTable = [None] * maxSize
+
+        meta = self._LoadMeta()
+        resume = meta is not None
+        # the frame shape and the action space of a resumed memory are checked on the first inserted replay
+        self.checkShape = resume
+        self.rewardTable = self._CreateTable('reward', (maxSize,), np.float32, resume)
+        self.terminalTable = self._CreateTable('terminal', (maxSize,), np.bool_, resume)
+        # flag 1 means the replay can be the first frame of a sampled state
+        self.flagTable = self._CreateTable('flag', (maxSize,), np.bool_, resume)
+        if resume:
+            self.frameTable = self._CreateTable('frame', (maxSize,) + tuple(meta['frameShape']), np.uint8, True)
+            self.actionTable = self._CreateTable('action', (maxSize,) + tuple(meta['actionShape']), np.uint8, True)
+            self.replayNum = meta['replayNum']
+            self.keyIndicate = meta['keyIndicate']
+            # the flags may be written after the last Save() before an unclean exit, clear the ones out of the
+            # saved replays and count the others instead of trusting the saved number
+            self.flagTable[self.replayNum:] = False
+            self.validNum = int(np.count_nonzero(self.flagTable[:self.replayNum]))
+            self.logger.info('resume replay memory from {}, replayNum: {}'.format(self.memoryPath, self.replayNum))
 
         #replay buffer
         self.replayBuffer = deque()
         self.maxBufferLen = self.termDelayFrame + self.stateRecentFrame
 
-        #store key in set, for random mini batch
-        self.keySet = set()
+    def _LoadMeta(self):
+        if self.memoryPath is None:
+            return None
 
-        #logger handle
-        self.logger = logging.getLogger('agent')
+        if not os.path.exists(self.memoryPath):
+            os.makedirs(self.memoryPath)
+
+        metaFile = os.path.join(self.memoryPath, MEMORY_META_FILE)
+        if not os.path.exists(metaFile):
+            return None
+
+        try:
+            with open(metaFile, 'r') as file:
+                meta = json.load(file)
+        except Exception as err:
+            self.logger.error('load replay memory meta {} failed, error: {}'.format(metaFile, err))
+            return None
+
+        if meta.get('maxSize') != self.maxSize or meta.get('frameShape') is None:
+            self.logger.warning('replay memory in {} does not match, maxSize: {}, create a new one'
+                                .format(self.memoryPath, meta.get('maxSize')))
+            return None
+        return meta
+
+    def _CreateTable(self, name, shape, dtype, resume=False):
+        if self.memoryPath is None:
+            return np.zeros(shape, dtype=dtype)
+
+        fileName = os.path.join(self.memoryPath, name + '.dat')
+        return np.memmap(fileName, dtype=dtype, mode='r+' if resume else 'w+', shape=shape)
+
+    def _Reset(self):
+        """
+        Drop the resumed replays, the frame and action tables are allocated again by the next inserted replay
+        """
+        self.frameTable = None
+        self.actionTable = None
+        self.rewardTable = self._CreateTable('reward', (self.maxSize,), np.float32)
+        self.terminalTable = self._CreateTable('terminal', (self.maxSize,), np.bool_)
+        self.flagTable = self._CreateTable('flag', (self.maxSize,), np.bool_)
+        self.variableTable = [None] * self.maxSize
+        self.replayNum = 0
+        self.keyIndicate = 0
+        self.validNum = 0
+
+    def Save(self):
+        """
+        Checkpoint the memory: flush the memmap files and save the buffer indexes,
+        only valid if memoryPath is set
+        :return: True if saved
+        """
+        if self.memoryPath is None or self.frameTable is None:
+            return False
+
+        for table in (self.frameTable, self.actionTable, self.rewardTable, self.terminalTable, self.flagTable):
+            table.flush()
+
+        meta = {'maxSize': self.maxSize,
+                'frameShape': list(self.frameTable.shape[1:]),
+                'actionShape': list(self.actionTable.shape[1:]),
+                'replayNum': self.replayNum,
+                'keyIndicate': self.keyIndicate,
+                'validNum': self.validNum}
+        metaFile = os.path.join(self.memoryPath, MEMORY_META_FILE)
+        with open(metaFile + '.tmp', 'w') as file:
+            json.dump(meta, file)
+        os.replace(metaFile + '.tmp', metaFile)
+        self.logger.info('save replay memory to {}, replayNum: {}'.format(self.memoryPath, self.replayNum))
+        return True
 
     def Add(self, action, reward, state, terminal, variables=None):
         """
         Add one sample (s, a, r, t) to replay memory
         """
-        self.logger.info('begin to add memory, action:{}, reward:{}, terminal:{}'.format(action, reward, terminal))
+        self.logger.debug('begin to add memory, action:{}, reward:{}, terminal:{}'.format(action, reward, terminal))
         self.replayBuffer.append((action, reward, state, terminal, variables))
 
         if len(self.replayBuffer) < self.maxBufferLen:
-            self.logger.info('replay buffer length not reach the max buffer len, len:{}'.format(len(self.replayBuffer)))
+            self.logger.debug('replay buffer length not reach the max buffer len, len:{}'
+                              .format(len(self.replayBuffer)))
             if terminal is True:
                 self.replayBuffer.clear()
             return
@@ -89,20 +190,34 @@ class ReplayMemory(object):
 
     def _InsertNew(self, action, reward, state, variables, terminal, flag):
 
-        self.logger.info('insert the variable, action:{}, reward:{}, variables:{}, terminal:{}, flag:{}'
-                         .format(action, reward, variables, terminal, flag))
+        self.logger.debug('insert the variable, action:{}, reward:{}, variables:{}, terminal:{}, flag:{}'
+                          .format(action, reward, variables, terminal, flag))
 
         if self.showState is True:
             cv2.imshow('replay', state)
             cv2.waitKey(1)
 
-        #add new replay
-        self.replayTable[self.keyIndicate] = (action, reward, state, terminal, flag, variables)
+        if self.checkShape:
+            self.checkShape = False
+            if self.frameTable.shape[1:] != np.shape(state) or self.actionTable.shape[1:] != np.shape(action):
+                self.logger.warning('replay memory in {} does not match, frameShape: {}, actionShape: {}, '
+                                    'create a new one'.format(self.memoryPath, self.frameTable.shape[1:],
+                                                              self.actionTable.shape[1:]))
+                self._Reset()
 
-        if flag == 1:
-            self.keySet.add(self.keyIndicate)
-        else:
-            self.keySet.discard(self.keyIndicate)
+        if self.frameTable is None:
+            self.frameTable = self._CreateTable('frame', (self.maxSize,) + np.shape(state), np.uint8)
+            self.actionTable = self._CreateTable('action', (self.maxSize,) + np.shape(action), np.uint8)
+
+        #add new replay
+        index = self.keyIndicate
+        self.validNum += int(flag == 1) - int(self.flagTable[index])
+        self.frameTable[index] = state
+        self.actionTable[index] = action
+        self.rewardTable[index] = reward
+        self.terminalTable[index] = terminal
+        self.flagTable[index] = flag == 1
+        self.variableTable[index] = variables
 
         self.keyIndicate = (self.keyIndicate + 1) % self.maxSize
 
@@ -110,52 +225,54 @@ class ReplayMemory(object):
         if self.replayNum < self.maxSize:
             self.replayNum += 1
 
+    def _SampleKeys(self, batchSize):
+        """
+        Random batchSize distinct keys, the state of a key is not split by the newest replay
+        """
+        keys = np.empty(0, dtype=np.int64)
+        while len(keys) < batchSize:
+            candidates = np.random.randint(0, self.replayNum, 2 * (batchSize + self.stateRecentFrame))
+            # the frames of key x are x ... x + stateRecentFrame, the newest replay must not be among them
+            distance = (self.keyIndicate - candidates) % self.replayNum
+            candidates = candidates[self.flagTable[candidates] & ((distance == 0) |
+                                                                  (distance > self.stateRecentFrame))]
+            keys = np.concatenate((keys, candidates))
+            _, firstIndex = np.unique(keys, return_index=True)
+            keys = keys[np.sort(firstIndex)]
+        return keys[:batchSize]
+
     def Random(self, batchSize):
         """
         Random batchSize sample from replay memory
+        :return: (stateBatch, actionBatch, rewardBatch, nextStateBatch, terminalBatch) arrays, states are
+                 (batchSize, height, width, stateRecentFrame) uint8 arrays; the variables of the samples are
+                 appended if they are added with the replays; empty tuple if the memory is not enough
         """
-        validCount = 0
-        batch = list()
-        self.logger.info("the keySet is {}, batchSize:{}, stateRecentFrame:{}".format(self.keySet,
-                                                                                      batchSize, self.stateRecentFrame))
-
-        if len(self.keySet) < batchSize + self.stateRecentFrame:
-            return batch
-
-        index = int(batchSize) + int(self.stateRecentFrame)
-        keys = random.sample(self.keySet, index)
-
-        invalidKeys = [(self.keyIndicate - x) % self.replayNum \
-                    for x in range(1, self.stateRecentFrame + 1)]
-
-        self.logger.info("the invalidKeys is".format(invalidKeys))
-
-        for x in keys:
-            if x in invalidKeys:
-                continue
-
-            replays = [self.replayTable[(x+i) % self.replayNum] \
-                    for i in range(0, self.stateRecentFrame + 1)]
-            if replays[0][4] == 0:
-                self.logger.error('flag error in replay memory')
-
-            imgs = [replay[2] for replay in replays]
-            a = replays[self.stateRecentFrame-1][0]
-            r = replays[self.stateRecentFrame-1][1]
-            t = replays[self.stateRecentFrame-1][3]
-
-            state0 = np.stack(imgs[0 : self.stateRecentFrame], axis=2)
-            state1 = np.stack(imgs[1 : self.stateRecentFrame + 1], axis=2)
-
-            variables0 = replays[self.stateRecentFrame-1][5]
-            variables1 = replays[self.stateRecentFrame][5]
-
-            if variables0 is None:
-                batch.append((state0, a, r, state1, t))
-            else:
-                batch.append((state0, a, r, state1, t, variables0, variables1))
-            validCount += 1
-            if validCount == batchSize:
-                break
-        self.logger.info("the size of  batch is {}".format(len(batch)))
+        batchSize = int(batchSize)
+        self.logger.debug("the valid key number is {}, batchSize:{}, stateRecentFrame:{}"
+                          .format(self.validNum, batchSize, self.stateRecentFrame))
+
+        if self.validNum < batchSize + self.stateRecentFrame:
+            return tuple()
+
+        keys = self._SampleKeys(batchSize)
+
+        # (batchSize, stateRecentFrame + 1) replay indexes, gathered by one fancy indexing
+        indexes = (keys[:, np.newaxis] + np.arange(self.stateRecentFrame + 1)) % self.replayNum
+        frames = np.moveaxis(self.frameTable[indexes], 1, -1)
+        stateBatch = frames[..., :self.stateRecentFrame]
+        nextStateBatch = frames[..., 1:]
+
+        lastIndexes = indexes[:, self.stateRecentFrame - 1]
+        if not np.all(self.flagTable[indexes[:, 0]]):
+            self.logger.error('flag error in replay memory')
+
+        batch = (stateBatch, self.actionTable[lastIndexes], self.rewardTable[lastIndexes],
+                 nextStateBatch, self.terminalTable[lastIndexes])
+
+        if self.variableTable[lastIndexes[0]] is not None:
+            batch += ([self.variableTable[index] for index in lastIndexes],
+                      [self.variableTable[index] for index in indexes[:, self.stateRecentFrame]])
+
+        self.logger.debug("the size of  batch is {}".format(batchSize))
         return batch
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+CPU throughput of QNetwork.Train, the legacy train step vs the current train step.
+Run from src/AgentAI: python -m aimodel.dqn.TrainBenchmark
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+# benchmark on CPU, must be set before tensorflow is imported
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+import numpy as np
+
+from .QNetwork import QNetwork
+
+
+def _LegacyTrain(qNetwork):
+    """
+    The train step before vectorizing: python loop batch and target, optimizer runs twice per step
+    """
+    minibatch = qNetwork.memory.Random(qNetwork.miniBatchSize)
+    stateBatch, actionBatch, rewardBatch, nextStateBatch, terminalBatch = [list(data) for data in minibatch[:5]]
+
+    yBatch = []
+    qValueBatch = qNetwork.QValue.eval(feed_dict={qNetwork.stateInput: nextStateBatch})
+    actionIndexBatch = [np.argmax(qv) for qv in qValueBatch]
+    qValueTBatch = qNetwork.QValueT.eval(feed_dict={qNetwork.stateInputT: nextStateBatch})
+    for i in range(0, int(qNetwork.miniBatchSize)):
+        if terminalBatch[i]:
+            yBatch.append(rewardBatch[i])
+        else:
+            yBatch.append(rewardBatch[i] + qNetwork.gama * qValueTBatch[i][actionIndexBatch[i]])
+
+    qNetwork.trainOptimizer.run(feed_dict={qNetwork.yInput: yBatch,
+                                           qNetwork.actionInput: actionBatch,
+                                           qNetwork.stateInput: stateBatch})
+    qNetwork.session.run([qNetwork.trainOptimizer, qNetwork.cost],
+                         feed_dict={qNetwork.yInput: yBatch,
+                                    qNetwork.actionInput: actionBatch,
+                                    qNetwork.stateInput: stateBatch})
+    qNetwork.trainStep += 1
+
+
+def CreateQNetwork(args, checkPointPath):
+    """
+    Create a double Q network with the default DQNLearning.json params, filled with random replays
+    """
+    learnArgs = {
+        'dueling_network': True,
+        'input_img_width': 176,
+        'input_img_height': 108,
+        'state_recent_frame': 4,
+        'terminal_delay_frame': 6,
+        'action_space': args.actions,
+        'reward_discount': 0.99,
+        'learn_rate': 0.000005,
+        'qnet_update_step': 12000,
+        'memory_size': args.memory,
+        'mini_batch_size': args.batch,
+        'train_with_double_q': True,
+        'gpu_memory_fraction': 0.6,
+        'gpu_memory_growth': False,
+        'checkpoint_path': checkPointPath,
+        'show_img_state': False,
+    }
+    qNetwork = QNetwork(learnArgs)
+
+    randomState = np.random.RandomState(0)
+    for index in range(args.memory):
+        action = np.zeros(args.actions, np.uint8)
+        action[randomState.randint(args.actions)] = 1
+        state = randomState.randint(0, 256, (108, 176), dtype=np.uint8)
+        qNetwork.StoreTransition(action, randomState.uniform(-1, 1), state, index % 500 == 499)
+    return qNetwork
+
+
+def RunBenchmark(trainFunc, stepNum, warmUpNum=5):
+    """
+    :return: train steps per second
+    """
+    for _ in range(warmUpNum):
+        trainFunc()
+
+    beginTime = time.time()
+    for _ in range(stepNum):
+        trainFunc()
+    return stepNum / (time.time() - beginTime)
+
+
+def main():
+    """
+    benchmark entry
+    """
+    parser = argparse.ArgumentParser(description='DQN train step benchmark on CPU')
+    parser.add_argument('--steps', type=int, default=50, help='number of train steps')
+    parser.add_argument('--batch', type=int, default=32, help='mini batch size')
+    parser.add_argument('--memory', type=int, default=2000, help='replays in memory')
+    parser.add_argument('--actions', type=int, default=6, help='action space')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as checkPointPath:
+        qNetwork = CreateQNetwork(args, checkPointPath + '/')
+        legacySpeed = RunBenchmark(lambda: _LegacyTrain(qNetwork), args.steps)
+        currentSpeed = RunBenchmark(qNetwork.Train, args.steps)
+
+    print('legacy train: {:.2f} steps/s'.format(legacySpeed))
+    print('current train: {:.2f} steps/s, loss: {:.6f}'.format(currentSpeed, qNetwork.lastCost))
+    print('speedup: {:.2f}x'.format(currentSpeed / legacySpeed))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 import configparser
 import logging
 import os
+import time
 
 import tbus
 from util.config_path_mgr import SYS_CONFIG_DIR
@@ -20,6 +21,11 @@ from protocol import common_pb2
 # BUS_CFG_FILE = '../cfg/platform/bus.ini'
 TBUS_CFG_PATH = 'cfg/platform/bus.ini'
 
+# an optional peer node is taken as not attached after this many consecutive failed sends,
+# and is skipped for the retry interval in seconds, a single failure, such as a full channel, only loses the msg
+OPTIONAL_PEER_MAX_FAILURES = 10
+OPTIONAL_PEER_RETRY_INTERVAL = 5
+
 class BusConnect(object):
     """
     Tbus connect manage class module
@@ -44,6 +50,8 @@ class BusConnect(object):
             self.__gameRegAddr = None
             self.__sdkToolAddr = None
             self.__connectOk = False
+            self.__optionalPeerFailures = dict()
+            self.__optionalPeerRetryTime = dict()
             self.__logger = logging.getLogger('agent')
             self.__init = True
 
@@ -98,13 +106,42 @@ class BusConnect(object):
         """
         Serialize and send a msg to MC channel
         """
+        return self.SendBuff(msg.SerializeToString(), peerNode)
+
+    def SendBuff(self, msgBuff, peerNode, optional=False):
+        """
+        Send a serialized msg, the same buffer can be sent to several peer nodes.
+        A send to an optional peer node, such as SDKTool, is skipped when the node is not attached:
+        its address is not configured, or OPTIONAL_PEER_MAX_FAILURES sends in a row to it failed
+        in the last retry interval
+        """
         peerNodeAddr = self._GetPeerNodeAddr(peerNode)
         if peerNodeAddr is None:
-            self.__logger.error('Seed error: peer node {} address is None!'.format(peerNode))
+            if not optional:
+                self.__logger.error('Seed error: peer node {} address is None!'.format(peerNode))
+            return -1
+
+        if not optional:
+            return tbus.SendTo(peerNodeAddr, msgBuff)
+
+        now = time.time()
+        if now < self.__optionalPeerRetryTime.get(peerNode, 0):
             return -1
 
-        msgBuff = msg.SerializeToString()
-        return tbus.SendTo(peerNodeAddr, msgBuff)
+        ret = tbus.SendTo(peerNodeAddr, msgBuff)
+        if ret != 0:
+            failures = self.__optionalPeerFailures.get(peerNode, 0) + 1
+            self.__optionalPeerFailures[peerNode] = failures
+            if failures >= OPTIONAL_PEER_MAX_FAILURES:
+                if peerNode not in self.__optionalPeerRetryTime:
+                    self.__logger.info('peer node {} is not attached, send return code[{}]'.format(peerNode, ret))
+                self.__optionalPeerRetryTime[peerNode] = now + OPTIONAL_PEER_RETRY_INTERVAL
+        else:
+            self.__optionalPeerFailures.pop(peerNode, None)
+            if peerNode in self.__optionalPeerRetryTime:
+                self.__logger.info('peer node {} is attached'.format(peerNode))
+                del self.__optionalPeerRetryTime[peerNode]
+        return ret
 
     def _GetPeerNodeAddr(self, peerNode):
         peerAddr = None
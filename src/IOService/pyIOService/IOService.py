@@ -8,27 +8,31 @@ For full details, please refer to the file "LICENSE.txt" which is provided as pa
 Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
+import base64
 import configparser
 import logging
 import os
-import time
 
 import cv2
 
-from common.Define import TASK_STATUS_INIT_SUCCESS
+from common.Define import TASK_STATUS_INIT_SUCCESS, BINARY_IMG_SEND_TYPE, CV2_EN_DECODE_IMG_SEND_TYPE, \
+    BASE_64_DECODE_IMG_SEND_TYPE
 from common.CommonContext import IO_SERVICE_CONTEXT
+from common.Reactor import Reactor, PRIORITY_FRAME, PRIORITY_MSG, PRIORITY_HOUSEKEEPING
 from communicate.HTTPClient import HTTPClient
 from communicate.SocketServer import SocketServer
 from communicate.HttpServer import HttpServer
 from communicate.TBUSMgr import TBUSMgr
 from msghandler.MsgHandler import MsgHandler
+from tools.FrameCodec import FRAME_ENCODE_RAW, GetFrameEncode, SniffFrameEncode
+from tools.FrameStore import FrameStore
+from tools.FrameTrace import FrameTrace
 from tools.ImgDecode import ImgDecode
+from tools.SpeedCheck import IOSpeedCheck
 from util.config_path_mgr import SYS_CONFIG_DIR
 
-MAIN_LOOP_RATE = 60
-MAIN_LOOP_SLEEP_TIME = 1. / MAIN_LOOP_RATE
-OTHERS_LOOP_RATE = 1
-OTHERS_LOOP_COUNT = int(MAIN_LOOP_RATE / OTHERS_LOOP_RATE)
+# interval of registering to AIControl before a task is assigned, in seconds
+REGISTER_INTERVAL = 10
 
 TBUS_CFG_PATH = 'cfg/platform/bus.ini'
 
@@ -40,8 +44,7 @@ class IOService(object):
     IOService Main class
     """
     def __init__(self, taskCfgPath, platformCfgPath):
-        self.__exited = False
-        self.__loopCount = 0
+        self.__reactor = Reactor()
         self.__debugShowFrame = False
         self.__debugTestMode = False
 
@@ -50,12 +53,19 @@ class IOService(object):
 
         self.__clientCfg = {}
         self.__controlCfg = {}
+        self.__frameStoreCfg = {}
+        self.__frameEncode = FRAME_ENCODE_RAW
+        self.__jpegQuality = 90
+        self.__latencyTraceCfg = {}
 
         self.__clientSocket = None
         self.__httpServer = None
         self.__controlSocket = None
         self.__commMgr = None
         self.__msgHandler = None
+        self.__frameStore = None
+        self.__frameTrace = None
+        self.__speedCheck = None
 
         self.__lastFrameSeq = 0
 
@@ -73,14 +83,29 @@ class IOService(object):
         IO_SERVICE_CONTEXT['test_mode'] = self.__debugTestMode
 
         # Construct sub modules
-        self.__clientSocket = SocketServer()
+        self.__clientSocket = SocketServer(wakeEvent=self.__reactor.GetWakeEvent())
         self.__httpServer = HttpServer()
         self.__controlSocket = HTTPClient()
         self.__commMgr = TBUSMgr()
+        if self.__frameStoreCfg['enable']:
+            self.__frameStore = FrameStore(name=self.__frameStoreCfg['name'],
+                                           slotNum=self.__frameStoreCfg['slot_num'],
+                                           slotSize=self.__frameStoreCfg['slot_size'])
+            if not self.__frameStore.Create():
+                LOG.warning('FrameStore Create failed, send frame data in tbus message')
+                self.__frameStore = None
+        self.__frameTrace = FrameTrace()
+        if self.__latencyTraceCfg['enable'] and not self.__frameTrace.Create():
+            LOG.warning('FrameTrace Create failed, frame latency is not traced')
+        self.__speedCheck = IOSpeedCheck(self.__frameTrace)
         self.__msgHandler = MsgHandler(self.__commMgr,
                                        self.__clientSocket,
                                        self.__httpServer,
-                                       self.__controlSocket)
+                                       self.__controlSocket,
+                                       self.__frameStore,
+                                       self.__frameEncode,
+                                       self.__jpegQuality,
+                                       self.__speedCheck)
 
         # Initialize sub modules
         tbus_cfg_path = os.path.join(SYS_CONFIG_DIR, TBUS_CFG_PATH)
@@ -100,6 +125,15 @@ class IOService(object):
         if not self.__controlSocket.Initialize(self.__controlCfg) or not self.__msgHandler.Initialize():
             LOG.error('Control Socket Initialize failed! or MsgHandler Initialize failed!')
             return False
+
+        # frames and actions are handled as soon as they arrive, control msgs and register afterwards
+        self.__reactor.AddSource('client', self._UpdateClient, PRIORITY_FRAME)
+        self.__reactor.AddSource('inner', self.__msgHandler.UpdateInnerMsg, PRIORITY_MSG)
+        self.__reactor.AddSource('control', self.__msgHandler.UpdateControlMsg, PRIORITY_HOUSEKEEPING)
+        self.__reactor.AddTimer('others', REGISTER_INTERVAL, self._UpdateOthers)
+        if self.__latencyTraceCfg['enable'] and self.__latencyTraceCfg['dump_file']:
+            self.__reactor.AddTimer('latency', self.__latencyTraceCfg['dump_interval'], self._DumpLatency,
+                                    delay=self.__latencyTraceCfg['dump_interval'])
         return True
 
     def Run(self):
@@ -107,26 +141,7 @@ class IOService(object):
         Run this module
         :return:
         """
-        while not self.__exited:
-            beginTime = time.time()
-            self._UpdateMsgHandler()  # Update Message handler
-            updateMsgHandlerTime = time.time()
-            self._UpdateFrame()  # Update frame
-            updateFrameTime = time.time()
-            self._UpdateOthers()
-            endTime = time.time()
-            sleepTime = MAIN_LOOP_SLEEP_TIME - (endTime - beginTime)
-            if sleepTime > 0:
-                time.sleep(sleepTime)
-            elif endTime - beginTime > 0.05:
-                overMS = int(-1000 * sleepTime)
-                totalMS = int(1000 * MAIN_LOOP_SLEEP_TIME) + overMS
-                msgHandlerMS = int(1000 * (updateMsgHandlerTime - beginTime))
-                frameMS = int(1000 * (updateFrameTime - updateMsgHandlerTime))
-                othersMS = int(1000 * (endTime - updateFrameTime))
-                LOG.warning('MainLoop overschedule %sms: %s=%s+%s+%s', overMS, totalMS,
-                            msgHandlerMS, frameMS, othersMS)
-            self.__loopCount += 1
+        self.__reactor.Run()
 
         self.__msgHandler.SendUnregisterToAIControl()
 
@@ -141,36 +156,51 @@ class IOService(object):
         self.__clientSocket.Finish()
         self.__httpServer.Finish()
         self.__controlSocket.Finish()
+        if self.__frameStore is not None:
+            self.__frameStore.Finish()
+        if self.__frameTrace is not None:
+            self.__frameTrace.Finish()
 
     def SetExited(self):
         """
         This module will exit when called
         :return:
         """
-        self.__exited = True
+        self.__reactor.Stop()
 
-    def _UpdateMsgHandler(self):
-        self.__msgHandler.Update()
+    def _UpdateClient(self):
+        recvClient = self.__msgHandler.UpdateClientMsg()
+        recvHttpClient = self.__msgHandler.UpdateHttpClientMsg()
+        sendFrame = self._UpdateFrame()
+        return recvClient or recvHttpClient or sendFrame
 
     def _UpdateFrame(self):
         if IO_SERVICE_CONTEXT['task_state'] != TASK_STATUS_INIT_SUCCESS:
-            return
+            return False
 
         frameBuff = IO_SERVICE_CONTEXT['frame']
         if frameBuff is None:
-            return
+            return False
+
+        frameSeq = IO_SERVICE_CONTEXT['frame_seq']
+        if self.__lastFrameSeq == frameSeq:
+            return False
 
         frameType = IO_SERVICE_CONTEXT['frame_type']
         extend = IO_SERVICE_CONTEXT['extend']
-        frame = ImgDecode(frameBuff, frameType)
-        frameSeq = IO_SERVICE_CONTEXT['frame_seq']
 
+        # forward the compressed client image without decoding, MC decodes it when the pixels are needed
+        if self.__frameEncode != FRAME_ENCODE_RAW and not self.__debugShowFrame:
+            encodedBuff, frameEncode = self._GetEncodedClientFrame(frameBuff, frameType)
+            if encodedBuff is not None:
+                self.__msgHandler.SendEncodedFrameMsgToMC(frameSeq, encodedBuff, frameEncode, extend)
+                self.__lastFrameSeq = frameSeq
+                return True
+
+        frame = ImgDecode(frameBuff, frameType)
         if frame is None:
             LOG.error('Decode image error, check the image encode.')
-            return
-
-        if self.__lastFrameSeq == frameSeq:
-            return
+            return False
 
         if self.__debugShowFrame:
             cv2.imshow('IO', frame)
@@ -178,11 +208,28 @@ class IOService(object):
 
         self.__msgHandler.SendFrameMsgToMC(frameSeq, frame, extend)
         self.__lastFrameSeq = frameSeq
+        return True
+
+    @staticmethod
+    def _GetEncodedClientFrame(frameBuff, frameType):
+        if frameType in [BINARY_IMG_SEND_TYPE, CV2_EN_DECODE_IMG_SEND_TYPE]:
+            encodedBuff = frameBuff
+        elif frameType == BASE_64_DECODE_IMG_SEND_TYPE:
+            encodedBuff = base64.b64decode(frameBuff)
+        else:
+            return None, None
+
+        frameEncode = SniffFrameEncode(encodedBuff)
+        if frameEncode is None:
+            return None, None
+        return encodedBuff, frameEncode
 
     def _UpdateOthers(self):
-        if self.__loopCount % (OTHERS_LOOP_COUNT * 10) == 0:
-            if IO_SERVICE_CONTEXT['task_id'] is None:
-                self.__msgHandler.SendRegisterToAIControl()
+        if IO_SERVICE_CONTEXT['task_id'] is None:
+            self.__msgHandler.SendRegisterToAIControl()
+
+    def _DumpLatency(self):
+        self.__speedCheck.Dump(self.__latencyTraceCfg['dump_file'])
 
     def _LoadConfig(self):
         if os.path.exists(self.__platformCfgPath):
@@ -219,6 +266,25 @@ class IOService(object):
 
             self.__controlCfg['STAFFNAME'] = iniCfg.get('CONTROL_COMMUNICATION', 'StaffName')
             self.__controlCfg['pattern'] = iniCfg.getint('CONTROL_COMMUNICATION', 'Pattern')
+
+            self.__frameStoreCfg = dict()
+            self.__frameStoreCfg['enable'] = iniCfg.getboolean('FRAME_TRANSPORT', 'ShmEnable', fallback=False)
+            self.__frameStoreCfg['name'] = iniCfg.get('FRAME_TRANSPORT', 'ShmName', fallback='ai_sdk_frame')
+            self.__frameStoreCfg['slot_num'] = iniCfg.getint('FRAME_TRANSPORT', 'ShmSlotNum', fallback=8)
+            self.__frameStoreCfg['slot_size'] = iniCfg.getint('FRAME_TRANSPORT', 'ShmSlotSize',
+                                                              fallback=1920 * 1080 * 3)
+
+            frameEncodeName = iniCfg.get('FRAME_TRANSPORT', 'FrameEncode', fallback='raw')
+            self.__frameEncode = GetFrameEncode(frameEncodeName)
+            if self.__frameEncode is None:
+                LOG.error('Invalid FrameEncode[%s] in %s', frameEncodeName, self.__platformCfgPath)
+                return False
+            self.__jpegQuality = iniCfg.getint('FRAME_TRANSPORT', 'JpegQuality', fallback=90)
+
+            self.__latencyTraceCfg = dict()
+            self.__latencyTraceCfg['enable'] = iniCfg.getboolean('LATENCY_TRACE', 'Enable', fallback=False)
+            self.__latencyTraceCfg['dump_file'] = iniCfg.get('LATENCY_TRACE', 'DumpFile', fallback='')
+            self.__latencyTraceCfg['dump_interval'] = iniCfg.getint('LATENCY_TRACE', 'DumpInterval', fallback=10)
         except KeyError as e:
             LOG.error('Load Config File[%s] failed, err: %s', self.__platformCfgPath, e)
             return False
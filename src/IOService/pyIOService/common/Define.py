@@ -14,10 +14,12 @@ MSG_ID_REPORT = 3
 MSG_ID_CONTROL_REP = 4
 MSG_ID_AI_SERVICE_STATE = 5
 MSG_ID_AI_TRAIN_SCHEDULE = 6
+MSG_ID_LATENCY_REP = 7
 
 # 与AI Client消息
 MSG_ID_NEW_TASK = 1000
 MSG_ID_CONTROL_REQ = 1001
+MSG_ID_LATENCY_REQ = 1002
 MSG_ID_AI_ACTION = 2000
 MSG_ID_UI_ACTION = 2001
 MSG_ID_GAME_STATE = 2002
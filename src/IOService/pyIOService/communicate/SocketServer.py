@@ -22,7 +22,8 @@ class SocketServer(object):
     """
     Socket Server implement for communication with AIClient
     """
-    def __init__(self):
+    def __init__(self, wakeEvent=None):
+        self.__wakeEvent = wakeEvent
         self.__recvSocket = None
         self.__sendSocket = None
         self.__recvthread = None
@@ -94,7 +95,7 @@ class SocketServer(object):
             LOG.error('SocketServer init send socket failed!')
             return False
 
-        self.__recvthread = RecvThread(self.__recvSocket, self.__recvQueue)
+        self.__recvthread = RecvThread(self.__recvSocket, self.__recvQueue, self.__wakeEvent)
         self.__sendthread = SendThread(self.__sendSocket, self.__sendQueue)
         self.__recvthread.setDaemon(True)
         self.__sendthread.setDaemon(True)
@@ -9,6 +9,7 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
 import logging
+import queue
 import threading
 import time
 
@@ -17,29 +18,61 @@ import msgpack_numpy as mn
 
 LOG = logging.getLogger('IOService')
 
+# the threads block on the socket or the queue, the timeout only bounds the exit latency
+POLL_TIMEOUT_MS = 100
+QUEUE_TIMEOUT = 0.1
+# seconds the recv thread waits after a poll error, doubled on each error in a row
+POLL_ERROR_WAIT_MIN = 0.01
+POLL_ERROR_WAIT_MAX = 1.
+# max msgs handled in one wake up, the burst is drained without blocking
+RECV_BATCH_SIZE = 64
+SEND_BATCH_SIZE = 64
+
 
 class RecvThread(threading.Thread):
     """
     Recv Thread implementation
     """
-    def __init__(self, recvSocket, recvQueue):
+    def __init__(self, recvSocket, recvQueue, wakeEvent=None):
         threading.Thread.__init__(self)
         self.__recvSocket = recvSocket
         self.__recvQueue = recvQueue
+        self.__wakeEvent = wakeEvent
         self.__runningFlag = threading.Event()
         self.__runningFlag.set()
 
     def run(self):
+        errorWait = POLL_ERROR_WAIT_MIN
         while self.__runningFlag.isSet():
-            buff = self.__recvSocket.Recv()
-            if buff is None or len(buff) == 0:
-                LOG.error('Recv buff is None')
-                time.sleep(0.001)
+            ready = self.__recvSocket.Poll(POLL_TIMEOUT_MS)
+            if ready is None:
+                # a closed socket never recovers, a broken one is polled again after a back off
+                if self.__recvSocket.IsClosed():
+                    LOG.error('Recv socket closed, exit recv thread')
+                    return
+                time.sleep(errorWait)
+                errorWait = min(errorWait * 2, POLL_ERROR_WAIT_MAX)
+                continue
+
+            errorWait = POLL_ERROR_WAIT_MIN
+            if not ready:
                 continue
 
-            data = msgpack.unpackb(buff, object_hook=mn.decode, encoding='utf-8')
-            self.__recvQueue.put_nowait(data)
-            time.sleep(0.001)
+            for _ in range(RECV_BATCH_SIZE):
+                buff = self.__recvSocket.Recv(block=False)
+                if buff is None:
+                    break
+
+                if len(buff) == 0:
+                    LOG.error('Recv buff is empty')
+                    continue
+
+                data = msgpack.unpackb(buff, object_hook=mn.decode, encoding='utf-8')
+                self.__recvQueue.put_nowait(data)
+
+            # wake up the main loop waiting for new msgs
+            if self.__wakeEvent is not None:
+                self.__wakeEvent.set()
 
     def finish(self):
         """
@@ -62,20 +95,29 @@ class SendThread(threading.Thread):
 
     def run(self):
         while self.__runningFlag.isSet():
-            if not self.__sendQueue.empty():
-                data = self.__sendQueue.get_nowait()
-                if data is not None:
-                    if not isinstance(data, bytes):
-                        buff = msgpack.packb(data, default=mn.encode, use_bin_type=True)
-                    else:
-                        buff = data
-                    self.__sendSocket.Send(buff)
-                    time.sleep(0.001)
-                    continue
-                LOG.error('Send data is None')
+            try:
+                data = self.__sendQueue.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+
+            self._Send(data)
+            for _ in range(SEND_BATCH_SIZE - 1):
+                try:
+                    data = self.__sendQueue.get_nowait()
+                except queue.Empty:
+                    break
+                self._Send(data)
+
+    def _Send(self, data):
+        if data is None:
+            LOG.error('Send data is None')
+            return
 
-            time.sleep(0.001)
-            continue
+        if not isinstance(data, bytes):
+            buff = msgpack.packb(data, default=mn.encode, use_bin_type=True)
+        else:
+            buff = data
+        self.__sendSocket.Send(buff)
 
     def finish(self):
         """
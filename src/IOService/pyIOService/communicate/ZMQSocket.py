@@ -53,13 +53,38 @@ class ZMQSocket(object):
             LOG.error('ZMQ Error [{0}]'.format(e))
             return False
 
-    def Recv(self):
+    def Poll(self, timeout):
+        """
+        Wait until there is data to recv on this socket
+        :param timeout: timeout in milliseconds
+        :return: True if there is data to recv, None if the socket is broken or closed
+        """
+        try:
+            return self.__zmqSocket.poll(timeout, zmq.POLLIN) != 0
+        except zmq.ZMQError as err:
+            LOG.error('Poll exception in zmq:{}'.format(err))
+            return None
+
+    def IsClosed(self):
+        """
+        Whether this socket is closed
+        :return: True or false
+        """
+        return self.__zmqSocket.closed
+
+    def Recv(self, block=True):
         """
         Recv data on this socket
-        :return: the received data
+        :param block: whether block until data arrives
+        :return: the received data, None if nothing received in non-blocking mode
         """
         try:
-            data = self.__zmqSocket.recv()
+            if block:
+                data = self.__zmqSocket.recv()
+            else:
+                data = self.__zmqSocket.recv(zmq.NOBLOCK)
+        except zmq.Again:
+            return None
         except Exception as err:
             LOG.error('Recv data exception in zmq:{}'.format(err))
             return None
@@ -18,8 +18,10 @@ from common.Define import BASE_64_DECODE_IMG_SEND_TYPE, MSG_ID_UI_ACTION, ACTION
     RESTART_RESULT_FAILURE, MSG_ID_REPORT, MSG_ID_REGISTER, MSG_ID_UNREGISTER, MSG_ID_GAME_STATE, \
     MSG_ID_AGENT_STATE, MSG_ID_AI_SERVICE_STATE, MSG_ID_NEW_TASK, MSG_ID_CONTROL_REQ, MSG_ID_CLIENT_DATA,\
     MSG_ID_CLIENT_REQ, MSG_ID_CHANGE_GAME_STATE, MSG_ID_PAUSE, MSG_ID_RESTORE, MSG_ID_RESTART, MSG_ID_SOURCE_REQ, \
-    MSG_ID_CLIENT_UI_REQ, MSG_ID_RESTART_RESULT, MSG_ID_AI_TRAIN_SCHEDULE, ACTION_ID_RESET
+    MSG_ID_CLIENT_UI_REQ, MSG_ID_RESTART_RESULT, MSG_ID_AI_TRAIN_SCHEDULE, ACTION_ID_RESET, MSG_ID_LATENCY_REQ, \
+    MSG_ID_LATENCY_REP
 from protocol import common_pb2
+from tools.FrameCodec import FRAME_ENCODE_RAW, EncodeFrame
 from tools.SpeedCheck import IOSpeedCheck
 
 LOG = logging.getLogger('IOService')
@@ -29,7 +31,8 @@ class MsgHandler(object):
     """
     IOService MsgHandler implementation for handling all messages
     """
-    def __init__(self, commMgr, clientSocket, httpClientConnect, controlSocket):
+    def __init__(self, commMgr, clientSocket, httpClientConnect, controlSocket, frameStore=None,
+                 frameEncode=FRAME_ENCODE_RAW, jpegQuality=90, speedCheck=None):
         self.__commMgr = commMgr
         self.__clientSocket = clientSocket
         self.__controlSocket = controlSocket
@@ -38,7 +41,10 @@ class MsgHandler(object):
         self.__controlMsgDict = {}
         self.__clientMsgDict = {}
         self.__httpClientMsgDict = {}
-        self.__speedCheck = IOSpeedCheck()
+        self.__speedCheck = speedCheck if speedCheck is not None else IOSpeedCheck()
+        self.__frameStore = frameStore
+        self.__frameEncode = frameEncode
+        self.__jpegQuality = jpegQuality
 
     def Initialize(self):
         """
@@ -58,6 +64,7 @@ class MsgHandler(object):
 
         self._RegisterControlMsgHandler(MSG_ID_NEW_TASK, self._OnNewTask)
         self._RegisterControlMsgHandler(MSG_ID_CONTROL_REQ, self._OnControlReq)
+        self._RegisterControlMsgHandler(MSG_ID_LATENCY_REQ, self._OnLatencyReq)
 
         self._RegisterClientMsgHandler(MSG_ID_CLIENT_DATA, self._OnClientData)
         self._RegisterClientMsgHandler(MSG_ID_CLIENT_REQ, self._OnClientReq)
@@ -86,26 +93,45 @@ class MsgHandler(object):
     def _RegisterHttpClientMsgHandler(self, cmdID, msgFuncHandler):
         self.__httpClientMsgDict[cmdID] = msgFuncHandler
 
-    def Update(self):
+    def SendFrameMsgToMC(self, frameSeq, frame, extend):
         """
-        Update the msg handler, handle the msgs from MC(Inner), ASM and AIClient
+        Send GameFrame to MC
+        :param frameSeq: Frame sequence
+        :param frame: GameFrame
+        :param extend: extend GameData
         :return:
         """
-        self._UpdateInnerMsg()
-        self._UpdateControlMsg()
-        self._UpdateClientMsg()
-        self._UpdateHttpClientMsg()
+        shmSlot = -1
+        if self.__frameStore is not None and self.__frameEncode == FRAME_ENCODE_RAW:
+            shmSlot = self.__frameStore.Write(frameSeq, frame)
 
-    def SendFrameMsgToMC(self, frameSeq, frame, extend):
+        if shmSlot >= 0:
+            msgBuff = self._CreatePBSrcImgMsg(frameSeq, frame.shape[0], frame.shape[1], None, extend,
+                                              shmSlot=shmSlot)
+        else:
+            frameEncode = self.__frameEncode
+            frameBuff = EncodeFrame(frame, frameEncode, self.__jpegQuality)
+            if frameBuff is None:
+                frameEncode = FRAME_ENCODE_RAW
+                frameBuff = frame.tobytes()
+            msgBuff = self._CreatePBSrcImgMsg(frameSeq, frame.shape[0], frame.shape[1], frameBuff, extend,
+                                              frameEncode=frameEncode)
+        LOG.debug('send frame data, frameIndex=%s, shmSlot=%s', frameSeq, shmSlot)
+        self.__speedCheck.AddSendImg(frameSeq)
+        self.__commMgr.SendToMC(msgBuff)
+
+    def SendEncodedFrameMsgToMC(self, frameSeq, frameBuff, frameEncode, extend):
         """
-        Send GameFrame to MC
+        Send already encoded GameFrame to MC, the frame is not decoded in IOService
         :param frameSeq: Frame sequence
-        :param frame: GameFrame
+        :param frameBuff: encoded GameFrame(bytes)
+        :param frameEncode: frame encode of frameBuff
         :param extend: extend GameData
         :return:
         """
-        msgBuff = self._CreatePBSrcImgMsg(frameSeq, frame, extend)
-        LOG.debug('send frame data, frameIndex=%s', frameSeq)
+        msgBuff = self._CreatePBSrcImgMsg(frameSeq, 0, 0, frameBuff, extend, frameEncode=frameEncode)
+        LOG.debug('send encoded frame data, frameIndex=%s, encode=%s', frameSeq, frameEncode)
+        self.__speedCheck.AddSendImg(frameSeq)
         self.__commMgr.SendToMC(msgBuff)
 
     def SendAIServiceStateToAIControl(self, serviceState):
@@ -156,13 +182,17 @@ class MsgHandler(object):
         LOG.info('Send Unregister to AIControl, msg_data[%s]', msg_data)
         self.__controlSocket.Send(msg_data)
 
-    def _UpdateInnerMsg(self):
+    def UpdateInnerMsg(self):
+        """
+        Handle the msgs from MC(Inner)
+        :return: True if any msg received
+        """
         # Recv the message
         msgBuffList = self.__commMgr.RecvMsg()
 
         # if recv nothing, then exit
         if len(msgBuffList) == 0:
-            return
+            return False
 
         # parse the message and call handler function
         for msgBuff in msgBuffList:
@@ -174,6 +204,7 @@ class MsgHandler(object):
                 handleFunc(msg)
             else:
                 LOG.warning('Unhandled MsgID[%s]', msg.eMsgID)
+        return True
 
     @staticmethod
     def _ParsePBMsg(msgBuff):
@@ -181,7 +212,11 @@ class MsgHandler(object):
         msg.ParseFromString(msgBuff)
         return msg
 
-    def _UpdateControlMsg(self):
+    def UpdateControlMsg(self):
+        """
+        Handle the msgs from ASM
+        :return: True if any msg received
+        """
         msgList = self.__controlSocket.Recv()
 
         for msg in msgList:
@@ -193,8 +228,13 @@ class MsgHandler(object):
                 handleFunc(msg)
             else:
                 LOG.warning('Unhandled CONTROL msgID[%s]', msgID)
+        return len(msgList) > 0
 
-    def _UpdateClientMsg(self):
+    def UpdateClientMsg(self):
+        """
+        Handle the msgs from AIClient
+        :return: True if any msg handled
+        """
         ret = False
         msgList = self.__clientSocket.Recv()
 
@@ -214,7 +254,11 @@ class MsgHandler(object):
 
         return ret
 
-    def _UpdateHttpClientMsg(self):
+    def UpdateHttpClientMsg(self):
+        """
+        Handle the msgs from Http client
+        :return: True if any msg handled
+        """
         ret = False
         msgList = self.__httpClientConnect.Recv()
 
@@ -466,6 +510,14 @@ class MsgHandler(object):
         msg_data['msg_id'] = MSG_ID_CONTROL_REP
         self.__controlSocket.Send(msg_data)
 
+    def _OnLatencyReq(self, msg_data):
+        LOG.info('Recv latency req msg[%s]', msg_data)
+
+        msg_data = dict()
+        msg_data['msg_id'] = MSG_ID_LATENCY_REP
+        msg_data['latency'] = self.__speedCheck.GetReport()
+        self.__controlSocket.Send(msg_data)
+
     def _OnClientReq(self, msg_data):
         LOG.info('Recv client req msg[%s]', msg_data)
         key = msg_data['key']
@@ -609,14 +661,21 @@ class MsgHandler(object):
         return msg_data
 
     @staticmethod
-    def _CreatePBSrcImgMsg(frameSeq, frame, extend, deviceIndex=0):
+    def _CreatePBSrcImgMsg(frameSeq, height, width, frameBuff, extend, deviceIndex=0, shmSlot=-1,
+                           frameEncode=FRAME_ENCODE_RAW):
         msg = common_pb2.tagMessage()
         # Fill the message
         msg.eMsgID = common_pb2.MSG_SRC_IMAGE_INFO
         msg.stSrcImageInfo.uFrameSeq = frameSeq
-        msg.stSrcImageInfo.nHeight = frame.shape[0]
-        msg.stSrcImageInfo.nWidth = frame.shape[1]
-        msg.stSrcImageInfo.byImageData = frame.tobytes()
+        msg.stSrcImageInfo.nHeight = height
+        msg.stSrcImageInfo.nWidth = width
+        if shmSlot >= 0:
+            # the frame is already in shared memory, only send the slot index
+            msg.stSrcImageInfo.bShmFrame = True
+            msg.stSrcImageInfo.nShmSlot = shmSlot
+        else:
+            msg.stSrcImageInfo.byImageData = frameBuff
+            msg.stSrcImageInfo.eImageEncode = frameEncode
         msg.stSrcImageInfo.uDeviceIndex = deviceIndex
         msg.stSrcImageInfo.strJsonData = extend
 
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import logging
+
+import cv2
+import numpy as np
+
+try:
+    import lz4.block as lz4block
+except ImportError:
+    lz4block = None
+
+LOG = logging.getLogger('IOService')
+
+# frame encode on the inner bus, same as EIMAGEENCODEENUM in common.proto
+FRAME_ENCODE_RAW = 0
+FRAME_ENCODE_JPEG = 1
+FRAME_ENCODE_PNG = 2
+FRAME_ENCODE_LZ4_RAW = 3
+
+FRAME_ENCODE_NAME_DICT = {
+    'raw': FRAME_ENCODE_RAW,
+    'jpeg': FRAME_ENCODE_JPEG,
+    'png': FRAME_ENCODE_PNG,
+    'lz4': FRAME_ENCODE_LZ4_RAW,
+}
+
+JPEG_MAGIC = b'\xff\xd8'
+PNG_MAGIC = b'\x89PNG'
+
+
+def GetFrameEncode(name):
+    """
+    get frame encode from the encode name in config
+    :param name: 'raw', 'jpeg', 'png' or 'lz4'
+    :return: frame encode, None if name is invalid or the encode is not supported
+    """
+    frameEncode = FRAME_ENCODE_NAME_DICT.get(name.lower())
+    if frameEncode == FRAME_ENCODE_LZ4_RAW and lz4block is None:
+        LOG.error('frame encode lz4 needs the lz4 package')
+        return None
+    return frameEncode
+
+
+def SniffFrameEncode(buff):
+    """
+    get the encode of an already encoded image from its magic bytes
+    :param buff: image data(bytes)
+    :return: FRAME_ENCODE_JPEG, FRAME_ENCODE_PNG or None
+    """
+    if not isinstance(buff, (bytes, bytearray)):
+        return None
+    if buff[:2] == JPEG_MAGIC:
+        return FRAME_ENCODE_JPEG
+    if buff[:4] == PNG_MAGIC:
+        return FRAME_ENCODE_PNG
+    return None
+
+
+def EncodeFrame(frame, frameEncode, jpegQuality=90):
+    """
+    encode the frame for the inner bus
+    :param frame: BGR frame
+    :param frameEncode: frame encode
+    :param jpegQuality: quality for FRAME_ENCODE_JPEG
+    :return: encoded data(bytes), None if failed
+    """
+    if frameEncode == FRAME_ENCODE_RAW:
+        return frame.tobytes()
+
+    if frameEncode == FRAME_ENCODE_LZ4_RAW:
+        return lz4block.compress(np.ascontiguousarray(frame), store_size=True)
+
+    if frameEncode == FRAME_ENCODE_JPEG:
+        ret, buff = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpegQuality])
+    elif frameEncode == FRAME_ENCODE_PNG:
+        ret, buff = cv2.imencode('.png', frame)
+    else:
+        LOG.error('unknown frame encode:%s', frameEncode)
+        return None
+
+    if not ret:
+        LOG.error('frame encode failed, encode:%s', frameEncode)
+        return None
+    return buff.tobytes()
+
+
+def DecodeFrame(buff, frameEncode, height=0, width=0):
+    """
+    decode the frame received from the inner bus
+    :param buff: encoded data(bytes)
+    :param frameEncode: frame encode
+    :param height: frame height, needed by FRAME_ENCODE_RAW and FRAME_ENCODE_LZ4_RAW
+    :param width: frame width, needed by FRAME_ENCODE_RAW and FRAME_ENCODE_LZ4_RAW
+    :return: BGR frame, None if failed
+    """
+    if frameEncode == FRAME_ENCODE_RAW:
+        return np.frombuffer(buff, np.uint8).reshape((height, width, 3))
+
+    if frameEncode == FRAME_ENCODE_LZ4_RAW:
+        if lz4block is None:
+            LOG.error('frame decode lz4 needs the lz4 package')
+            return None
+        data = lz4block.decompress(buff)
+        return np.frombuffer(data, np.uint8).reshape((height, width, 3))
+
+    if frameEncode in (FRAME_ENCODE_JPEG, FRAME_ENCODE_PNG):
+        frame = cv2.imdecode(np.frombuffer(buff, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            LOG.error('frame decode failed, encode:%s', frameEncode)
+        return frame
+
+    LOG.error('unknown frame encode:%s', frameEncode)
+    return None
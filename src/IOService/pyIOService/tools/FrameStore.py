@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import logging
+import mmap
+import os
+import platform
+import struct
+import zlib
+
+import numpy as np
+
+LOG = logging.getLogger('IOService')
+
+SHM_DIR = '/dev/shm'
+STORE_MAGIC = b'AIFS'
+# magic, layout, slotNum, slotSize
+STORE_HEADER_FMT = '<4sIII'
+STORE_HEADER_SIZE = 64
+# frameSeq, height, width, channels
+SLOT_HEADER_FMT = '<QIII'
+SLOT_HEADER_SIZE = 64
+# IOService and MC each ship a copy of this module, the writer stores the signature of its layout in the header
+# and the reader refuses a different one. Bump the version when the meaning of the layout changes
+STORE_LAYOUT_VERSION = 1
+STORE_LAYOUT = zlib.crc32(repr((STORE_LAYOUT_VERSION, STORE_HEADER_FMT, STORE_HEADER_SIZE,
+                                SLOT_HEADER_FMT, SLOT_HEADER_SIZE)).encode('utf-8'))
+
+
+class FrameStore(object):
+    """
+    Shared memory ring buffer of game frames, shared between IOService and MC.
+    The writer copies each frame into slot (frameSeq % slotNum) once, and the tbus message only
+    carries the slot index and the frame sequence. The reader maps the slot as a numpy array
+    without copying, and checks the frame sequence to detect the slot has been overwritten.
+    """
+    def __init__(self, name, slotNum=8, slotSize=1920 * 1080 * 3):
+        self.__name = name
+        self.__slotNum = slotNum
+        self.__slotSize = slotSize
+        self.__mmap = None
+        self.__fd = None
+
+    def Create(self):
+        """
+        Create the shared memory as writer
+        :return: True or false
+        """
+        totalSize = STORE_HEADER_SIZE + self.__slotNum * (SLOT_HEADER_SIZE + self.__slotSize)
+        try:
+            self.__mmap = self._Map(totalSize, create=True)
+        except (OSError, ValueError) as err:
+            LOG.error('FrameStore create shared memory[%s] failed, err: %s', self.__name, err)
+            return False
+
+        struct.pack_into(STORE_HEADER_FMT, self.__mmap, 0, STORE_MAGIC, STORE_LAYOUT, self.__slotNum,
+                         self.__slotSize)
+        for slot in range(self.__slotNum):
+            struct.pack_into(SLOT_HEADER_FMT, self.__mmap, self._SlotOffset(slot), 0, 0, 0, 0)
+
+        LOG.info('FrameStore create shared memory[%s], slotNum[%s] slotSize[%s]',
+                 self.__name, self.__slotNum, self.__slotSize)
+        return True
+
+    def Open(self):
+        """
+        Open the shared memory created by the writer, the geometry is read from the store header
+        :return: True or false
+        """
+        try:
+            self.__mmap = self._Map(STORE_HEADER_SIZE, create=False)
+            magic, layout, slotNum, slotSize = struct.unpack_from(STORE_HEADER_FMT, self.__mmap, 0)
+            if magic != STORE_MAGIC:
+                LOG.error('FrameStore shared memory[%s] has wrong magic', self.__name)
+                self.Finish()
+                return False
+
+            if layout != STORE_LAYOUT:
+                LOG.error('FrameStore shared memory[%s] has layout[%s], expect[%s], the FrameStore of IOService '
+                          'and MC are different', self.__name, layout, STORE_LAYOUT)
+                self.Finish()
+                return False
+
+            self.__mmap.close()
+            self.__mmap = None
+            self.__slotNum = slotNum
+            self.__slotSize = slotSize
+            totalSize = STORE_HEADER_SIZE + slotNum * (SLOT_HEADER_SIZE + slotSize)
+            self.__mmap = self._Map(totalSize, create=False)
+        except (OSError, ValueError) as err:
+            LOG.error('FrameStore open shared memory[%s] failed, err: %s', self.__name, err)
+            self.Finish()
+            return False
+
+        LOG.info('FrameStore open shared memory[%s], slotNum[%s] slotSize[%s]',
+                 self.__name, self.__slotNum, self.__slotSize)
+        return True
+
+    def IsOpened(self):
+        """
+        Whether the shared memory is mapped
+        :return: True or false
+        """
+        return self.__mmap is not None
+
+    def Write(self, frameSeq, frame):
+        """
+        Copy the frame into its slot
+        :param frameSeq: frame sequence, must be greater than 0
+        :param frame: the frame, HxW or HxWxC uint8 array
+        :return: the slot index, -1 if the frame can not be stored
+        """
+        if self.__mmap is None or frameSeq <= 0:
+            return -1
+
+        if frame.nbytes > self.__slotSize or frame.dtype != np.uint8:
+            LOG.debug('FrameStore can not store frame, shape[%s] dtype[%s]', frame.shape, frame.dtype)
+            return -1
+
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        slot = frameSeq % self.__slotNum
+        offset = self._SlotOffset(slot)
+
+        # invalidate the slot first, so a reader never takes a half written frame
+        struct.pack_into(SLOT_HEADER_FMT, self.__mmap, offset, 0, 0, 0, 0)
+        data = np.ndarray(shape=frame.shape, dtype=np.uint8, buffer=self.__mmap,
+                          offset=offset + SLOT_HEADER_SIZE)
+        data[...] = frame
+        struct.pack_into(SLOT_HEADER_FMT, self.__mmap, offset, frameSeq, height, width, channels)
+        return slot
+
+    def Read(self, slot, frameSeq):
+        """
+        Get the frame stored in slot, the returned array is a view on the shared memory
+        :param slot: the slot index
+        :param frameSeq: the expected frame sequence
+        :return: the frame, None if the slot has been overwritten
+        """
+        if self.__mmap is None or slot < 0 or slot >= self.__slotNum:
+            return None
+
+        offset = self._SlotOffset(slot)
+        seq, height, width, channels = struct.unpack_from(SLOT_HEADER_FMT, self.__mmap, offset)
+        if seq != frameSeq:
+            return None
+
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        return np.ndarray(shape=shape, dtype=np.uint8, buffer=self.__mmap,
+                          offset=offset + SLOT_HEADER_SIZE)
+
+    def IsValid(self, slot, frameSeq):
+        """
+        Whether the slot still holds the frame, call it after using a frame returned by Read
+        :param slot: the slot index
+        :param frameSeq: the expected frame sequence
+        :return: True or false
+        """
+        if self.__mmap is None:
+            return False
+        seq = struct.unpack_from('<Q', self.__mmap, self._SlotOffset(slot))[0]
+        return seq == frameSeq
+
+    def Finish(self):
+        """
+        Unmap the shared memory
+        :return:
+        """
+        if self.__mmap is not None:
+            try:
+                self.__mmap.close()
+            except BufferError:
+                # numpy views on the shared memory are still alive, leave it to the gc
+                LOG.warning('FrameStore shared memory[%s] still in use', self.__name)
+            self.__mmap = None
+
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def _SlotOffset(self, slot):
+        return STORE_HEADER_SIZE + slot * (SLOT_HEADER_SIZE + self.__slotSize)
+
+    def _Map(self, size, create):
+        if platform.system() == 'Windows':
+            # named shared memory, the tagname is visible to all processes of the session
+            return mmap.mmap(-1, size, tagname=self.__name)
+
+        if self.__fd is None:
+            path = os.path.join(SHM_DIR, self.__name)
+            if create:
+                self.__fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+                os.ftruncate(self.__fd, size)
+            else:
+                self.__fd = os.open(path, os.O_RDWR)
+        return mmap.mmap(self.__fd, size)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import argparse
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from communicate.SocketThread import RecvThread, SendThread
+from communicate.ZMQSocket import ZMQSocket
+
+
+def RunBenchmark(msgNum, msgSize, port):
+    """
+    Send msgNum msgs through SendThread -> zmq -> RecvThread on localhost, one hop of
+    the AIClient <-> IOService path, and measure the throughput and latency of the hop
+    :param msgNum: number of msgs
+    :param msgSize: payload bytes of each msg
+    :param port: tcp port used by the benchmark
+    :return: (msgs per second, p50 latency, p99 latency), latency in milliseconds
+    """
+    recvSocket = ZMQSocket(port=port, pattern=zmq.PAIR)
+    sendSocket = ZMQSocket(port=port, pattern=zmq.PAIR, ip='127.0.0.1')
+    recvSocket.Initialize(isServer=True)
+    sendSocket.Initialize(isServer=False)
+
+    sendQueue = queue.Queue()
+    recvQueue = queue.Queue()
+    recvThread = RecvThread(recvSocket, recvQueue)
+    sendThread = SendThread(sendSocket, sendQueue)
+    recvThread.setDaemon(True)
+    sendThread.setDaemon(True)
+    recvThread.start()
+    sendThread.start()
+
+    payload = b'0' * msgSize
+    latencyList = np.zeros(msgNum)
+    beginTime = time.time()
+    for index in range(msgNum):
+        sendQueue.put_nowait({'index': index, 'ts': time.time(), 'data': payload})
+
+    for _ in range(msgNum):
+        data = recvQueue.get()
+        latencyList[data['index']] = time.time() - data['ts']
+    totalTime = time.time() - beginTime
+
+    recvThread.finish()
+    sendThread.finish()
+    recvSocket.Finish()
+    sendSocket.Finish()
+
+    latencyList *= 1000
+    return msgNum / totalTime, np.percentile(latencyList, 50), np.percentile(latencyList, 99)
+
+
+def main():
+    """
+    benchmark entry
+    """
+    parser = argparse.ArgumentParser(description='IOService socket thread benchmark')
+    parser.add_argument('--num', type=int, default=20000, help='number of msgs')
+    parser.add_argument('--size', type=int, default=256, help='payload bytes of each msg')
+    parser.add_argument('--port', type=int, default=18898, help='tcp port used by the benchmark')
+    args = parser.parse_args()
+
+    msgPerSec, p50, p99 = RunBenchmark(args.num, args.size, args.port)
+    print('msgs: {}, size: {}B, {:.0f} msgs/s, latency p50: {:.3f}ms, p99: {:.3f}ms'.format(
+        args.num, args.size, msgPerSec, p50, p99))
+
+
+if __name__ == '__main__':
+    main()
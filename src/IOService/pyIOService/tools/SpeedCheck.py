@@ -8,28 +8,100 @@ For full details, please refer to the file "LICENSE.txt" which is provided as pa
 Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
+import json
 import logging
-import time
+import math
+
+import numpy as np
+
+from tools.FrameTrace import FrameTrace, TRACE_STAGE_CLIENT_RECV, TRACE_STAGE_DECODE, TRACE_STAGE_ACTION_SEND, \
+    TRACE_STAGE_NUM, TRACE_STAGE_NAME_LIST
 
 LOG = logging.getLogger('IOService')
 
 RECORD_INTERVAL_NUM = 100
-PROCESS_IMG_TIME_INTERVAL = 50
+
+# latency histogram buckets, log spaced from HIST_MIN_MS to HIST_MIN_MS * 2 ** HIST_OCTAVE_NUM
+HIST_MIN_MS = 0.05
+HIST_OCTAVE_NUM = 18
+HIST_BUCKETS_PER_OCTAVE = 8
+
+TOTAL_STAGE_NAME = 'total'
+
+
+class LatencyHistogram(object):
+    """
+    Fixed memory latency histogram, the percentiles are accurate to one bucket (about 9%)
+    """
+    def __init__(self):
+        bucketNum = HIST_OCTAVE_NUM * HIST_BUCKETS_PER_OCTAVE + 2
+        self.__counts = np.zeros(bucketNum, dtype=np.int64)
+        # upper bound of each bucket, the first bucket holds values under HIST_MIN_MS
+        self.__bounds = HIST_MIN_MS * np.power(2., np.arange(bucketNum) / HIST_BUCKETS_PER_OCTAVE)
+        self.__bounds[-1] = np.inf
+        self.__count = 0
+        self.__sum = 0.
+        self.__max = 0.
+
+    def Add(self, valueMS):
+        """
+        Add a latency
+        :param valueMS: latency in milliseconds
+        :return:
+        """
+        # the stamps come from several processes, keep a tiny clock step from making it negative
+        valueMS = max(float(valueMS), 0.)
+        if valueMS < HIST_MIN_MS:
+            index = 0
+        else:
+            index = int(math.log2(valueMS / HIST_MIN_MS) * HIST_BUCKETS_PER_OCTAVE) + 1
+            index = min(index, len(self.__counts) - 1)
+        self.__counts[index] += 1
+        self.__count += 1
+        self.__sum += valueMS
+        self.__max = max(self.__max, valueMS)
+
+    def Percentile(self, percent):
+        """
+        Get the percentile
+        :param percent: 0 ~ 100
+        :return: upper bound of the bucket holding the percentile, in milliseconds
+        """
+        if self.__count == 0:
+            return 0.
+        rank = max(int(math.ceil(self.__count * percent / 100.)), 1)
+        index = int(np.searchsorted(np.cumsum(self.__counts), rank))
+        return min(float(self.__bounds[index]), self.__max)
+
+    def GetStat(self):
+        """
+        Get the statistic result
+        :return: dict with count, avg, p50, p95, p99 and max, in milliseconds
+        """
+        avg = self.__sum / self.__count if self.__count > 0 else 0.
+        return {'count': self.__count,
+                'avg': round(avg, 3),
+                'p50': round(self.Percentile(50), 3),
+                'p95': round(self.Percentile(95), 3),
+                'p99': round(self.Percentile(99), 3),
+                'max': round(self.__max, 3)}
 
 
 class IOSpeedCheck(object):
     """
-    Speed Check module, output the statistic result to log
+    Speed Check module, traces each frame from client recv to action send through the FrameTrace
+    shared with MC and AgentAI, and keeps the latency of each stage in histograms
     """
 
-    def __init__(self):
-        self.__imgRecvDict = {}
-        self.__processImgDict = {}
-        self.__imgRecvNum = 0
+    def __init__(self, frameTrace=None):
+        self.__frameTrace = frameTrace if frameTrace is not None else FrameTrace()
+        # latency of stage i is the time from the previous stamped stage to stage i
+        self.__histDict = dict()
+        for stage in range(TRACE_STAGE_DECODE, TRACE_STAGE_NUM):
+            self.__histDict[TRACE_STAGE_NAME_LIST[stage]] = LatencyHistogram()
+        self.__histDict[TOTAL_STAGE_NAME] = LatencyHistogram()
+        self.__maxRecvImgID = -1
         self.__processActionNum = 0
-        self.__processImgNum = 0
-        self.__avgActionProcessTime = 0
-        self.__avgImgProcessTime = 0
 
     def AddRecvImg(self, imgID):
         """
@@ -37,50 +109,63 @@ class IOSpeedCheck(object):
         :param imgID: frameSeq
         :return:
         """
-        self.__imgRecvDict[imgID] = time.time()
-        self.__imgRecvNum += 1
+        self.__frameTrace.Begin(imgID)
+        self.__maxRecvImgID = max(self.__maxRecvImgID, imgID)
+
+    def AddSendImg(self, imgID):
+        """
+        When the img is decoded and sent to MC, call this
+        :param imgID: frameSeq
+        :return:
+        """
+        self.__frameTrace.Stamp(imgID, TRACE_STAGE_DECODE)
 
     def AddSendAction(self, imgID):
         """
-        When send an action, call this
+        When send an action, call this, only the first action of each img is counted
         :param imgID: frameSeq
         :return:
         """
-        if imgID in self.__imgRecvDict:
-            diffTime = time.time() - self.__imgRecvDict[imgID]
-            self.__avgActionProcessTime = (self.__avgActionProcessTime * self.__processActionNum + diffTime) / (
-                    self.__processActionNum + 1)
-            self.__processActionNum += 1
-
-            self.__processImgDict[imgID] = time.time()
-            if len(self.__processImgDict) % PROCESS_IMG_TIME_INTERVAL == 0:
-                sumTime = 0
-                for key in self.__processImgDict:
-                    sumTime += self.__processImgDict[key] - self.__imgRecvDict[key]
-
-                self.__avgImgProcessTime = (self.__avgImgProcessTime * self.__processImgNum + sumTime) / (
-                        self.__processImgNum + len(self.__processImgDict))
-                self.__processImgNum += len(self.__processImgDict)
-                self.__processImgDict = {}
-                keyList = []
-                for key in self.__imgRecvDict:
-                    if key <= imgID:
-                        keyList.append(key)
-                for key in keyList:
-                    del self.__imgRecvDict[key]
-
-            if self.__processActionNum % RECORD_INTERVAL_NUM == 0:
-                maxRecvImgID = self._GetMaxImgID()
-                LOG.info("current_process_img_id:{}".format(imgID))
-                LOG.info("recv max imgID:{}".format(maxRecvImgID))
-                LOG.info("process action num:{a}, avg_action_process_time:{b}".
-                         format(a=self.__processActionNum, b=self.__avgActionProcessTime))
-                LOG.info("process_img num:{a}, avg_img_process_time:{b}".
-                         format(a=self.__processImgNum, b=self.__avgImgProcessTime))
-
-    def _GetMaxImgID(self):
-        maxImgID = -1
-        for imgID in self.__imgRecvDict:
-            if maxImgID < imgID:
-                maxImgID = imgID
-        return maxImgID
+        if not self.__frameTrace.Stamp(imgID, TRACE_STAGE_ACTION_SEND):
+            return
+
+        timestamps = self.__frameTrace.Get(imgID)
+        if timestamps is None:
+            return
+
+        lastTime = timestamps[TRACE_STAGE_CLIENT_RECV]
+        for stage in range(TRACE_STAGE_DECODE, TRACE_STAGE_NUM):
+            if timestamps[stage] == 0:
+                continue
+            self.__histDict[TRACE_STAGE_NAME_LIST[stage]].Add(1000 * (timestamps[stage] - lastTime))
+            lastTime = timestamps[stage]
+        self.__histDict[TOTAL_STAGE_NAME].Add(
+            1000 * (timestamps[TRACE_STAGE_ACTION_SEND] - timestamps[TRACE_STAGE_CLIENT_RECV]))
+        self.__processActionNum += 1
+
+        if self.__processActionNum % RECORD_INTERVAL_NUM == 0:
+            LOG.info("current_process_img_id:{}".format(imgID))
+            LOG.info("recv max imgID:{}".format(self.__maxRecvImgID))
+            for name, stat in self.GetReport().items():
+                LOG.info("latency {}: {}".format(name, stat))
+
+    def GetReport(self):
+        """
+        Get the latency of each stage
+        :return: dict of stage name to the statistic result of LatencyHistogram
+        """
+        return {name: hist.GetStat() for name, hist in self.__histDict.items()}
+
+    def Dump(self, path):
+        """
+        Dump the latency of each stage to a json file
+        :param path: file path
+        :return: True or false
+        """
+        try:
+            with open(path, 'w') as fileObj:
+                json.dump(self.GetReport(), fileObj, indent=4)
+        except IOError as err:
+            LOG.error('Dump latency to %s failed, err: %s', path, err)
+            return False
+        return True
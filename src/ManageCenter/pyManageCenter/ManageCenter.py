@@ -16,18 +16,20 @@ import cv2
 
 from common.Define import RUN_TYPE_UI_AI, RESULT_TYPE_AI, SERVICE_UNREGISTER, SERVICE_TYPE_REG, SERVICE_TYPE_UI, \
     ALL_NORMAL, AGENT_EXIT, UI_EXIT, REG_EXIT, RESULT_TYPE_UI, RUN_TYPE_AI, RUN_TYPE_UI
+from common.Reactor import Reactor, PRIORITY_FRAME
 from commmanager.CommManager import CommManager
 from msghandler.MsgHandler import MsgHandler
+from gamemanager.FrameCreditManager import FrameCreditManager
 from gamemanager.GameManager import GameManager
 from gamemanager.ResultManager import ResultManager
 from servicemanager.ServiceManager import ServiceManager
 from monitormanager.MonitorManager import MonitorManager
 from util.config_path_mgr import SYS_CONFIG_DIR, DEFAULT_USER_CONFIG_DIR
+from util.FrameStore import FrameStore
+from util.FrameTrace import FrameTrace, TRACE_STAGE_MC_FORWARD
 
-MAIN_LOOP_RATE = 60
-MAIN_LOOP_SLEEP_TIME = 1. / MAIN_LOOP_RATE
-OTHERS_LOOP_RATE = 1
-OTHERS_LOOP_COUNT = int(MAIN_LOOP_RATE / OTHERS_LOOP_RATE)
+# interval of monitoring the services, in seconds
+MONITOR_INTERVAL = 1
 
 TBUS_CFG_PATH = 'cfg/platform/bus.ini'
 
@@ -39,8 +41,7 @@ class ManageCenter(object):
     ManageCenter Main class
     """
     def __init__(self, taskCfgPath, platformCfgPath):
-        self.__exited = False
-        self.__loopCount = 0
+        self.__reactor = Reactor()
         self.__debugShowFrame = False
         self.__initTimestamp = time.time()
 
@@ -56,7 +57,13 @@ class ManageCenter(object):
         self.__msgHandler = None
         self.__serviceMgr = None
         self.__monitorMgr = None
+        self.__frameStore = None
+        self.__frameStoreName = None
+        self.__frameTrace = FrameTrace()
+        self.__creditMgr = None
+        self.__flowControlCfg = None
         self.__lastFrameSeq = 0
+        self.__lastRegFrameSeq = 0
         self.__lastMonitorResult = None
 
         self.__resultPath = None
@@ -80,8 +87,13 @@ class ManageCenter(object):
         self.__serviceMgr = ServiceManager(self.__runType)
         self.__gameMgr = GameManager()
         self.__resultMgr = ResultManager()
+        self.__frameStore = FrameStore(name=self.__frameStoreName)
+        if self.__flowControlCfg['enable']:
+            self.__creditMgr = FrameCreditManager(creditNum=self.__flowControlCfg['credit_num'],
+                                                  creditTimeout=self.__flowControlCfg['credit_timeout'])
         self.__msgHandler = MsgHandler(self.__commMgr, self.__gameMgr, self.__serviceMgr,
-                                       self.__resultMgr, self.__resultType, self.__runType)
+                                       self.__resultMgr, self.__resultType, self.__runType,
+                                       self.__frameStore, self.__creditMgr)
         self.__monitorMgr = MonitorManager(self.__runType)
 
         # Initialize sub modules
@@ -104,6 +116,10 @@ class ManageCenter(object):
             LOG.error('ResultManager Initialize failed!')
             return False
 
+        # frames are forwarded as soon as they are received, the monitor runs on a timer
+        self.__reactor.AddSource('msg', self._UpdateMsgAndFrame, PRIORITY_FRAME)
+        self.__reactor.AddTimer('others', MONITOR_INTERVAL, self._UpdateOthers)
+
         self.__initTimestamp = time.time()
         return True
 
@@ -112,25 +128,7 @@ class ManageCenter(object):
         Loop run funtion
         :return:
         """
-        while not self.__exited:
-            beginTime = time.time()
-            self._UpdateMsgHandler()  # Update Message handler
-            updateMsgTime = time.time()
-            self._UpdateFrame()  # Update frame
-            updateFrameTime = time.time()
-            self._UpdateOthers()
-            endTime = time.time()
-            sleepTime = MAIN_LOOP_SLEEP_TIME - (endTime - beginTime)
-            if sleepTime > 0:
-                time.sleep(sleepTime)
-            elif endTime - beginTime > 0.05:
-                overMS = int(-1000 * sleepTime)
-                totalMS = int(1000 * MAIN_LOOP_SLEEP_TIME) + overMS
-                msgMS = int(1000 * (updateMsgTime - beginTime))
-                frameMS = int(1000 * (updateFrameTime - updateMsgTime))
-                othersMS = int(1000 * (endTime - updateFrameTime))
-                LOG.warning('MainLoop overschedule %sms: %s=%s+%s+%s', overMS, totalMS, msgMS, frameMS, othersMS)
-            self.__loopCount += 1
+        self.__reactor.Run()
 
         self.__msgHandler.SendServiceRegisterMsgToIO(SERVICE_UNREGISTER)
 
@@ -144,54 +142,66 @@ class ManageCenter(object):
         self.__resultMgr.Finish()
         self.__commMgr.Finish()
         self.__serviceMgr.Finish()
+        self.__frameStore.Finish()
+        self.__frameTrace.Finish()
 
     def SetExited(self):
         """
         This module will exit when called
         :return:
         """
-        self.__exited = True
+        self.__reactor.Stop()
 
-    def _UpdateMsgHandler(self):
-        self.__msgHandler.Update()
+    def _UpdateMsgAndFrame(self):
+        recvMsg = self.__msgHandler.Update()
+        sendFrame = self._UpdateFrame()
+        return recvMsg or sendFrame
 
     def _UpdateFrame(self):
         if not self.__serviceMgr.IsTaskReady():
-            return
-
-        frame = self.__gameMgr.GetGameFrame()
-        if frame is None:
-            return
+            return False
 
         frameSeq = self.__gameMgr.GetFrameSeq()
-        if self.__lastFrameSeq == frameSeq:
-            return
+        sendUI = self.__lastFrameSeq != frameSeq
+        sendReg = self.__lastRegFrameSeq != frameSeq and self.__gameMgr.GameStarted()
+        # a frame waiting for a credit is sent to the recognizers when the credit comes back
+        if sendReg and self.__creditMgr is not None:
+            sendReg = self.__creditMgr.Acquire(frameSeq)
+        if not sendUI and not sendReg:
+            return False
 
-        data = self.__gameMgr.GetGameData()
+        frame = self.__gameMgr.GetGameFrame()
+        if frame is None:
+            return False
 
-        if self.__debugShowFrame:
+        if self.__debugShowFrame and sendUI:
             cv2.imshow('MC', frame)
             cv2.waitKey(1)
 
-        if self.__gameMgr.GameStarted():
+        # each message is serialized once and the same buff is sent to every service
+        if sendReg:
+            data = self.__gameMgr.GetGameData()
             addrList = self.__serviceMgr.GetAllServiceAddr(serviceType=SERVICE_TYPE_REG)
-            for addr in addrList:
-                self.__msgHandler.SendGameFrameMsgTo(addr=addr, gameFrame=frame, gameData=data,
-                                                     frameSeq=frameSeq)
-
-        addrList = self.__serviceMgr.GetAllServiceAddr(serviceType=SERVICE_TYPE_UI)
-        for addr in addrList:
-            self.__msgHandler.SendUIAPIStateMsgTo(addr=addr, gameFrame=frame, frameSeq=frameSeq)
-
-        self.__lastFrameSeq = frameSeq
+            # the frame on the shared memory may be overwritten while serializing, then it is dropped
+            if self.__msgHandler.SendGameFrameMsgToAll(addrList=addrList, gameFrame=frame, gameData=data,
+                                                       frameSeq=frameSeq):
+                self.__frameTrace.Stamp(frameSeq, TRACE_STAGE_MC_FORWARD)
+            elif self.__creditMgr is not None:
+                self.__creditMgr.Cancel(frameSeq)
+            self.__lastRegFrameSeq = frameSeq
+
+        if sendUI:
+            addrList = self.__serviceMgr.GetAllServiceAddr(serviceType=SERVICE_TYPE_UI)
+            self.__msgHandler.SendUIAPIStateMsgToAll(addrList=addrList, gameFrame=frame, frameSeq=frameSeq)
+            self.__lastFrameSeq = frameSeq
+        return True
 
     def _UpdateOthers(self):
         now = time.time()
         if now - self.__initTimestamp < 30:
             return
 
-        if self.__loopCount % OTHERS_LOOP_COUNT == 0:
-            self._UpdateMonitor()
+        self._UpdateMonitor()
 
     def _UpdateMonitor(self):
         result = self.__monitorMgr.GetResult()
@@ -262,6 +272,14 @@ class ManageCenter(object):
             self.__resultCfg['timeout'] = iniCfg.getint('RESULT', 'Timeout', fallback=3600)
 
             self.__resultType = iniCfg.get('RESULT', 'Type', fallback=self.__resultType)
+
+            self.__frameStoreName = iniCfg.get('FRAME_TRANSPORT', 'ShmName', fallback='ai_sdk_frame')
+
+            self.__flowControlCfg = dict()
+            self.__flowControlCfg['enable'] = iniCfg.getboolean('FLOW_CONTROL', 'Enable', fallback=False)
+            self.__flowControlCfg['credit_num'] = iniCfg.getint('FLOW_CONTROL', 'CreditNum', fallback=2)
+            self.__flowControlCfg['credit_timeout'] = iniCfg.getfloat('FLOW_CONTROL', 'CreditTimeout',
+                                                                      fallback=1.)
         except KeyError as e:
             LOG.error('Load Config File[%s] failed, err: %s', self.__platformCfgPath, e)
             return False
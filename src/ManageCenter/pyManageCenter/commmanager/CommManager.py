@@ -11,6 +11,7 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 import configparser
 import logging
 import os
+import time
 
 import tbus
 
@@ -18,6 +19,8 @@ from common.Define import RUN_TYPE_UI_AI, RUN_TYPE_AI, RUN_TYPE_UI
 
 LOG = logging.getLogger('ManageCenter')
 
+SEND_STAT_INTERVAL = 300
+
 
 class CommManager(object):
     """
@@ -36,6 +39,7 @@ class CommManager(object):
         self.__IOAddr = None
         self.__recvAddrsSet = set()
         self.__recvAgentAddrsSet = set()
+        self.__sendStat = dict()
 
     def Initialize(self, configFile):
         """
@@ -88,6 +92,26 @@ class CommManager(object):
             return False
         return True
 
+    def SendToAll(self, addrList, buff):
+        """
+        Send the same buff to all addrs, and record the send time of each addr
+        """
+        for addr in addrList:
+            beginTime = time.time()
+            self.SendTo(addr, buff)
+            self._RecordSendTime(addr, time.time() - beginTime)
+
+    def GetSendStat(self):
+        """
+        Get the send time statistic of each addr in current interval
+        :return: dict of addr: (count, avg send time, max send time), time in seconds
+        """
+        result = dict()
+        for addr, (count, totalTime, maxTime) in self.__sendStat.items():
+            if count > 0:
+                result[addr] = (count, totalTime / count, maxTime)
+        return result
+
     def SendMsgToIOService(self, buff):
         """
         Send the buff to IOService
@@ -124,6 +148,21 @@ class CommManager(object):
         if self.__selfAddr:
             tbus.Exit(self.__selfAddr)
 
+    def _RecordSendTime(self, addr, sendTime):
+        stat = self.__sendStat.get(addr)
+        if stat is None:
+            stat = [0, 0., 0.]
+            self.__sendStat[addr] = stat
+
+        stat[0] += 1
+        stat[1] += sendTime
+        stat[2] = max(stat[2], sendTime)
+
+        if stat[0] >= SEND_STAT_INTERVAL:
+            LOG.info('Send to addr[%s] %s msgs, avg %.3fms, max %.3fms', addr, stat[0],
+                     1000 * stat[1] / stat[0], 1000 * stat[2])
+            stat[0], stat[1], stat[2] = 0, 0., 0.
+
     @staticmethod
     def _LoadTbusConfig(cfgPath):
         tbusArgs = {}
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+LOG = logging.getLogger('ManageCenter')
+
+# source priority, smaller runs first in each round
+PRIORITY_FRAME = 0
+PRIORITY_MSG = 1
+PRIORITY_HOUSEKEEPING = 2
+
+# tbus can not notify, so an idle loop still polls, the wait grows from min to max while idle
+IDLE_WAIT_MIN = 0.0005
+IDLE_WAIT_MAX = 0.004
+OVERSCHEDULE_TIME = 0.05
+
+
+class Reactor(object):
+    """
+    Main loop scheduler, runs the sources by priority as soon as they have work, and runs the periodic work
+    on timers. It is not event driven: when all the sources are idle it waits IDLE_WAIT_MIN to IDLE_WAIT_MAX
+    seconds on the wake event and polls again. Only sources which set the wake event, such as the client
+    sockets, end the wait early; a tbus msg does not, it waits for the next poll
+    """
+    def __init__(self, idleWaitMin=IDLE_WAIT_MIN, idleWaitMax=IDLE_WAIT_MAX):
+        self.__exited = False
+        self.__sources = []
+        self.__timers = []
+        self.__timerCount = 0
+        self.__wakeEvent = threading.Event()
+        self.__idleWaitMin = idleWaitMin
+        self.__idleWaitMax = idleWaitMax
+        self.__idleWait = idleWaitMin
+
+    def GetWakeEvent(self):
+        """
+        Get the event to set when new data arrives, which wakes up the idle loop at once
+        :return: threading.Event
+        """
+        return self.__wakeEvent
+
+    def AddSource(self, name, func, priority=PRIORITY_MSG):
+        """
+        Add a source polled in every round
+        :param name: source name, used in log
+        :param func: poll function, return True if there was work to do
+        :param priority: PRIORITY_FRAME, PRIORITY_MSG or PRIORITY_HOUSEKEEPING
+        :return:
+        """
+        self.__sources.append((priority, len(self.__sources), name, func))
+        self.__sources.sort()
+
+    def AddTimer(self, name, interval, func, delay=0.):
+        """
+        Add a periodic timer
+        :param name: timer name, used in log
+        :param interval: interval in seconds
+        :param func: timer function
+        :param delay: delay of the first run in seconds
+        :return:
+        """
+        self._PushTimer(time.time() + delay, interval, name, func)
+
+    def Run(self):
+        """
+        Run until Stop is called
+        :return:
+        """
+        while not self.__exited:
+            self.RunOnce()
+
+    def RunOnce(self):
+        """
+        Run all the sources and the expired timers once, wait if nothing to do
+        :return:
+        """
+        # clear before polling, a set during polling makes the wait below return at once
+        self.__wakeEvent.clear()
+
+        busy = False
+        for _, _, name, func in self.__sources:
+            beginTime = time.time()
+            if func():
+                busy = True
+            self._CheckOverSchedule(name, beginTime)
+
+        self._RunTimers()
+
+        if busy:
+            self.__idleWait = self.__idleWaitMin
+            return
+
+        waitTime = self.__idleWait
+        if self.__timers:
+            waitTime = min(waitTime, max(self.__timers[0][0] - time.time(), 0.))
+        self.__wakeEvent.wait(waitTime)
+        self.__idleWait = min(self.__idleWait * 2, self.__idleWaitMax)
+
+    def Stop(self):
+        """
+        Stop the loop, can be called from signal handler or other threads
+        :return:
+        """
+        self.__exited = True
+        self.__wakeEvent.set()
+
+    def _RunTimers(self):
+        now = time.time()
+        while self.__timers and self.__timers[0][0] <= now:
+            deadline, _, interval, name, func = heapq.heappop(self.__timers)
+            beginTime = time.time()
+            func()
+            self._CheckOverSchedule(name, beginTime)
+            # keep the period, but never run a missed timer more than once
+            self._PushTimer(max(deadline + interval, now), interval, name, func)
+
+    def _PushTimer(self, deadline, interval, name, func):
+        heapq.heappush(self.__timers, (deadline, self.__timerCount, interval, name, func))
+        self.__timerCount += 1
+
+    @staticmethod
+    def _CheckOverSchedule(name, beginTime):
+        costTime = time.time() - beginTime
+        if costTime > OVERSCHEDULE_TIME:
+            LOG.warning('MainLoop %s overschedule %sms', name, int(1000 * costTime))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+"""
+
+import collections
+import logging
+import time
+
+LOG = logging.getLogger('ManageCenter')
+
+DROP_LOG_INTERVAL = 100
+# the flow control is off again if no credit comes back in this many credit timeouts
+INACTIVE_TIMEOUT_TIMES = 10
+
+
+class FrameCreditManager(object):
+    """
+    Credit based flow control of the frames sent to the recognizers.
+    Each frame sent takes a credit, the credit is returned when the consumer of the recognize
+    result(AgentAI) reports a result of this frame or a later one. When no credit is left the
+    frame is not sent, a newer frame replaces it and it is counted as dropped.
+    The flow control is only active after the consumer returns its first credit, so the frames are
+    not throttled when nothing returns credits(no AgentAI running, SDKTool or UI only), and it is off
+    again when the consumer stops returning credits.
+    """
+    def __init__(self, creditNum=2, creditTimeout=1.):
+        self.__creditNum = creditNum
+        self.__creditTimeout = creditTimeout
+        # (frameSeq, sendTime) of the frames waiting for the result
+        self.__inFlightQueue = collections.deque()
+        self.__waitingFrameSeq = None
+        self.__dropCount = 0
+        self.__timeoutCount = 0
+        self.__active = False
+        self.__lastReleaseTime = 0.
+
+    def Acquire(self, frameSeq):
+        """
+        Take a credit for sending the frame
+        :param frameSeq: frame sequence
+        :return: True if the frame can be sent
+        """
+        if not self._IsActive():
+            return True
+
+        self._ReclaimTimeout()
+
+        if self.__waitingFrameSeq is not None and self.__waitingFrameSeq != frameSeq:
+            self._AddDrop()
+        self.__waitingFrameSeq = frameSeq
+
+        if len(self.__inFlightQueue) >= self.__creditNum:
+            return False
+
+        self.__inFlightQueue.append((frameSeq, time.time()))
+        self.__waitingFrameSeq = None
+        return True
+
+    def Release(self, frameSeq):
+        """
+        Return the credits of the frames not later than frameSeq, the recognizers only keep the
+        latest frame, so the frames before the reported one have been handled or dropped
+        :param frameSeq: frame sequence of the result
+        :return: True if any credit returned
+        """
+        if not self.__active:
+            LOG.info('FrameCredit flow control is active, the first credit is returned')
+            self.__active = True
+        self.__lastReleaseTime = time.time()
+
+        released = False
+        while self.__inFlightQueue and self.__inFlightQueue[0][0] <= frameSeq:
+            self.__inFlightQueue.popleft()
+            released = True
+        return released
+
+    def Cancel(self, frameSeq):
+        """
+        Return the credit of a frame which took a credit but was not sent
+        :param frameSeq: frame sequence
+        :return: True if the credit returned
+        """
+        for index, (seq, _) in enumerate(self.__inFlightQueue):
+            if seq == frameSeq:
+                del self.__inFlightQueue[index]
+                return True
+        return False
+
+    def Reset(self):
+        """
+        Return all the credits, call it when the game or the task restarts
+        :return:
+        """
+        self.__inFlightQueue.clear()
+        self.__waitingFrameSeq = None
+
+    def GetStat(self):
+        """
+        Get the statistic result
+        :return: dict of inflight, drop and timeout count
+        """
+        return {'active': self.__active,
+                'inflight': len(self.__inFlightQueue),
+                'drop': self.__dropCount,
+                'timeout': self.__timeoutCount}
+
+    def _IsActive(self):
+        if self.__active and time.time() - self.__lastReleaseTime > self.__creditTimeout * INACTIVE_TIMEOUT_TIMES:
+            LOG.info('FrameCredit flow control is inactive, no credit returned in %s seconds',
+                     self.__creditTimeout * INACTIVE_TIMEOUT_TIMES)
+            self.__active = False
+            self.__inFlightQueue.clear()
+            self.__waitingFrameSeq = None
+        return self.__active
+
+    def _ReclaimTimeout(self):
+        # a frame without result(game restarted, recognizer restarted) must not hold its credit forever
+        now = time.time()
+        while self.__inFlightQueue and now - self.__inFlightQueue[0][1] > self.__creditTimeout:
+            self.__inFlightQueue.popleft()
+            self.__timeoutCount += 1
+
+    def _AddDrop(self):
+        self.__dropCount += 1
+        if self.__dropCount % DROP_LOG_INTERVAL == 0:
+            LOG.info('FrameCredit drop %s frames, %s credits timeout', self.__dropCount, self.__timeoutCount)
@@ -11,6 +11,7 @@ Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 import logging
 
 from common.Define import GAME_STATE_NONE, GAME_STATE_START
+from util.FrameCodec import DecodeFrame
 
 LOG = logging.getLogger('ManageCenter')
 
@@ -21,6 +22,8 @@ class GameManager(object):
     """
     def __init__(self):
         self.__gameFrame = None
+        self.__encodedFrame = None
+        self.__shmSlot = -1
         self.__gameState = GAME_STATE_NONE
         self.__prevGameSate = GAME_STATE_NONE
         self.__frameSeq = 0
@@ -32,6 +35,8 @@ class GameManager(object):
         :return:
         """
         self.__gameFrame = None
+        self.__encodedFrame = None
+        self.__shmSlot = -1
         self.__gameState = GAME_STATE_NONE
         self.__prevGameSate = GAME_STATE_NONE
         self.__frameSeq = 0
@@ -39,19 +44,52 @@ class GameManager(object):
 
     def GetGameFrame(self):
         """
-        Get the current frame
+        Get the current frame, an encoded frame is decoded here on first access
         :return: the current frame
         """
+        if self.__encodedFrame is not None:
+            frameBuff, frameEncode, height, width = self.__encodedFrame
+            self.__encodedFrame = None
+            self.__gameFrame = DecodeFrame(frameBuff, frameEncode, height, width)
         return self.__gameFrame
 
-    def SetGameFrame(self, frame, frameSeq=None):
+    def GetShmSlot(self):
+        """
+        Get the shared memory slot of the current frame
+        :return: the slot index, -1 if the frame is not a view on the shared memory
+        """
+        return self.__shmSlot
+
+    def SetGameFrame(self, frame, frameSeq=None, shmSlot=-1):
         """
         Set the current frame, used for update frame
         :param frame: the frame
         :param frameSeq: the frame sequence
+        :param shmSlot: the shared memory slot if the frame is a view on it, the slot may be
+        overwritten by IOService at any time
         :return:
         """
         self.__gameFrame = frame
+        self.__encodedFrame = None
+        self.__shmSlot = shmSlot
+        if frameSeq is None:
+            self.__frameSeq += 1
+        else:
+            self.__frameSeq = frameSeq
+
+    def SetEncodedGameFrame(self, frameBuff, frameEncode, height=0, width=0, frameSeq=None):
+        """
+        Set the current frame with encoded data, the frame is decoded when it is first got
+        :param frameBuff: the encoded frame data
+        :param frameEncode: the frame encode, see EIMAGEENCODEENUM
+        :param height: the frame height, needed by raw encodes
+        :param width: the frame width, needed by raw encodes
+        :param frameSeq: the frame sequence
+        :return:
+        """
+        self.__gameFrame = None
+        self.__encodedFrame = (frameBuff, frameEncode, height, width)
+        self.__shmSlot = -1
         if frameSeq is None:
             self.__frameSeq += 1
         else:
@@ -8,6 +8,7 @@ For full details, please refer to the file "LICENSE.txt" which is provided as pa
 Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
 """
 
+import bisect
 import json
 import logging
 import os
@@ -35,6 +36,9 @@ class ResultManager(object):
     """
     def __init__(self):
         self.__enable = False
+        # the video keeps one frame per interval of the video FPS, the other frames are not decoded or copied
+        self.__videoFrameInterval = 0
+        self.__lastVideoFrameTime = 0
         self.__frameQueue = queue.Queue(maxsize=100)
         self.__actionQueue = queue.Queue()
         self.__resultThread = ResultThread(self.__frameQueue, self.__actionQueue)
@@ -49,6 +53,8 @@ class ResultManager(object):
         """
         self.__resultThread.Initialize(taskID, resultOutputPath, context)
         self.__enable = context['enable']
+        if context['fps'] > 0:
+            self.__videoFrameInterval = 1.0 / context['fps']
         self.__resultThread.setDaemon(True)
         if self.__enable:
             self.__resultThread.start()
@@ -74,19 +80,42 @@ class ResultManager(object):
         """
         return self.__resultThread.UpdateContext(testID, taskID, gameID, gameVersion)
 
-    def SavingVideo(self, frame, frameSeq, AIFlag=False):
+    def IsEnable(self):
+        """
+        Whether the result generation is enabled
+        :return: True or false
+        """
+        return self.__enable
+
+    def NeedVideoFrame(self):
+        """
+        Whether the video keeps the frame received now, frames are sampled at the video FPS
+        :return: True or false
+        """
+        if not self.__enable:
+            return False
+
+        return time.time() - self.__lastVideoFrameTime >= self.__videoFrameInterval and \
+            not self.__frameQueue.full()
+
+    def SavingVideo(self, frame, frameSeq, AIFlag=False, copy=False):
         """
         Save one frame into the video
         :param frame: GameFrame
         :param frameSeq: Frame Sequence
         :param AIFlag: Flag indicates whether in AI or UI
+        :param copy: copy the frame before queueing, for frames which may be overwritten later
         :return:
         """
         if not self.__enable:
             return True
 
+        if copy:
+            frame = frame.copy()
+
         try:
             self.__frameQueue.put_nowait((frame, frameSeq, AIFlag))
+            self.__lastVideoFrameTime = time.time()
             return True
         except queue.Full:
             LOG.warning('Result saving video failed, frameQueue Full')
@@ -266,7 +295,11 @@ class ResultThread(threading.Thread):
 
         try:
             actionData = msgpack.unpackb(actionBuff, object_hook=mn.decode, encoding='utf-8')
-            actionData['video_frame_seq'] = self.__frameSeqList.index(frameSeq)
+            # the video only keeps sampled frames, the action is on the last kept frame before it
+            videoFrameSeq = bisect.bisect_right(self.__frameSeqList, frameSeq) - 1
+            if videoFrameSeq < 0:
+                raise ValueError('frameSeq[{}] before the video'.format(frameSeq))
+            actionData['video_frame_seq'] = videoFrameSeq
         except ValueError:
             LOG.error('Wrong action frameSeq[{}]'.format(frameSeq))
             return False
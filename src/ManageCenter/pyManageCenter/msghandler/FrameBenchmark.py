@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Tencent is pleased to support the open source community by making GameAISDK available.
+
+This source code file is licensed under the GNU General Public License Version 3.
+For full details, please refer to the file "LICENSE.txt" which is provided as part of this source code package.
+
+Copyright (C) 2020 THL A29 Limited, a Tencent company.  All rights reserved.
+
+Per frame latency of the MC frame receive path (_OnFrameMsg) for shared memory, raw and JPEG frames, with result
+saving disabled and enabled. Frames arrive at the given FPS, so the video of ResultManager samples them as it does
+in MC. With result saving enabled the result thread writes the video into a temporary directory.
+Run from src/ManageCenter/pyManageCenter: python -m msghandler.FrameBenchmark
+"""
+
+import argparse
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from protocol import common_pb2
+from gamemanager.GameManager import GameManager
+from gamemanager.ResultManager import ResultManager
+from util.FrameStore import FrameStore
+
+from .MsgHandler import MsgHandler
+
+BENCHMARK_SHM_NAME = 'mc_frame_benchmark'
+
+
+def _CreateResultManager(enable, videoFPS):
+    context = {'enable': enable, 'fps': videoFPS, 'result_url': '', 'state_url': '', 'token': '',
+               'api_user': 'ai_sdk', 'rtx_user': 'ai_sdk', 'timeout': 3600}
+    resultMgr = ResultManager()
+    resultMgr.Initialize('benchmark', tempfile.mkdtemp(prefix='mc_frame_benchmark_'), context)
+    return resultMgr
+
+
+def _CreateFrameMsg(frame, frameSeq, frameStore, mode):
+    msg = common_pb2.tagMessage()
+    msg.eMsgID = common_pb2.MSG_SRC_IMAGE_INFO
+    msg.stSrcImageInfo.uFrameSeq = frameSeq
+    msg.stSrcImageInfo.nHeight = frame.shape[0]
+    msg.stSrcImageInfo.nWidth = frame.shape[1]
+    if mode == 'shm':
+        msg.stSrcImageInfo.bShmFrame = True
+        msg.stSrcImageInfo.nShmSlot = frameStore.Write(frameSeq, frame)
+    elif mode == 'jpeg':
+        msg.stSrcImageInfo.eImageEncode = common_pb2.PB_IMAGE_ENCODE_JPEG
+        msg.stSrcImageInfo.byImageData = cv2.imencode('.jpg', frame)[1].tobytes()
+    else:
+        msg.stSrcImageInfo.eImageEncode = common_pb2.PB_IMAGE_ENCODE_RAW
+        msg.stSrcImageInfo.byImageData = frame.tobytes()
+    return msg
+
+
+def RunBenchmark(mode, resultEnable, frameNum, frameFPS, videoFPS, height, width):
+    """
+    Latency in us of _OnFrameMsg for each frame, the msgs are created outside of the measurement
+    """
+    frameStore = FrameStore(BENCHMARK_SHM_NAME, slotSize=height * width * 3)
+    frameStore.Create()
+    resultMgr = _CreateResultManager(resultEnable, videoFPS)
+    msgHandler = MsgHandler(None, GameManager(), None, resultMgr, None, None, frameStore=frameStore)
+
+    frame = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    latencyList = list()
+    try:
+        for frameSeq in range(1, frameNum + 1):
+            beginTime = time.time()
+            msg = _CreateFrameMsg(frame, frameSeq, frameStore, mode)
+            startTime = time.time()
+            msgHandler._OnFrameMsg(msg, None)
+            latencyList.append((time.time() - startTime) * 1000000)
+            time.sleep(max(0, 1.0 / frameFPS - (time.time() - beginTime)))
+    finally:
+        frameStore.Finish()
+
+    return np.array(latencyList)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MC frame receive path benchmark')
+    parser.add_argument('--frames', type=int, default=150, help='number of frames of each case')
+    parser.add_argument('--fps', type=int, default=30, help='rate of the received frames')
+    parser.add_argument('--video-fps', type=int, default=5, help='FPS of the result video, as in MC.ini')
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--width', type=int, default=1280)
+    args = parser.parse_args()
+
+    for mode in ('shm', 'raw', 'jpeg'):
+        for resultEnable in (False, True):
+            latency = RunBenchmark(mode, resultEnable, args.frames, args.fps, args.video_fps,
+                                   args.height, args.width)
+            print('{} frame, result saving {}: avg {:.2f} us, p50 {:.2f} us, p99 {:.2f} us per frame'.format(
+                mode, 'enabled' if resultEnable else 'disabled', latency.mean(), np.percentile(latency, 50),
+                np.percentile(latency, 99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,13 +23,16 @@ class MsgHandler(object):
     """
     MC MsgHandler implementation for handling all messages
     """
-    def __init__(self, commMgr, gameMgr, serviceMgr, resultMgr, resultType, runType):
+    def __init__(self, commMgr, gameMgr, serviceMgr, resultMgr, resultType, runType, frameStore=None,
+                 creditMgr=None):
         self.__resultType = resultType
         self.__runType = runType
         self.__commMgr = commMgr
         self.__gameMgr = gameMgr
         self.__serviceMgr = serviceMgr
         self.__resultMgr = resultMgr
+        self.__frameStore = frameStore
+        self.__creditMgr = creditMgr
         self.__msgDict = {}
         self.__source_info = None
 
@@ -54,19 +57,20 @@ class MsgHandler(object):
         self._RegisterMsgHandler(common_pb2.MSG_IM_TRAIN_STATE, self._OnIMTrainState)
         self._RegisterMsgHandler(common_pb2.MSG_PROJECT_SOURCE, self._get_source_info)
         self._RegisterMsgHandler(common_pb2.MSG_PROJECT_SOURCE_RES, self._get_source_response)
+        self._RegisterMsgHandler(common_pb2.MSG_FRAME_CREDIT, self._OnFrameCredit)
         return True
 
     def Update(self):
         """
         Update the msg handler, handle the msgs from IO, agentai, GameReg, UI
-        :return:
+        :return: True if any msg received
         """
         # Recv the message
         msgBuffList = self.__commMgr.RecvMsg()
 
         # if recv nothing, then exit
         if len(msgBuffList) == 0:
-            return
+            return False
 
         # parse the message and call handler function
         for (addr, msgBuff) in msgBuffList:
@@ -79,6 +83,7 @@ class MsgHandler(object):
                 handleFunc(msg, addr)
             else:
                 LOG.warning('Unhandled MsgID[{0}]'.format(msg.eMsgID))
+        return True
 
     def _RegisterMsgHandler(self, msgID, msgFuncHandler):
         self.__msgDict[msgID] = msgFuncHandler
@@ -192,16 +197,46 @@ class MsgHandler(object):
         height = msg.stSrcImageInfo.nHeight
         width = msg.stSrcImageInfo.nWidth
 
-        imgdata = np.fromstring(msg.stSrcImageInfo.byImageData, np.uint8)
-        shape = (height, width, 3)
-        gameFrame = np.reshape(imgdata, shape)
-        LOG.debug('recv frame data, frameIndex={}'.format(frameSeq))
+        isShmFrame = msg.stSrcImageInfo.bShmFrame
+        frameEncode = msg.stSrcImageInfo.eImageEncode
+        if isShmFrame:
+            gameFrame = self._ReadShmFrame(msg.stSrcImageInfo.nShmSlot, frameSeq)
+            if gameFrame is None:
+                return
+            self.__gameMgr.SetGameFrame(gameFrame, frameSeq, msg.stSrcImageInfo.nShmSlot)
+        elif frameEncode == common_pb2.PB_IMAGE_ENCODE_RAW:
+            # view on the message buffer, no copy
+            imgdata = np.frombuffer(msg.stSrcImageInfo.byImageData, np.uint8)
+            shape = (height, width, 3)
+            gameFrame = np.reshape(imgdata, shape)
+            self.__gameMgr.SetGameFrame(gameFrame, frameSeq)
+        else:
+            # decoded on the first GetGameFrame, frames neither forwarded nor kept by the video are never decoded
+            self.__gameMgr.SetEncodedGameFrame(msg.stSrcImageInfo.byImageData, frameEncode,
+                                               height, width, frameSeq)
+        LOG.debug('recv frame data, frameIndex={}, encode={}'.format(frameSeq, frameEncode))
         jsonData = msg.stSrcImageInfo.strJsonData
         LOG.debug('recv json data={}'.format(jsonData))
 
-        self.__gameMgr.SetGameFrame(gameFrame, frameSeq)
         self.__gameMgr.SetGameData(jsonData, frameSeq)
-        self.__resultMgr.SavingVideo(gameFrame, frameSeq, self.__gameMgr.GameStarted())
+        if self.__resultMgr.NeedVideoFrame():
+            gameFrame = self.__gameMgr.GetGameFrame()
+            if gameFrame is not None:
+                # the shared memory slot will be reused by IOService, the video thread needs its own copy
+                self.__resultMgr.SavingVideo(gameFrame, frameSeq, self.__gameMgr.GameStarted(), copy=isShmFrame)
+
+    def _ReadShmFrame(self, slot, frameSeq):
+        if self.__frameStore is None:
+            LOG.error('Recv shared memory frame, but FrameStore is not configured')
+            return None
+
+        if not self.__frameStore.IsOpened() and not self.__frameStore.Open():
+            return None
+
+        gameFrame = self.__frameStore.Read(slot, frameSeq)
+        if gameFrame is None:
+            LOG.warning('Shared memory slot[{0}] already overwritten, drop frame[{1}]'.format(slot, frameSeq))
+        return gameFrame
 
     def _OnAIAction(self, msg, addr):
         ret, _ = self.__serviceMgr.IsServiceAlreadyRegistered(addr, SERVICE_TYPE_AGENT)
@@ -392,6 +427,14 @@ class MsgHandler(object):
 
         self.__resultMgr.UpdateContext(testID=testID, gameID=nGameID, gameVersion=strGameVersion)
 
+    def _OnFrameCredit(self, msg, addr):
+        if self.__creditMgr is None:
+            return
+
+        frameSeq = msg.stFrameCredit.uFrameSeq
+        LOG.debug('recv frame credit from addr[%s], frameIndex=%s', addr, frameSeq)
+        self.__creditMgr.Release(frameSeq)
+
     def _OnIMTrainState(self, msg, addr):
         progress = msg.stIMTrainState.nProgress
         LOG.info('Recv MSG_IM_TRAIN_STATE msg, progress: {}'.format(progress))
@@ -450,6 +493,63 @@ class MsgHandler(object):
         LOG.info('send frame data, frameIndex={1} to addr[{0}]'.format(addr, frameSeq))
         self.__commMgr.SendTo(addr, msgBuff)
 
+    def SendGameFrameMsgToAll(self, addrList, gameFrame, gameData, frameSeq):
+        """
+        Send GameFrame To all the services, the message is serialized only once
+        :param addrList: the addrs of the services
+        :param gameFrame: GameFrame
+        :param gameData: GameData extend
+        :param frameSeq: FrameSeq
+        :return: False if the frame is dropped, because its shared memory slot was overwritten
+        """
+        if not addrList:
+            return True
+
+        msgBuff = self._CreateSrcImgMsg(frameSeq, gameFrame, gameData)
+        if not self.IsGameFrameValid(frameSeq):
+            return False
+
+        LOG.info('send frame data, frameIndex={1} to addrs{0}'.format(addrList, frameSeq))
+        self.__commMgr.SendToAll(addrList, msgBuff)
+        return True
+
+    def SendUIAPIStateMsgToAll(self, addrList, gameFrame, frameSeq, stucked=False):
+        """
+        Send UIAPI State To all the services, the message is serialized only once
+        :param addrList: the addrs of the services
+        :param gameFrame: GameFrame
+        :param frameSeq: FrameSeq
+        :param stucked: whether the UI stucked
+        :return: False if the frame is dropped, because its shared memory slot was overwritten
+        """
+        if not addrList or gameFrame is None:
+            return True
+
+        msgBuff = self._CreateUIAPIStateMsg(self._GetUIAPIState(stucked), frameSeq, gameFrame,
+                                            UI_SCREEN_ORI_LANDSCAPE, self.__gameMgr.GetGameState())
+        if not self.IsGameFrameValid(frameSeq):
+            return False
+
+        LOG.info('Send UIAPIState to {0}, frame_seq[{1}]'.format(addrList, frameSeq))
+        self.__commMgr.SendToAll(addrList, msgBuff)
+        return True
+
+    def IsGameFrameValid(self, frameSeq):
+        """
+        Whether the current frame is still the frame of frameSeq, call it after the frame is serialized.
+        A frame on the shared memory is invalid once IOService overwrites its slot.
+        :param frameSeq: FrameSeq
+        :return: True or false
+        """
+        slot = self.__gameMgr.GetShmSlot()
+        if slot < 0 or self.__frameStore is None:
+            return True
+
+        if not self.__frameStore.IsValid(slot, frameSeq):
+            LOG.warning('Shared memory slot[{0}] overwritten while sending, drop frame[{1}]'.format(slot, frameSeq))
+            return False
+        return True
+
     def SendUIAPIStateMsgTo(self, addr, gameFrame, frameSeq, stucked=False):
         """
         Send UIAPI State To addr(service)
@@ -459,11 +559,7 @@ class MsgHandler(object):
         :param stucked: whether the UI stucked
         :return:
         """
-        if stucked:
-            uiAPIState = common_pb2.PB_UI_STATE_STUCK
-        else:
-            uiAPIState = common_pb2.PB_UI_STATE_NORMAL
-
+        uiAPIState = self._GetUIAPIState(stucked)
         gameState = self.__gameMgr.GetGameState()
         screenOri = UI_SCREEN_ORI_LANDSCAPE
         if gameFrame is None:
@@ -474,6 +570,12 @@ class MsgHandler(object):
         msgBuff = self._CreateUIAPIStateMsg(uiAPIState, frameSeq, gameFrame, screenOri, gameState)
         self.__commMgr.SendTo(addr, msgBuff)
 
+    @staticmethod
+    def _GetUIAPIState(stucked):
+        if stucked:
+            return common_pb2.PB_UI_STATE_STUCK
+        return common_pb2.PB_UI_STATE_NORMAL
+
     def SendAIServiceStateToIO(self, serviceStateResult):
         """
         Send Service monitor State To IO
@@ -498,6 +600,10 @@ class MsgHandler(object):
         Send UIGameStart To agentai
         :return:
         """
+        # the results of the frames sent in the last round will never come
+        if self.__creditMgr is not None:
+            self.__creditMgr.Reset()
+
         msgBuff = self._CreateUIGameStartMsg()
 
         addrList = self.__serviceMgr.GetAllServiceAddr(serviceType=SERVICE_TYPE_AGENT)